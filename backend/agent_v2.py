@@ -1,12 +1,33 @@
 #Competencies Agent
 from typing import Dict, List, Any, Optional
 import os
+import csv
+import json
+import heapq
+import hashlib
+import argparse
+import tempfile
+import threading
+import contextvars
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
 from datetime import datetime
-from azure.communication.email import EmailClient
-from langchain_openai import AzureChatOpenAI
 from pydantic import BaseModel
+from azure.cosmos import exceptions
 from cosmos_db import CosmosDBManager  # Import the CosmosDBManager
+from cosmos_telemetry import LEDGER, caller_tag
+from tracing import TRACER, new_run_id, write_report, print_report
+from run_journal import RunJournal, JOURNAL_BACKENDS
+from hr_snapshot import DEFAULT_SNAPSHOT_DIR, HRSnapshot, snapshots_available
+from notifications import NotificationDispatcher, notification_status_patch, render_notification
+from work_leases import (DEFAULT_LEASE_STORE, DEFAULT_LEASE_TTL_SECONDS, LeaseKeeper, claim_shards,
+                         default_worker_id, open_lease_store, rollup, shard_for)
+from llm_scheduler import LLMRequestScheduler, estimate_prompt_tokens
+from llm_cache import LLMResponseCache
+from competency_rules import derive_direct_competencies, missing_pse_columns, normalize
+from prompt_builder import build_messages, build_batch_messages, render_employee_profile
+from recommendation_payload import RECOMMENDATIONS_SCHEMA_VERSION, build_recommendations_payload
 
 # Enable/disable email notifications
 ENABLE_EMAIL_NOTIFICATIONS = False
@@ -15,6 +36,19 @@ ENABLE_EMAIL_NOTIFICATIONS = False
 COSMOS_DATABASE_ID = "test_db"
 COSMOS_CONTAINER_ID = "people"
 
+# Version of the analysis prompt and output schema. Bump it whenever either changes so
+# that stored input fingerprints no longer match and every employee is re-analyzed.
+PROMPT_VERSION = "3"
+
+# Number of employees processed concurrently (analyze -> store -> notify)
+MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "8"))
+
+# Batch mode: employees per batched LLM request (1 disables batching), the largest profile
+# (in prompt tokens) that may be batched, and the completion token cap of a batched request
+LLM_BATCH_SIZE = int(os.getenv("AGENT_LLM_BATCH_SIZE", "1"))
+BATCH_PROFILE_MAX_TOKENS = int(os.getenv("AGENT_BATCH_PROFILE_MAX_TOKENS", "800"))
+LLM_BATCH_MAX_TOKENS = int(os.getenv("AGENT_LLM_BATCH_MAX_TOKENS", "12000"))
+
 
 class CompetencyRecommendation(BaseModel):
     """Represents a single competency recommendation with confidence, level, and reasoning"""
@@ -30,6 +64,17 @@ class CompetencyAnalysis(BaseModel):
     new_competencies: List[CompetencyRecommendation]
 
 
+class EmployeeAnalysisResult(BaseModel):
+    """One employee's analysis inside a batched LLM response"""
+    employee_id: str
+    analysis: CompetencyAnalysis
+
+
+class BatchCompetencyAnalysis(BaseModel):
+    """Analysis output for several employees analyzed in one LLM request"""
+    results: List[EmployeeAnalysisResult]
+
+
 class EmployeeCompetencyRecord(BaseModel):
     """Record to be stored in Cosmos DB for each employee analysis"""
     id: str  # employee_id for the document ID
@@ -42,22 +87,65 @@ class EmployeeCompetencyRecord(BaseModel):
     notification_timestamp: Optional[str] = None
     approved: bool = False
     approved_timestamp: Optional[str] = None
+    input_fingerprint: Optional[str] = None  # Hash of the analysis inputs, see compute_input_fingerprint
+    prompt_tokens: Optional[int] = None  # Prompt size sent to the LLM (0 when the rules resolved everything)
+    recommendations_payload: Optional[str] = None  # Serialized API response, see recommendation_payload.py
+    recommendations_schema_version: Optional[int] = None
+
+
+# Maximum completion tokens per analysis (also counted against the TPM quota)
+LLM_MAX_TOKENS = int(os.getenv("AOAI_MAX_TOKENS", "1500"))
+LLM_TEMPERATURE = 0
+
+# LLM and email clients, built on first use by get_llm() and get_email_client() so that importing
+# this module needs no Azure configuration (tests and benchmarks may assign their own)
+llm = None
+email_client = None
+_clients_lock = threading.Lock()
+
+def get_llm():
+    """The AzureChatOpenAI client, created from the AOAI_* environment variables on first use."""
+    global llm
+    if llm is None:
+        with _clients_lock:
+            if llm is None:
+                # langchain_openai (with openai) is the largest import of the agent; only LLM calls need it
+                from langchain_openai import AzureChatOpenAI
+                llm = AzureChatOpenAI(
+                    azure_deployment=os.getenv("AOAI_DEPLOYMENT"),
+                    api_version="2024-05-01-preview",
+                    temperature=LLM_TEMPERATURE,
+                    max_tokens=LLM_MAX_TOKENS,   # Adjust as needed
+                    timeout=None,
+                    max_retries=0,   # Retries and 429 backoff are handled by llm_scheduler
+                    api_key=os.getenv("AOAI_KEY"),
+                    azure_endpoint=os.getenv("AOAI_ENDPOINT")
+                )
+    return llm
+
+def get_email_client():
+    """The Azure Communication Services EmailClient, created on first use.
 
+    :raises ValueError: If COMMUNICATION_SERVICES_CONNECTION_STRING is not set
+    """
+    global email_client
+    if email_client is None:
+        with _clients_lock:
+            if email_client is None:
+                connection_string = os.environ.get("COMMUNICATION_SERVICES_CONNECTION_STRING")
+                if not connection_string:
+                    raise ValueError("COMMUNICATION_SERVICES_CONNECTION_STRING is not set")
+                from azure.communication.email import EmailClient
+                email_client = EmailClient.from_connection_string(connection_string)
+    return email_client
 
-# Initialize the LLM using environment variables (ensure these are set)
-llm = AzureChatOpenAI(
-    azure_deployment=os.getenv("AOAI_DEPLOYMENT"),
-    api_version="2024-05-01-preview",
-    temperature=0,
-    max_tokens=1500,   # Adjust as needed
-    timeout=None,
-    max_retries=2,
-    api_key=os.getenv("AOAI_KEY"),
-    azure_endpoint=os.getenv("AOAI_ENDPOINT")
-)
+# Keeps concurrent analyze_employee calls within the deployment's RPM/TPM quota
+llm_scheduler = LLMRequestScheduler()
+
+# Structured results of previous identical requests (shared across runs and worker processes)
+llm_cache = LLMResponseCache()
 
 # Azure Communication Services
-email_client = EmailClient.from_connection_string(os.environ.get("COMMUNICATION_SERVICES_CONNECTION_STRING"))
 SENDER_EMAIL = os.getenv("SENDER_EMAIL")
 
 # CSV File Paths
@@ -65,43 +153,82 @@ EMPLOYEES_WORKDAY_CSV = "D:/data/dxc/employee_data_workday.csv"
 PSE_DATA_CSV = "D:/data/dxc/employee_data_pse.csv"
 APPROVED_VALUES_CSV = "D:/data/dxc/approved_values.csv"
 
+# Snapshot of the parsed CSV files, reused while they are unchanged (see hr_snapshot.py)
+HR_SNAPSHOT_DIR = DEFAULT_SNAPSHOT_DIR
+
+# Rows per chunk when streaming the Workday/PSE exports (--stream)
+STREAM_CHUNK_SIZE = int(os.getenv("AGENT_STREAM_CHUNK_SIZE", "20000"))
+
+# Directory for run reports (and exported spans)
+AGENT_REPORT_DIR = os.getenv("AGENT_REPORT_DIR", "run_reports")
+
+# Maximum number of employees to process per run (for testing purposes)
+MAX_EMPLOYEES = 3
+
+# Checkpoint journal used by --resume: "file", "cosmos" (control document) or "off"
+AGENT_JOURNAL = os.getenv("AGENT_JOURNAL", "file")
+
+# Attempts to store an analysis while the employee's record keeps changing (decisions saved by the API)
+STORE_MAX_ATTEMPTS = 3
+
 # -------------------------------
 # CSV Helper Functions
 # -------------------------------
+# Columns read from the Workday export; everything is read as str so IDs keep their exact form
+EMPLOYEE_COLUMNS = ['employee_id', 'name', 'email', 'competencies', 'certifications', 'cloud_skills']
+
+def _split_list_column(series, count):
+    """Split a column of comma separated values into one list of stripped strings per row."""
+    values = [[] for _ in range(count)]
+    items = series.str.split(',').explode().dropna()
+    for position, item in zip(items.index.tolist(), items.str.strip().tolist()):
+        values[position].append(item)
+    return values
+
+def _split_competencies_column(series, count):
+    """Split "skill1:level1,skill2:level2" strings into one {skill: level} dict per row."""
+    values = [{} for _ in range(count)]
+    items = series.str.split(',').explode().dropna()
+    for position, item in zip(items.index.tolist(), items.tolist()):
+        skill, separator, level = item.partition(':')
+        if separator:
+            values[position][skill.strip()] = level.strip()
+    return values
+
+def _parse_employees_frame(df):
+    """Convert a Workday DataFrame into the employee dicts used by analyze_employee."""
+    df = df.reset_index(drop=True)
+    count = len(df)
+    empty = pd.Series([None] * count, dtype=object)
+    competencies = _split_competencies_column(df['competencies'] if 'competencies' in df else empty, count)
+    certifications = _split_list_column(df['certifications'] if 'certifications' in df else empty, count)
+    cloud_skills = _split_list_column(df['cloud_skills'] if 'cloud_skills' in df else empty, count)
+
+    return [
+        {
+            'employee_id': employee_id,
+            'name': name,
+            'email': email,
+            'competencies': employee_competencies,
+            'certifications': employee_certifications,
+            'cloud_skills': employee_cloud_skills
+        }
+        for employee_id, name, email, employee_competencies, employee_certifications, employee_cloud_skills in zip(
+            df['employee_id'].tolist(), df['name'].tolist(), df['email'].tolist(),
+            competencies, certifications, cloud_skills
+        )
+    ]
+
+def _load_employees_csv(file_path):
+    df = pd.read_csv(file_path, dtype=str, usecols=lambda column: column in EMPLOYEE_COLUMNS)
+    
+    # Competencies are "skill1:level1,skill2:level2"; certifications and cloud_skills are comma separated
+    return _parse_employees_frame(df)
+
 def read_employees_csv(file_path=EMPLOYEES_WORKDAY_CSV):
     """Read employee data from CSV file"""
     try:
-        df = pd.read_csv(file_path)
-        
-        # Process the DataFrame to handle complex columns
-        employees = []
-        for _, row in df.iterrows():
-            # Convert competencies string to dictionary (assuming format like "skill1:level1,skill2:level2")
-            competencies = {}
-            if pd.notna(row.get('competencies')):
-                for comp in row['competencies'].split(','):
-                    if ':' in comp:
-                        skill, level = comp.split(':', 1)
-                        competencies[skill.strip()] = level.strip()
-            
-            # Convert certifications and cloud_skills to lists
-            certifications = []
-            if pd.notna(row.get('certifications')):
-                certifications = [cert.strip() for cert in row['certifications'].split(',')]
-                
-            cloud_skills = []
-            if pd.notna(row.get('cloud_skills')):
-                cloud_skills = [skill.strip() for skill in row['cloud_skills'].split(',')]
-            
-            employee = {
-                'employee_id': row['employee_id'],
-                'name': row['name'],
-                'email': row['email'],
-                'competencies': competencies,
-                'certifications': certifications,
-                'cloud_skills': cloud_skills
-            }
-            employees.append(employee)
+        employees = _load_employees_csv(file_path)
             
         print(f"Read {len(employees)} employees from CSV")
         return employees
@@ -109,24 +236,34 @@ def read_employees_csv(file_path=EMPLOYEES_WORKDAY_CSV):
         print(f"Error reading employees CSV: {e}")
         return []
 
+def _group_pse_frame(df):
+    """Group PSE rows into {employee_id: [project dict, ...]} preserving file order."""
+    records = df.to_dict('records')
+    positions_by_employee = df.groupby('employee_id', sort=False).indices
+    return {
+        employee_id: [records[position] for position in positions]
+        for employee_id, positions in positions_by_employee.items()
+    }
+
+def _warn_missing_pse_columns(columns, file_path):
+    """Warn when a PSE export lacks the columns the competency rules match on."""
+    missing = missing_pse_columns(columns)
+    if missing:
+        print(f"WARNING: PSE file {file_path} has no {', '.join(' / '.join(names) for names in missing.values())} column; "
+              f"those projects are analyzed by the LLM from their other fields")
+
+def _load_pse_data_csv(file_path):
+    # Read every column as str so employee_id matches the Workday export exactly
+    df = pd.read_csv(file_path, dtype=str)
+    _warn_missing_pse_columns(df.columns, file_path)
+    
+    # Group the PSE data by employee_id
+    return _group_pse_frame(df)
+
 def read_pse_data_csv(file_path=PSE_DATA_CSV):
     """Read PSE (Project System of Engagement) data from CSV file"""
     try:
-        df = pd.read_csv(file_path)
-        
-        # Group the PSE data by employee_id
-        grouped_data = {}
-        
-        for _, row in df.iterrows():
-            employee_id = row['employee_id']
-            
-            # Initialize the list for this employee if not already present
-            if employee_id not in grouped_data:
-                grouped_data[employee_id] = []
-            
-            # Convert row to dict and append to the employee's project list
-            project_data = row.to_dict()
-            grouped_data[employee_id].append(project_data)
+        grouped_data = _load_pse_data_csv(file_path)
         
         print(f"Read PSE data for {len(grouped_data)} employees")
         return grouped_data
@@ -134,104 +271,375 @@ def read_pse_data_csv(file_path=PSE_DATA_CSV):
         print(f"Error reading PSE data CSV: {e}")
         return {}
 
+def _load_approved_values_csv(file_path):
+    df = pd.read_csv(file_path)
+    
+    approved_competencies = df['approved_competency'].dropna().tolist() if 'approved_competency' in df.columns else []
+    
+    return {
+        "approved_competencies": approved_competencies
+    }
+
 def read_approved_values_csv(file_path=APPROVED_VALUES_CSV):
     """Read approved competencies from CSV file"""
     try:
-        df = pd.read_csv(file_path)
-        
-        approved_competencies = df['approved_competency'].dropna().tolist() if 'approved_competency' in df.columns else []
-        
-        approved_values = {
-            "approved_competencies": approved_competencies
-        }
+        approved_values = _load_approved_values_csv(file_path)
         
-        print(f"Read {len(approved_competencies)} approved competencies")
+        print(f"Read {len(approved_values['approved_competencies'])} approved competencies")
         return approved_values
     except Exception as e:
         print(f"Error reading approved values CSV: {e}")
         return {"approved_competencies": []}
 
+def load_hr_inputs(employees_csv=EMPLOYEES_WORKDAY_CSV, pse_csv=PSE_DATA_CSV, approved_values_csv=APPROVED_VALUES_CSV,
+                   snapshot_dir=HR_SNAPSHOT_DIR, rebuild_snapshot=False):
+    """
+    Return (employees, pse_data, approved_values, snapshot) for the three CSV inputs.
+
+    With a `snapshot_dir` and pyarrow installed they come from the memory-mapped snapshot of the
+    files (see hr_snapshot.py), which is rebuilt when missing, stale or `rebuild_snapshot` is set;
+    PSE rows are then converted one employee at a time, on lookup. Otherwise, or when the
+    snapshot cannot be used, the CSV files are parsed and `snapshot` is None.
+    """
+    if snapshot_dir and not snapshots_available():
+        print("pyarrow is not installed: reading the CSV files without a snapshot")
+    elif snapshot_dir:
+        def parse():
+            return (_load_employees_csv(employees_csv), _load_pse_data_csv(pse_csv),
+                    _load_approved_values_csv(approved_values_csv))
+        
+        try:
+            sources = {"employees": employees_csv, "pse": pse_csv, "approved_values": approved_values_csv}
+            snapshot = HRSnapshot.load(sources, parse, snapshot_dir, rebuild=rebuild_snapshot)
+            employees, pse_data, approved_values = snapshot.employees(), snapshot.projects(), snapshot.approved_values()
+            if not snapshot.rebuilt:
+                _warn_missing_pse_columns(pse_data.columns, pse_csv)
+            print(f"{'Built' if snapshot.rebuilt else 'Opened'} HR snapshot {snapshot.snapshot_id[:12]} in {snapshot.directory}")
+            print(f"Read {len(employees)} employees, PSE data for {len(pse_data)} employees and "
+                  f"{len(approved_values['approved_competencies'])} approved competencies from the snapshot")
+            return employees, pse_data, approved_values, snapshot
+        except Exception as e:
+            print(f"Could not use the HR snapshot, reading the CSV files: {e}")
+    
+    return (read_employees_csv(employees_csv), read_pse_data_csv(pse_csv),
+            read_approved_values_csv(approved_values_csv), None)
+
+# -------------------------------
+# Streaming CSV Helpers
+# -------------------------------
+# Streaming mode requires both exports sorted by employee_id (as strings, ascending).
+# Use sort_csv_by_employee_id to externally sort an export that is not.
+
+def iter_employees_csv(file_path=EMPLOYEES_WORKDAY_CSV, chunksize=STREAM_CHUNK_SIZE):
+    """Yield employee dicts from the Workday export, reading `chunksize` rows at a time."""
+    with pd.read_csv(file_path, dtype=str, usecols=lambda column: column in EMPLOYEE_COLUMNS, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield from _parse_employees_frame(chunk)
+
+def iter_pse_groups_csv(file_path=PSE_DATA_CSV, chunksize=STREAM_CHUNK_SIZE):
+    """
+    Yield (employee_id, [project dict, ...]) from a PSE export sorted by employee_id.
+
+    Only one chunk plus the employee spanning the chunk boundary is held in memory.
+    Raises ValueError if the file is not sorted by employee_id.
+    """
+    pending_id, pending_projects = None, []
+    with pd.read_csv(file_path, dtype=str, chunksize=chunksize) as reader:
+        for index, chunk in enumerate(reader):
+            if index == 0:
+                _warn_missing_pse_columns(chunk.columns, file_path)
+            chunk = chunk[chunk['employee_id'].notna()]
+            for employee_id, projects in _group_pse_frame(chunk).items():
+                if employee_id == pending_id:
+                    pending_projects.extend(projects)
+                    continue
+                if pending_id is not None:
+                    if employee_id < pending_id:
+                        raise ValueError(f"PSE file {file_path} is not sorted by employee_id ({employee_id} after {pending_id})")
+                    yield pending_id, pending_projects
+                pending_id, pending_projects = employee_id, projects
+    if pending_id is not None:
+        yield pending_id, pending_projects
+
+def iter_employees_with_projects(employees_path=EMPLOYEES_WORKDAY_CSV, pse_path=PSE_DATA_CSV, chunksize=STREAM_CHUNK_SIZE):
+    """
+    Merge-join the sorted Workday and PSE exports, yielding (employee, [project dict, ...]).
+
+    Employees without PSE rows get an empty project list; PSE rows without a Workday
+    employee are dropped, matching the in-memory loaders.
+    """
+    pse_groups = iter_pse_groups_csv(pse_path, chunksize)
+    pse_id, pse_projects = next(pse_groups, (None, []))
+    previous_id = None
+
+    for employee in iter_employees_csv(employees_path, chunksize):
+        employee_id = employee['employee_id']
+        if previous_id is not None and employee_id < previous_id:
+            raise ValueError(f"Employees file {employees_path} is not sorted by employee_id ({employee_id} after {previous_id})")
+        previous_id = employee_id
+
+        # Skip PSE groups for employees that are not in the Workday export
+        while pse_id is not None and pse_id < employee_id:
+            pse_id, pse_projects = next(pse_groups, (None, []))
+
+        if pse_id == employee_id:
+            yield employee, pse_projects
+            pse_id, pse_projects = next(pse_groups, (None, []))
+        else:
+            yield employee, []
+
+def sort_csv_by_employee_id(file_path, output_path, chunksize=STREAM_CHUNK_SIZE, temp_dir=None):
+    """
+    Externally sort a CSV export by employee_id so it can be used in streaming mode.
+
+    Each chunk is sorted in memory and spilled to a temporary file, then the runs are
+    merged. The sort is stable, so rows of one employee keep their original order.
+    """
+    with tempfile.TemporaryDirectory(dir=temp_dir) as run_dir:
+        run_paths = []
+        header = None
+        with pd.read_csv(file_path, dtype=str, keep_default_na=False, chunksize=chunksize) as reader:
+            for index, chunk in enumerate(reader):
+                header = list(chunk.columns)
+                run_path = os.path.join(run_dir, f"run_{index}.csv")
+                chunk.sort_values('employee_id', kind='stable').to_csv(run_path, index=False)
+                run_paths.append(run_path)
+
+        if header is None:
+            raise ValueError(f"{file_path} has no rows to sort")
+
+        key_index = header.index('employee_id')
+        run_files = [open(path, newline='', encoding='utf-8') for path in run_paths]
+        try:
+            readers = []
+            for run_file in run_files:
+                reader = csv.reader(run_file)
+                next(reader)  # header
+                readers.append(reader)
+            with open(output_path, 'w', newline='', encoding='utf-8') as out:
+                writer = csv.writer(out)
+                writer.writerow(header)
+                writer.writerows(heapq.merge(*readers, key=lambda row: row[key_index]))
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+    print(f"Sorted {file_path} by employee_id into {output_path}")
+    return output_path
+
+# -------------------------------
+# Input Fingerprinting
+# -------------------------------
+def compute_input_fingerprint(employee, employee_pse_data, approved_competencies):
+    """Stable hash of everything that feeds an employee's analysis, including PROMPT_VERSION."""
+    analysis_inputs = {
+        "prompt_version": PROMPT_VERSION,
+        "employee_id": str(employee['employee_id']),
+        "name": employee['name'],
+        "competencies": employee['competencies'],
+        "certifications": employee['certifications'],
+        "cloud_skills": employee['cloud_skills'],
+        "projects": employee_pse_data,
+        "approved_competencies": approved_competencies
+    }
+    canonical = json.dumps(analysis_inputs, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+@caller_tag("load_existing_fingerprints")
+def load_existing_fingerprints(cosmos_db_manager):
+    """
+    Return {employee_id: input_fingerprint} for every stored analysis whose notification was sent.
+
+    Uses one single-partition query that projects only the two fields needed.
+    """
+    query = ("SELECT c.id, c.input_fingerprint FROM c "
+             "WHERE c.partitionKey = 'people' AND IS_DEFINED(c.input_fingerprint) AND c.notification_sent = true")
+    items = cosmos_db_manager.query_items(query, partition_key="people")
+    return {item['id']: item['input_fingerprint'] for item in items}
+
 # -------------------------------
 # Employee Analysis Function
 # -------------------------------
-def analyze_employee(employee, pse_data, approved_values):
-    """Analyze employee skills and competencies using LLM"""
-    print(f"\n{'='*50}")
-    print(f"Analyzing Employee: {employee['name']} (ID: {employee['employee_id']})")
-    print(f"{'='*50}")
-    
+def prepare_analysis(employee, pse_data, approved_values):
+    """Fingerprint the inputs and resolve direct matches by rule; the LLM part is left to the caller."""
     # Retrieve company approved competencies
     approved_competencies = approved_values.get("approved_competencies", [])
     
     # Get PSE data for this employee
     employee_pse_data = pse_data.get(employee['employee_id'], [])
     
-    # Build the system prompt
-    system_prompt = """You are a competency updater agent specializing in making sure an employee's competencies are aligned with company standards and up to date. You will be provided an employee's 
-current certifications, cloud skills, existing approved competencies, and project history (PSE data). You will also be provided the company-approved list of competencies. Please do the following:
-
-1. Analyze the employee's existing certifications, cloud skills, existing competencies listed, and project history
-2. Compare their info to the company's approved competencies list
-3. Determine which approved competencies are missing and should be added to their profile based on the information provided
-4. Look at the certifications, cloud skills, and project history. Can we glean any approved competencies from these?
-5. For each recommended competency, determine the appropriate skill level: beginner, intermediate, advanced, or expert
-
-Our goal is to closely analyze all available information and produce a comprehensive list of company-approved competencies that the employee should have on their profile.
-
-###Data Source Info###
+    with TRACER.span("rules", projects=len(employee_pse_data)) as span:
+        # Resolve direct matches (project requirements, certifications, cloud skills) without the LLM
+        rule_analysis = derive_direct_competencies(employee, employee_pse_data, approved_competencies)
+        rule_recommendations = [CompetencyRecommendation(**rec) for rec in rule_analysis["recommendations"]]
+        print(f"Rule engine derived {len(rule_recommendations)} competencies for {employee['name']}; "
+              f"{len(rule_analysis['candidate_competencies'])} candidates left for the LLM")
+        span.set_attributes(derived=len(rule_recommendations), needs_llm=rule_analysis["needs_llm"])
+        
+        return {
+            "employee": employee,
+            "employee_pse_data": employee_pse_data,
+            "input_fingerprint": compute_input_fingerprint(employee, employee_pse_data, approved_competencies),
+            "rule_analysis": rule_analysis,
+            "rule_recommendations": rule_recommendations
+        }
 
-Project history/PSE Data contains the projects the employee has worked on. Each project will have a list of the required competencies, certifications, and cloud skills. 
-If the employee has worked on a project, and the project required a competency that the employee does not have listed in their existing approved competencies, then the employee is very likely missing that competency.
+def finish_analysis(prepared, llm_result=None, prompt_tokens=0):
+    """Combine the deterministic matches with the LLM's residual recommendations (if any)."""
+    employee = prepared["employee"]
+    rule_analysis = prepared["rule_analysis"]
+    rule_recommendations = prepared["rule_recommendations"]
+    
+    if llm_result is None:
+        analysis_result = CompetencyAnalysis(
+            thought_process=rule_analysis["summary"],
+            new_competencies=rule_recommendations
+        )
+    else:
+        derived = {normalize(rec.competency) for rec in rule_recommendations}
+        held = {normalize(comp) for comp in employee['competencies']}
+        analysis_result = CompetencyAnalysis(
+            thought_process=f"{rule_analysis['summary']}\n\n{llm_result.thought_process}",
+            new_competencies=rule_recommendations + [
+                rec for rec in llm_result.new_competencies
+                if normalize(rec.competency) not in derived and normalize(rec.competency) not in held
+            ]
+        )
+    
+    return _format_analysis(employee, analysis_result, prepared["input_fingerprint"], prompt_tokens)
 
+def analyze_prepared(prepared):
+    """Run the single-employee LLM call for a prepared analysis (skipped when the rules resolved everything)."""
+    employee = prepared["employee"]
+    if not prepared["rule_analysis"]["needs_llm"]:
+        print(f"Nothing ambiguous remains for {employee['name']}; skipping the LLM call")
+        return finish_analysis(prepared)
+    
+    # Build the prompt within the token budget, compacting the project history if needed
+    with TRACER.span("prompt_build") as span:
+        prompt = build_messages(
+            employee,
+            prepared["employee_pse_data"],
+            [rec.competency for rec in prepared["rule_recommendations"]],
+            prepared["rule_analysis"]['candidate_competencies']
+        )
+        span.set_attributes(estimated_tokens=prompt["prompt_tokens"], pse_rendering=prompt["pse_rendering"])
+    print(f"Prompt: {prompt['prompt_tokens']} tokens (project history: {prompt['pse_rendering']})")
+    
+    llm_result = call_llm_structured(prompt["messages"], CompetencyAnalysis)
+    return finish_analysis(prepared, llm_result, prompt["prompt_tokens"])
 
-###Output Format###
+def analyze_employee(employee, pse_data, approved_values):
+    """Analyze employee skills and competencies: direct matches by rule, the rest using the LLM"""
+    print(f"\n{'='*50}")
+    print(f"Analyzing Employee: {employee['name']} (ID: {employee['employee_id']})")
+    print(f"{'='*50}")
+    
+    return analyze_prepared(prepare_analysis(employee, pse_data, approved_values))
 
-1. thought_process: A comprehensive analysis of the employee's skills, certifications, existing approved competencies, and project history. What skills and certifications can map to approved competencies? What can we discern from the projects they worked on?
+def analyze_employee_batch(work_items, approved_values):
+    """
+    Analyze several (employee, pse_data) work items, packing small profiles into one LLM request.
 
-2. new_competencies: <new competency> <level: beginner/intermediate/advanced/expert> <confidence value> <reasoning - how did you come to this conclusion? what data points support this?>
+    Profiles larger than BATCH_PROFILE_MAX_TOKENS, and any employee missing from (or making
+    unparseable) the batched response, fall back to single analyze calls.
 
-For each competency, include:
-- Competency name from the approved list
-- Competency level (beginner, intermediate, advanced, or expert) based on evidence from their background
-- A % confidence value (0-100). For obvious matches with the approved competencies, put 100%. For less obvious matches, put some % but be careful not to overstate the confidence.
-- Detailed reasoning that supports both the competency and the assigned level
-"""
+    :return: One entry per work item, in order: the analyze_employee result, or the Exception raised
+    """
+    approved_competencies = approved_values.get("approved_competencies", [])
+    results = [None] * len(work_items)
+    batched = []  # (index, prepared, profile)
     
-    # Format PSE data for inclusion in the prompt
-    pse_data_formatted = ""
-    if employee_pse_data:
-        pse_data_formatted = "Project History (PSE Data):\n"
-        for idx, project in enumerate(employee_pse_data, 1):
-            pse_data_formatted += f"Project {idx}:\n"
-            for key, value in project.items():
-                if key != 'employee_id':  # Skip employee_id as redundant
-                    pse_data_formatted += f"  {key}: {value}\n"
-            pse_data_formatted += "\n"
-    else:
-        pse_data_formatted = "Project History (PSE Data): No project history available\n"
+    for index, (employee, pse_data) in enumerate(work_items):
+        try:
+            prepared = prepare_analysis(employee, pse_data, approved_values)
+            if not prepared["rule_analysis"]["needs_llm"]:
+                results[index] = finish_analysis(prepared)
+                continue
+            with TRACER.span("prompt_build", batched=True) as span:
+                profile = render_employee_profile(
+                    employee,
+                    prepared["employee_pse_data"],
+                    [rec.competency for rec in prepared["rule_recommendations"]],
+                    BATCH_PROFILE_MAX_TOKENS
+                )
+                span.set_attributes(estimated_tokens=profile["tokens"], fits=profile["fits"])
+            if profile["fits"]:
+                batched.append((index, prepared, profile))
+            else:
+                print(f"Profile of {employee['name']} is too large to batch ({profile['tokens']} tokens); analyzing alone")
+                results[index] = analyze_prepared(prepared)
+        except Exception as e:
+            print(f"Error analyzing employee {employee.get('employee_id', 'N/A')}: {e}")
+            results[index] = e
     
-    # Build the user message
-    user_message = f"""### Employee Name: {employee['name']} ###
-Existing Cloud Skills: {', '.join(employee['cloud_skills'])}
-Existing Competencies:
-{chr(10).join(f"- {comp}: {level}" for comp, level in employee['competencies'].items())}
-Existing Certifications: {', '.join(employee['certifications'])}
-
-{pse_data_formatted}
-
-### Company Approved Competencies ###
-{', '.join(approved_competencies)}
-"""
+    if len(batched) == 1:
+        index, prepared, _ = batched[0]
+        batched = []
+        try:
+            results[index] = analyze_prepared(prepared)
+        except Exception as e:
+            results[index] = e
     
-    # Call the LLM
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_message}
-    ]
+    if batched:
+        prompt = build_batch_messages([profile for _, _, profile in batched], approved_competencies)
+        print(f"Batched LLM request for {len(batched)} employees: {prompt['prompt_tokens']} tokens")
+        llm_results = {}
+        try:
+            batch_result = call_llm_structured(
+                prompt["messages"],
+                BatchCompetencyAnalysis,
+                max_tokens=min(LLM_BATCH_MAX_TOKENS, LLM_MAX_TOKENS * len(batched))
+            )
+            llm_results = {str(entry.employee_id): entry.analysis for entry in batch_result.results}
+        except Exception as e:
+            print(f"Batched LLM request failed ({e}); falling back to single requests")
+        
+        shared_tokens = prompt["shared_tokens"] // len(batched)
+        for index, prepared, profile in batched:
+            employee_id = str(prepared["employee"]["employee_id"])
+            try:
+                if employee_id in llm_results:
+                    results[index] = finish_analysis(prepared, llm_results[employee_id], profile["tokens"] + shared_tokens)
+                else:
+                    results[index] = analyze_prepared(prepared)
+            except Exception as e:
+                print(f"Error analyzing employee {employee_id}: {e}")
+                results[index] = e
     
-    llm_with_structured_output = llm.with_structured_output(CompetencyAnalysis)
-    analysis_result = llm_with_structured_output.invoke(messages)
+    return results
 
+def call_llm_structured(messages, schema, max_tokens=None):
+    """Get a structured `schema` response for `messages`, from the cache or through the quota scheduler."""
+    max_tokens = max_tokens or LLM_MAX_TOKENS
+    with TRACER.span("llm", schema=schema.__name__) as span:
+        cache_key = LLMResponseCache.make_key(os.getenv("AOAI_DEPLOYMENT"), LLM_TEMPERATURE, max_tokens, schema, messages)
+        result = llm_cache.get_model(cache_key, schema)
+        span.set_attribute("cached", result is not None)
+        if result is not None:
+            print("Using cached LLM response")
+            return result
+        
+        model = get_llm()
+        if max_tokens != LLM_MAX_TOKENS:
+            model = model.model_copy(update={"max_tokens": max_tokens})
+        llm_with_structured_output = model.with_structured_output(schema, include_raw=True)
+        estimated_tokens = estimate_prompt_tokens(messages) + max_tokens
+        response = llm_scheduler.run(
+            lambda: llm_with_structured_output.invoke(messages),
+            estimated_tokens,
+            usage_getter=lambda r: getattr(r["raw"], "usage_metadata", None)
+        )
+        usage = getattr(response.get("raw"), "usage_metadata", None) or {}
+        span.set_attributes(prompt_tokens=usage.get("input_tokens"), completion_tokens=usage.get("output_tokens"))
+        if response.get("parsing_error"):
+            raise response["parsing_error"]
+        result = response["parsed"]
+        llm_cache.put_model(cache_key, result)
+        return result
+
+def _format_analysis(employee, analysis_result, input_fingerprint, prompt_tokens):
+    """Print the analysis and wrap it with its text rendering, as returned by analyze_employee."""
     # Print the raw values as requested
     print("\n===== RAW ANALYSIS VALUES =====")
     print(f"thought_process={analysis_result.thought_process}")
@@ -263,14 +671,20 @@ Recommended New Competencies:
     # Return both the formatted text and the structured object
     return {
         "text": final_analysis,
-        "structured_data": analysis_result
+        "structured_data": analysis_result,
+        "input_fingerprint": input_fingerprint,
+        "prompt_tokens": prompt_tokens
     }
 
 # -------------------------------
 # Email Notification Function
 # -------------------------------
+@caller_tag("send_notification")
 def send_notification(employee, analysis_result, cosmos_db_manager):
-    """Send an email notification to the employee with their analysis"""
+    """Send an email notification to the employee with their analysis and wait for it to be delivered.
+
+    Batch runs queue notifications on a NotificationDispatcher instead (see notifications.py).
+    """
     print(f"\n{'='*50}")
     print(f"Processing notification for Employee: {employee['name']} (ID: {employee['employee_id']})")
     print(f"{'='*50}")
@@ -282,137 +696,14 @@ def send_notification(employee, analysis_result, cosmos_db_manager):
         # Get the employee's email
         employee_email = employee['email']
         
-        # Extract text and structured data
-        analysis_text = analysis_result["text"]
-        structured_data = analysis_result["structured_data"]
-        
-        # Build the email subject and body
-        subject = f"Skills & Competencies Update Recommendation for {employee['name']}"
-        
-        # Create a more structured HTML representation of the recommendations
-        recommendations_html = ""
-        for comp in structured_data.new_competencies:
-            recommendations_html += f'''
-            <div class="recommendation">
-                <h3>{comp.competency} <span class="level">{comp.level}</span> <span class="confidence">({comp.confidence}% confidence)</span></h3>
-                <p><strong>Reasoning:</strong> {comp.reasoning}</p>
-            </div>
-            '''
-        
-        html_content = f"""
-        <html>
-            <head>
-                <style>
-                    body {{
-                        font-family: Arial, sans-serif;
-                        line-height: 1.6;
-                        padding: 20px;
-                        background-color: #f4f4f4;
-                    }}
-                    .container {{
-                        max-width: 800px;
-                        margin: auto;
-                        background: #ffffff;
-                        padding: 20px;
-                        border-radius: 8px;
-                        box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
-                    }}
-                    h1 {{
-                        font-size: 24px;
-                        color: #333333;
-                    }}
-                    h2 {{
-                        font-size: 20px;
-                        color: #444444;
-                        margin-top: 20px;
-                    }}
-                    h3 {{
-                        font-size: 18px;
-                        color: #0066cc;
-                        margin-bottom: 5px;
-                    }}
-                    .thought-process {{
-                        background: #f9f9f9;
-                        padding: 15px;
-                        border-radius: 4px;
-                        margin: 15px 0;
-                        border-left: 4px solid #dddddd;
-                    }}
-                    .recommendations {{
-                        margin-top: 20px;
-                    }}
-                    .recommendation {{
-                        background: #f0f7ff;
-                        padding: 15px;
-                        border-radius: 4px;
-                        margin-bottom: 15px;
-                        border-left: 4px solid #0066cc;
-                    }}
-                    .level {{
-                        color: #008800;
-                        font-weight: bold;
-                        margin-right: 8px;
-                    }}
-                    .confidence {{
-                        color: #666666;
-                        font-weight: normal;
-                        font-size: 16px;
-                    }}
-                    .recommendations-link {{
-                        color: #0066cc;
-                        text-decoration: none;
-                        margin-bottom: 15px;
-                        display: inline-block;
-                        padding: 10px 15px;
-                        background: #e6f0ff;
-                        border-radius: 4px;
-                    }}
-                    .recommendations-link:hover {{
-                        background: #d4e6ff;
-                        text-decoration: underline;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <h1>Skills &amp; Competencies Update Recommendation</h1>
-                    <a href="http://localhost:3000/recommendations" class="recommendations-link">View and Validate Recommendations</a>
-                    <p>Hello {employee['name']},</p>
-                    <p>Based on our analysis of your profile, we've identified potential competencies to add to your profile:</p>
-                    
-                    <h2>Recommended Competencies</h2>
-                    <div class="recommendations">
-                        {recommendations_html}
-                    </div>
-                    
-                    <h2>Analysis Details</h2>
-                    <div class="thought-process">
-                        {structured_data.thought_process}
-                    </div>
-                    
-                    <p>Best regards,<br/>HR Team</p>
-                </div>
-            </body>
-        </html>
-        """
-        
-        # Build the email message
-        email_message = {
-            "senderAddress": SENDER_EMAIL,
-            "recipients": {
-                "to": [{"address": employee_email}]
-            },
-            "content": {
-                "subject": subject,
-                "plainText": analysis_text,
-                "html": html_content
-            }
-        }
+        # Build the email message from the precompiled templates
+        email_message = render_notification(employee, analysis_result, SENDER_EMAIL)
         
         # Send the email
         try:
-            poller = email_client.begin_send(email_message)
-            result = poller.result()
+            with TRACER.span("email_send"):
+                poller = get_email_client().begin_send(email_message)
+                result = poller.result()
             print(f"Notification sent successfully to {employee_email}")
             notification_sent = True
             notification_timestamp = datetime.now().isoformat()
@@ -424,23 +715,20 @@ def send_notification(employee, analysis_result, cosmos_db_manager):
         notification_sent = True
         notification_timestamp = datetime.now().isoformat()
     
-            # Update the Cosmos DB record with notification info if sent
+    # Update the Cosmos DB record with notification info if sent
     if notification_sent:
         try:
             # Ensure employee_id is a string
             employee_id_str = str(employee['employee_id'])
             
-            # Query for the existing record
-            query = f"SELECT * FROM c WHERE c.employee_id = '{employee_id_str}'"
-            existing_records = cosmos_db_manager.query_items(query)
+            # Patch only the notification fields of the record stored under this id (a point write, no query)
+            patched_record = cosmos_db_manager.patch_item(
+                employee_id_str,
+                "people",
+                notification_status_patch(notification_timestamp)
+            )
             
-            if existing_records:
-                # Update existing record
-                record = existing_records[0]
-                record['notification_sent'] = True
-                record['notification_timestamp'] = notification_timestamp
-                
-                cosmos_db_manager.update_item(record)
+            if patched_record:
                 print(f"Updated Cosmos DB record for employee {employee['employee_id']} with notification info")
             else:
                 print(f"Warning: No Cosmos DB record found for employee {employee['employee_id']} to update notification status")
@@ -456,8 +744,26 @@ def send_notification(employee, analysis_result, cosmos_db_manager):
 # -------------------------------
 # Store Employee Analysis in Cosmos DB
 # -------------------------------
+def _carried_decisions(existing_record, new_competencies):
+    """Approval decisions of the stored record about competencies that are still recommended,
+    and whether they cover every recommendation, so a re-run keeps what was already decided."""
+    recommended = {comp['competency'].casefold(): comp['competency'] for comp in new_competencies}
+    decisions = {
+        recommended[name.casefold()]: decision
+        for name, decision in ((existing_record or {}).get('decisions') or {}).items()
+        if name.casefold() in recommended
+    }
+    approved = bool(decisions) and all(name in decisions for name in recommended.values())
+    return decisions, approved
+
+@caller_tag("store_employee_analysis")
 def store_employee_analysis(employee, analysis_result, cosmos_db_manager):
-    """Store employee analysis results in Cosmos DB"""
+    """Store employee analysis results in Cosmos DB.
+
+    The record is read first and replaced only while it still has the ETag that was read, so
+    approval decisions saved by the API meanwhile are not dropped; decisions about competencies
+    that are still recommended carry over to the new analysis.
+    """
     print(f"\n{'='*50}")
     print(f"Storing analysis for Employee: {employee['name']} (ID: {employee['employee_id']})")
     print(f"{'='*50}")
@@ -466,6 +772,8 @@ def store_employee_analysis(employee, analysis_result, cosmos_db_manager):
         # Ensure employee_id is a string for Cosmos DB
         employee_id_str = str(employee['employee_id'])
         
+        analysis_data = analysis_result["structured_data"].model_dump()  # Convert Pydantic model to dict
+        
         # Create the employee record for Cosmos DB - only store essential information
         employee_record = {
             "id": employee_id_str,
@@ -473,28 +781,51 @@ def store_employee_analysis(employee, analysis_result, cosmos_db_manager):
             "employee_id": employee_id_str,
             "employee_name": employee['name'],
             "employee_email": employee['email'],
-            "analysis_result": analysis_result["structured_data"].model_dump(),  # Convert Pydantic model to dict
+            "analysis_result": analysis_data,
             "notification_sent": False,
             "notification_timestamp": None,
             "approved": False,
             "approved_timestamp": None,
+            "input_fingerprint": analysis_result.get("input_fingerprint"),
+            "prompt_tokens": analysis_result.get("prompt_tokens"),
+            # API-ready response, so the API serves it without rebuilding models per request
+            "recommendations_payload": build_recommendations_payload(
+                employee_id_str, employee['name'], analysis_data["new_competencies"]
+            ),
+            "recommendations_schema_version": RECOMMENDATIONS_SCHEMA_VERSION,
             "created_at": datetime.now().isoformat(),
             "last_updated": datetime.now().isoformat()
         }
         
-        # Instead of trying to determine if the record exists, use upsert which works for both create and update
-        print(f"Upserting record for employee {employee_id_str}...")
-        try:
-            result = cosmos_db_manager.upsert_item(employee_record)
+        for attempt in range(STORE_MAX_ATTEMPTS):
+            existing_record = cosmos_db_manager.read_item(employee_id_str, "people")
+            decisions, approved = _carried_decisions(existing_record, analysis_data["new_competencies"])
+            employee_record["decisions"] = decisions
+            employee_record["approved"] = approved
+            employee_record["approved_timestamp"] = (
+                ((existing_record or {}).get("approved_timestamp") or datetime.now().isoformat()) if approved else None
+            )
+            if existing_record and existing_record.get("created_at"):
+                employee_record["created_at"] = existing_record["created_at"]
+            
+            print(f"{'Replacing' if existing_record else 'Creating'} record for employee {employee_id_str}...")
+            try:
+                if existing_record:
+                    result = cosmos_db_manager.update_item(employee_record, etag=existing_record.get("_etag"))
+                else:
+                    # Fails (None) if the record was created meanwhile; the next attempt reads it
+                    result = cosmos_db_manager.create_item(employee_record)
+            except exceptions.CosmosAccessConditionFailedError:
+                print(f"Record of {employee['name']} changed while storing the analysis, retrying")
+                continue
+            except Exception as e:
+                print(f"Error during store operation: {e}")
+                return False
             if result:
-                print(f"Successfully upserted record for {employee['name']} in Cosmos DB")
+                print(f"Successfully stored record for {employee['name']} in Cosmos DB")
                 return True
-            else:
-                print(f"Failed to upsert record for {employee['name']} in Cosmos DB - no result returned")
-                return False
-        except Exception as e:
-            print(f"Error during upsert operation: {e}")
-            return False
+        print(f"Failed to store record for {employee['name']} in Cosmos DB after {STORE_MAX_ATTEMPTS} attempts")
+        return False
             
     except Exception as e:
         print(f"Error preparing employee record for Cosmos DB: {e}")
@@ -502,93 +833,490 @@ def store_employee_analysis(employee, analysis_result, cosmos_db_manager):
         traceback.print_exc()
         return False
 
+# -------------------------------
+# Concurrent Processing Pipeline
+# -------------------------------
+def _journal_analysis(analysis_result):
+    """The parts of an analyze_employee result needed to rebuild it on resume."""
+    return {
+        "structured_data": analysis_result["structured_data"].model_dump(),
+        "input_fingerprint": analysis_result.get("input_fingerprint"),
+        "prompt_tokens": analysis_result.get("prompt_tokens")
+    }
+
+def _resumed_analysis(employee, journal):
+    """The analysis journaled by an earlier attempt of this run, or None."""
+    data = journal.pending_analysis(employee['employee_id']) if journal else None
+    if data is None:
+        return None
+    print(f"Resuming {employee['name']} from the journaled analysis")
+    return _format_analysis(employee, CompetencyAnalysis.model_validate(data["structured_data"]),
+                            data.get("input_fingerprint"), data.get("prompt_tokens") or 0)
+
+def _store_and_notify(employee, analysis_result, cosmos_db_manager, outcome, journal=None, notifier=None):
+    """Store an analysis and send its notification, recording the results in `outcome` (and the journal).
+
+    With a `notifier` the notification is queued and sent in the background; the journal records
+    "notified" once it was sent and its status written.
+    """
+    employee_id = employee['employee_id']
+    # Store analysis in Cosmos DB (unless an earlier attempt of this run already did)
+    if journal and journal.stage(employee_id) in ("stored", "notified"):
+        outcome["stored"] = True
+    else:
+        with TRACER.span("cosmos_upsert") as span:
+            outcome["stored"] = store_employee_analysis(employee, analysis_result, cosmos_db_manager)
+            span.set_attribute("outcome", "stored" if outcome["stored"] else "failed")
+        if journal and outcome["stored"]:
+            journal.record(employee_id, "stored")
+
+    # Send notification email and update notification status in Cosmos DB
+    if outcome["stored"] and notifier is not None:
+        def on_done(sent):
+            if journal and sent:
+                journal.record(employee_id, "notified")
+        with TRACER.span("notify", queued=True):
+            notifier.submit(employee, analysis_result, on_done)
+        outcome["notification_queued"] = True
+    elif outcome["stored"]:
+        with TRACER.span("notify") as span:
+            notification_result = send_notification(employee, analysis_result, cosmos_db_manager)
+            outcome["notification_sent"] = notification_result["notification_sent"]
+            span.set_attribute("outcome", "sent" if outcome["notification_sent"] else "not_sent")
+        if journal and outcome["notification_sent"]:
+            journal.record(employee_id, "notified")
+    return outcome
+
+def _outcome_label(outcome):
+    if outcome["error"]:
+        return "error"
+    if outcome["notification_sent"]:
+        return "notified"
+    if outcome["notification_queued"]:
+        return "queued"
+    return "stored" if outcome["stored"] else "not_stored"
+
+def _new_outcome(employee):
+    return {
+        "employee_id": employee.get("employee_id"),
+        "stored": False,
+        "notification_sent": False,
+        "notification_queued": False,
+        "error": None
+    }
+
+def process_employee(employee, pse_data, approved_values, cosmos_db_manager, journal=None, notifier=None):
+    """Run analyze -> store -> notify for a single employee.
+
+    Any exception is caught and reported in the outcome so that one bad employee
+    does not abort the rest of the run. Stages already journaled by an earlier attempt
+    of the run are not repeated.
+    """
+    outcome = _new_outcome(employee)
+    with TRACER.span("employee", employee_id=str(employee.get("employee_id"))) as span:
+        try:
+            # Analyze employee with structured output
+            analysis_result = _resumed_analysis(employee, journal)
+            if analysis_result is None:
+                analysis_result = analyze_employee(employee, pse_data, approved_values)
+                if journal:
+                    journal.record(employee['employee_id'], "analyzed", _journal_analysis(analysis_result))
+            _store_and_notify(employee, analysis_result, cosmos_db_manager, outcome, journal, notifier)
+        except Exception as e:
+            print(f"Error processing employee {employee.get('employee_id', 'N/A')}: {e}")
+            outcome["error"] = str(e)
+            span.set_error(str(e))
+        span.set_attribute("outcome", _outcome_label(outcome))
+    return outcome
+
+def process_employee_batch(work_items, approved_values, cosmos_db_manager, journal=None, notifier=None):
+    """Run analyze (batched) -> store -> notify for several employees, isolating failures per employee."""
+    if len(work_items) == 1:
+        employee, pse_data = work_items[0]
+        return [process_employee(employee, pse_data, approved_values, cosmos_db_manager, journal, notifier)]
+
+    outcomes = []
+    analyses = [_resumed_analysis(employee, journal) for employee, _ in work_items]
+    to_analyze = [index for index, analysis_result in enumerate(analyses) if analysis_result is None]
+    if to_analyze:
+        with TRACER.span("analyze_batch", employees=len(to_analyze)):
+            batch_results = analyze_employee_batch([work_items[index] for index in to_analyze], approved_values)
+        for index, analysis_result in zip(to_analyze, batch_results):
+            analyses[index] = analysis_result
+            if journal and not isinstance(analysis_result, Exception):
+                journal.record(work_items[index][0]['employee_id'], "analyzed", _journal_analysis(analysis_result))
+    for (employee, _), analysis_result in zip(work_items, analyses):
+        outcome = _new_outcome(employee)
+        # In batch mode the employee span covers store and notify; the shared analysis is in analyze_batch
+        with TRACER.span("employee", employee_id=str(employee.get("employee_id")), batched=True) as span:
+            try:
+                if isinstance(analysis_result, Exception):
+                    raise analysis_result
+                _store_and_notify(employee, analysis_result, cosmos_db_manager, outcome, journal, notifier)
+            except Exception as e:
+                print(f"Error processing employee {employee.get('employee_id', 'N/A')}: {e}")
+                outcome["error"] = str(e)
+                span.set_error(str(e))
+            span.set_attribute("outcome", _outcome_label(outcome))
+        outcomes.append(outcome)
+    return outcomes
+
+def _batched(iterable, size):
+    """Group an iterable into lists of up to `size` items, lazily."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def run_employee_pipeline(work_items, approved_values, cosmos_db_manager, max_concurrency=MAX_CONCURRENCY,
+                          batch_size=LLM_BATCH_SIZE, journal=None, notifier=None):
+    """Process (employee, pse_data) work items with at most `max_concurrency` pipelines in flight.
+
+    `work_items` may be any iterable (including a generator); it is consumed lazily
+    so no more than 2 * max_concurrency batches are queued at once. With `batch_size` > 1,
+    small profiles are analyzed `batch_size` at a time in one LLM request. Outcomes are
+    yielded in completion order. Stage completions are recorded in `journal`, if given.
+    Notifications are queued on `notifier`, if given, instead of being sent inline.
+    """
+    max_concurrency = max(1, int(max_concurrency))
+    batch_size = max(1, int(batch_size))
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="employee") as executor:
+        in_flight = set()
+        for batch in _batched(work_items, batch_size):
+            if len(in_flight) >= max_concurrency * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            # Run in a copy of this context so tracing spans and caller tags carry over to the worker
+            in_flight.add(executor.submit(contextvars.copy_context().run, process_employee_batch,
+                                          batch, approved_values, cosmos_db_manager, journal, notifier))
+
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
 # -------------------------------
 # Main Function
 # -------------------------------
-def main():
-    """Run the employee analysis workflow using structured outputs."""
+def main(max_concurrency=MAX_CONCURRENCY, stream=False, chunksize=STREAM_CHUNK_SIZE,
+         employees_csv=EMPLOYEES_WORKDAY_CSV, pse_csv=PSE_DATA_CSV, approved_values_csv=APPROVED_VALUES_CSV,
+         force=False, batch_size=LLM_BATCH_SIZE, report_dir=AGENT_REPORT_DIR, export_spans=False,
+         max_employees=MAX_EMPLOYEES, cosmos_db_manager=None, resume_run_id=None, journal_backend=AGENT_JOURNAL,
+         run_id=None, num_shards=None, lease_store=DEFAULT_LEASE_STORE, worker_id=None,
+         lease_ttl=DEFAULT_LEASE_TTL_SECONDS, snapshot_dir=HR_SNAPSHOT_DIR, rebuild_snapshot=False):
+    """Run the employee analysis workflow using structured outputs.
+
+    With `stream=True` the Workday and PSE exports (sorted by employee_id) are read in
+    chunks and joined on the fly, so memory is bounded by the chunk size.
+    Employees whose input fingerprint matches their stored analysis are skipped unless `force` is set.
+    With `batch_size` > 1, small profiles share one LLM request.
+    Each stage is traced; the run report is written to `report_dir` (and the spans too, in
+    OTLP/JSON, with `export_spans`) and returned.
+    `cosmos_db_manager` replaces the Cosmos DB connection (e.g. with an in-memory container).
+    Progress is checkpointed in a run journal (`journal_backend`); `resume_run_id` continues an
+    interrupted run, skipping the stages it already completed.
+    With `num_shards`, employees are split into shards by a hash of employee_id and this worker
+    processes the shards it can lease from `lease_store`; every worker of the run uses the same
+    `run_id` and `num_shards`, and `max_employees` applies per shard.
+    Notification emails are queued on a NotificationDispatcher and sent concurrently while the
+    analysis continues; each batch of records waits for its notifications before it finishes.
+    Without `stream`, the inputs are loaded from the HR snapshot in `snapshot_dir` (built on the
+    first run and rebuilt when a CSV file changes, or with `rebuild_snapshot`); None parses the
+    CSV files every run.
+    """
     print("\n=== Employee Skills Analysis System ===")
+    if num_shards and not (resume_run_id or run_id):
+        print("Sharded runs need a run id shared by every worker (--run-id)")
+        return
+    run_id = resume_run_id or run_id or new_run_id()
+    # Workers of a sharded run write their own report and spans
+    report_name = run_id
+    if num_shards:
+        worker_id = worker_id or default_worker_id()
+        report_name = f"{run_id}-{worker_id}"
+    TRACER.start_run(run_id, export_path=os.path.join(report_dir, f"spans_{report_name}.otlp.jsonl") if export_spans else None)
     
     # Initialize Cosmos DB Manager
+    if cosmos_db_manager is None:
+        try:
+            cosmos_db_manager = CosmosDBManager(
+                cosmos_database_id=COSMOS_DATABASE_ID,
+                cosmos_container_id=COSMOS_CONTAINER_ID
+            )
+            print(f"Connected to Cosmos DB - Database: {COSMOS_DATABASE_ID}, Container: {COSMOS_CONTAINER_ID}")
+        except Exception as e:
+            print(f"Failed to connect to Cosmos DB: {e}")
+            return
+    
+    if journal_backend == "off" and resume_run_id:
+        print("Cannot resume without a run journal")
+        return
+    
+    # Notifications are rendered and queued by the pipeline, sent in the background and their
+    # status written to Cosmos DB in batches (without sending anything when emails are disabled)
     try:
-        cosmos_db_manager = CosmosDBManager(
-            cosmos_database_id=COSMOS_DATABASE_ID,
-            cosmos_container_id=COSMOS_CONTAINER_ID
-        )
-        print(f"Connected to Cosmos DB - Database: {COSMOS_DATABASE_ID}, Container: {COSMOS_CONTAINER_ID}")
-    except Exception as e:
-        print(f"Failed to connect to Cosmos DB: {e}")
+        notifier = NotificationDispatcher(get_email_client() if ENABLE_EMAIL_NOTIFICATIONS else None, cosmos_db_manager, SENDER_EMAIL)
+    except ValueError as e:
+        print(f"Failed to create the email client: {e}")
         return
     
+    def open_journal(journal_id, resume):
+        """Checkpoint journal of this run (or shard), replayed when resuming."""
+        if journal_backend == "off":
+            return None
+        journal = RunJournal.open(journal_id, journal_backend, cosmos_db_manager=cosmos_db_manager, resume=resume,
+                                  final_stage="notified" if ENABLE_EMAIL_NOTIFICATIONS else "stored")
+        if resume:
+            stats = journal.stats()
+            print(f"Resuming {journal_id}: {stats['complete']} employees complete, {stats['pending']} analyzed but unfinished")
+        return journal
+    
     # Load all data
     print("\nLoading data...")
-    employees = read_employees_csv()
-    pse_data = read_pse_data_csv()
-    approved_values = read_approved_values_csv()
+    with TRACER.span("load_data", stream=stream) as span:
+        if stream:
+            approved_values = read_approved_values_csv(approved_values_csv)
+            print(f"Streaming employees and PSE data in chunks of {chunksize} rows")
+        else:
+            employees, pse_data, approved_values, snapshot = load_hr_inputs(
+                employees_csv, pse_csv, approved_values_csv, snapshot_dir, rebuild_snapshot)
+            span.set_attribute("snapshot", "off" if snapshot is None else "rebuilt" if snapshot.rebuilt else "loaded")
+    
+    def employee_records(shard=None):
+        """(employee, pse_data) for every employee, or for the employees of one shard."""
+        if stream:
+            records = (
+                (employee, {employee['employee_id']: projects})
+                for employee, projects in iter_employees_with_projects(employees_csv, pse_csv, chunksize)
+            )
+        else:
+            records = ((employee, pse_data) for employee in employees)
+        if shard is None:
+            return records
+        return (record for record in records if shard_for(record[0]['employee_id'], num_shards) == shard)
+    
+    # Fingerprints of the previous run, used to skip employees whose inputs have not changed
+    existing_fingerprints = {}
+    if force:
+        print("Force mode: re-analyzing every eligible employee")
+    else:
+        with TRACER.span("load_fingerprints") as span:
+            existing_fingerprints = load_existing_fingerprints(cosmos_db_manager)
+            span.set_attribute("fingerprints", len(existing_fingerprints))
+        print(f"Loaded {len(existing_fingerprints)} existing input fingerprints")
+    approved_competencies = approved_values.get("approved_competencies", [])
     
     print("\n==== EMPLOYEE ANALYSIS DETAILS ====")
-    print(f"Total employees: {len(employees)}")
-    
-    # Set maximum number of employees to process (for testing purposes)
-    MAX_EMPLOYEES = 3
-    processed_count = 0
-    skipped_count = 0
-    success_count = 0
-    
-    # Loop through each employee
-    for index, employee in enumerate(employees):
-        employee_id = employee.get("employee_id", "N/A")
-        name = employee.get("name", "N/A")
+    if not stream:
+        print(f"Total employees: {len(employees)}")
+    print(f"Max concurrency: {max_concurrency}")
+    if batch_size > 1:
+        print(f"LLM batch size: {batch_size}")
+    
+    def process_records(records, journal, keeper=None):
+        """Analyze, store and notify the eligible employees among `records`; returns the counts."""
+        counts = {"total": 0, "processed": 0, "succeeded": 0, "failed": 0, "skipped": 0, "unchanged": 0, "resumed": 0}
+        notifications_failed = notifier.stats()["failed"]
         
-        print(f"\n--- Employee #{index+1}: {name} (ID: {employee_id}) ---")
+        def eligible_employees():
+            """Yield (employee, pse_data) for employees that meet the processing criteria, counting the rest as skipped."""
+            for index, (employee, pse_data) in enumerate(records):
+                if keeper and keeper.lost:
+                    print("Stopping: the shard's lease was lost")
+                    return
+                counts["total"] += 1
+                employee_id = employee.get("employee_id", "N/A")
+                name = employee.get("name", "N/A")
+                
+                print(f"\n--- Employee #{index+1}: {name} (ID: {employee_id}) ---")
+                
+                # Check competencies count
+                competencies = employee.get("competencies", {})
+                if competencies is None:
+                    competencies = {}
+                    print("  WARNING: competencies is None, treating as empty dict")
+                    employee["competencies"] = competencies
+                    
+                print(f"  Competencies count: {len(competencies)}")
+                if len(competencies) > 0:
+                    print(f"  Competencies: {competencies}")
+                
+                if journal and journal.is_complete(employee_id):
+                    print("  RESUMED: Completed by an earlier attempt of this run, skipping")
+                    counts["resumed"] += 1
+                    continue
+                
+                # Process if competencies count is less than 7
+                if len(competencies) < 7 and counts["processed"] < max_employees:
+                    stored_fingerprint = existing_fingerprints.get(str(employee_id))
+                    if stored_fingerprint:
+                        employee_pse_data = pse_data.get(employee['employee_id'], [])
+                        if stored_fingerprint == compute_input_fingerprint(employee, employee_pse_data, approved_competencies):
+                            print("  UNCHANGED: Inputs match the stored analysis, skipping")
+                            counts["unchanged"] += 1
+                            continue
+                    print(f"  PROCESSING: Employee has {len(competencies)} competencies (< 7)")
+                    counts["processed"] += 1
+                    yield employee, pse_data
+                else:
+                    print(f"  SKIPPED: Employee has {len(competencies)} competencies (≥ 7) or max processed reached")
+                    counts["skipped"] += 1
         
-        # Check competencies count
-        competencies = employee.get("competencies", {})
-        if competencies is None:
-            competencies = {}
-            print("  WARNING: competencies is None, treating as empty dict")
-            employee["competencies"] = competencies
-            
-        print(f"  Competencies count: {len(competencies)}")
-        if len(competencies) > 0:
-            print(f"  Competencies: {competencies}")
+        # Analyze, store and notify up to max_concurrency employees at once
+        for outcome in run_employee_pipeline(eligible_employees(), approved_values, cosmos_db_manager, max_concurrency,
+                                             batch_size, journal, notifier):
+            if outcome["notification_sent"] or outcome["notification_queued"]:
+                counts["succeeded"] += 1
+            if outcome["error"]:
+                counts["failed"] += 1
         
-        # Process if competencies count is less than 7
-        if len(competencies) < 7 and processed_count < MAX_EMPLOYEES:
-            print(f"  PROCESSING: Employee has {len(competencies)} competencies (< 7)")
-            processed_count += 1
-            
-            # Analyze employee with structured output
-            analysis_result = analyze_employee(employee, pse_data, approved_values)
-            
-            # Store analysis in Cosmos DB
-            storage_success = store_employee_analysis(employee, analysis_result, cosmos_db_manager)
-            
-            # Send notification email and update notification status in Cosmos DB
-            if storage_success:
-                notification_result = send_notification(employee, analysis_result, cosmos_db_manager)
-                if notification_result["notification_sent"]:
-                    success_count += 1
-        else:
-            print(f"  SKIPPED: Employee has {len(competencies)} competencies (≥ 7) or max processed reached")
-            skipped_count += 1
+        # Wait for the queued notifications (and their journal records); those that failed do not count as succeeded
+        notifier.drain()
+        counts["succeeded"] -= notifier.stats()["failed"] - notifications_failed
+        
+        if journal:
+            journal.close()
+            journal.print_stats()
+        return counts
     
-    # Provide simple processing summary
+    run_totals = None
+    if num_shards:
+        # Lease shards until every shard is done (reclaiming those of dead workers), then roll up the shards
+        store = open_lease_store(lease_store, cosmos_db_manager)
+        print(f"Worker {worker_id}: run {run_id} in {num_shards} shards, leases in {store}")
+        counts = {}
+        shards_done = []
+        for lease in claim_shards(store, run_id, num_shards, worker_id, lease_ttl):
+            print(f"\n==== SHARD {lease.shard} of {num_shards} (attempt {lease.attempt}) ====")
+            with TRACER.span("shard", shard=lease.shard, attempt=lease.attempt), LeaseKeeper(store, lease, lease_ttl) as keeper:
+                # A shard reclaimed from a dead worker resumes from that worker's journal (if it can be reached)
+                shard_counts = process_records(employee_records(lease.shard), open_journal(f"{run_id}-shard{lease.shard:04d}", True), keeper)
+                if keeper.complete(shard_counts):
+                    shards_done.append(lease.shard)
+                    for key, value in shard_counts.items():
+                        counts[key] = counts.get(key, 0) + value
+                else:
+                    print(f"Shard {lease.shard} was reclaimed by another worker; its results are counted there")
+        counts = counts or {"total": 0, "processed": 0, "succeeded": 0, "failed": 0, "skipped": 0, "unchanged": 0, "resumed": 0}
+        run_totals = rollup(store.shard_states(run_id), num_shards)
+    else:
+        if not resume_run_id:
+            print(f"Run {run_id} (resume with --resume {run_id})")
+        counts = process_records(employee_records(), open_journal(run_id, bool(resume_run_id)))
+    notifier.close()
+    
+    notifier.print_stats()
+    llm_scheduler.print_stats()
+    llm_cache.print_stats()
+    LEDGER.print_summary()
+    
+    report = TRACER.finish_run(employees=counts["processed"])
+    report["summary"] = counts
+    report["notifications"] = notifier.stats()
+    if run_totals is not None:
+        report["run_summary"] = run_totals
+    print_report(report)
+    report_path = write_report(report, os.path.join(report_dir, f"run_{report_name}.json"))
+    print(f"Run report written to {report_path}")
+    if export_spans:
+        print(f"Spans exported to {report['export_path']}")
+    
+    # Provide simple processing summary (for a sharded run: every finished shard, from all workers)
+    summary = run_totals if run_totals is not None else counts
     print("\n==== PROCESSING SUMMARY ====")
-    print(f"Total employees: {len(employees)}")
-    print(f"Processed: {processed_count}")
-    print(f"Successfully stored in Cosmos DB: {success_count}")
-    print(f"Skipped: {skipped_count}")
+    if run_totals is not None:
+        print(f"Shards finished: {run_totals['shards_done']} of {num_shards}"
+              + (f" ({run_totals['shards_pending']} still leased by other workers)" if run_totals['shards_pending'] else ""))
+        print(f"This worker: {len(shards_done)} shards, {counts['processed']} employees processed")
+    print(f"Total employees: {summary.get('total', 0)}")
+    print(f"Processed: {summary.get('processed', 0)}")
+    print(f"Successfully stored in Cosmos DB: {summary.get('succeeded', 0)}")
+    print(f"Failed: {summary.get('failed', 0)}")
+    print(f"Skipped: {summary.get('skipped', 0)}")
+    print(f"Skipped (unchanged inputs): {summary.get('unchanged', 0)}")
+    if resume_run_id or summary.get('resumed'):
+        print(f"Skipped (completed before resume): {summary.get('resumed', 0)}")
     
     # Provide warning if no employees meet criteria
-    if processed_count == 0 and len(employees) > 0:
+    if summary.get('processed', 0) == 0 and summary.get('total', 0) > 0:
         print("\n==== WARNING: No employees meet the criteria ====")
         print("All employees have 7 or more competencies")
     
     print("\n==== ANALYSIS COMPLETE ====")
+    return report
+
+def parse_args(argv=None):
+    """Parse command line options for the batch agent."""
+    parser = argparse.ArgumentParser(description="Employee competency analysis agent")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY,
+                        help="Number of employees to analyze, store and notify at once")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read the Workday and PSE exports in chunks (both must be sorted by employee_id)")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE,
+                        help="Rows per chunk in streaming mode")
+    parser.add_argument("--sort-inputs", action="store_true",
+                        help="Externally sort the Workday and PSE exports by employee_id (into *.sorted.csv) and stream them")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-analyze employees even if their inputs match the stored fingerprint")
+    parser.add_argument("--batch-size", type=int, default=LLM_BATCH_SIZE,
+                        help="Pack up to this many small employee profiles into one LLM request (1 disables batching)")
+    parser.add_argument("--max-employees", type=int, default=MAX_EMPLOYEES,
+                        help="Stop after processing this many eligible employees")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                        help="Continue an interrupted run from its journal, skipping completed stages")
+    parser.add_argument("--journal", choices=JOURNAL_BACKENDS, default=AGENT_JOURNAL,
+                        help="Where to checkpoint progress: a local file, a Cosmos DB control document, or off")
+    parser.add_argument("--run-id",
+                        help="Run id (required with --shards: every worker of the run uses the same one)")
+    parser.add_argument("--shards", type=int,
+                        help="Split employees into this many shards by employee_id and process the shards this worker can lease")
+    parser.add_argument("--lease-store", default=DEFAULT_LEASE_STORE,
+                        help="Shard lease store: sqlite:<path> (one machine), file:<shared directory> or cosmos")
+    parser.add_argument("--worker-id", help="Name of this worker in the lease store (default host-pid)")
+    parser.add_argument("--lease-ttl", type=float, default=DEFAULT_LEASE_TTL_SECONDS,
+                        help="Seconds before an unrenewed shard lease can be reclaimed by another worker")
+    parser.add_argument("--snapshot-dir", default=HR_SNAPSHOT_DIR,
+                        help="Directory of the HR input snapshot reused while the CSV files are unchanged (needs pyarrow)")
+    parser.add_argument("--no-snapshot", action="store_true",
+                        help="Parse the CSV files without reading or writing a snapshot")
+    parser.add_argument("--rebuild-snapshot", action="store_true",
+                        help="Rebuild the HR input snapshot even if the CSV files are unchanged")
+    parser.add_argument("--report-dir", default=AGENT_REPORT_DIR,
+                        help="Directory for the JSON run report (per-stage latency, throughput, slowest employees)")
+    parser.add_argument("--export-spans", action="store_true",
+                        help="Also write every span to the report directory in OpenTelemetry OTLP/JSON format")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        main()
+        employees_csv, pse_csv = EMPLOYEES_WORKDAY_CSV, PSE_DATA_CSV
+        if args.sort_inputs:
+            employees_csv = sort_csv_by_employee_id(EMPLOYEES_WORKDAY_CSV, EMPLOYEES_WORKDAY_CSV + ".sorted.csv", args.chunk_size)
+            pse_csv = sort_csv_by_employee_id(PSE_DATA_CSV, PSE_DATA_CSV + ".sorted.csv", args.chunk_size)
+        main(
+            max_concurrency=args.concurrency,
+            stream=args.stream or args.sort_inputs,
+            chunksize=args.chunk_size,
+            employees_csv=employees_csv,
+            pse_csv=pse_csv,
+            force=args.force,
+            batch_size=args.batch_size,
+            report_dir=args.report_dir,
+            export_spans=args.export_spans,
+            max_employees=args.max_employees,
+            resume_run_id=args.resume,
+            journal_backend=args.journal,
+            run_id=args.run_id,
+            num_shards=args.shards,
+            lease_store=args.lease_store,
+            worker_id=args.worker_id,
+            lease_ttl=args.lease_ttl,
+            snapshot_dir=None if args.no_snapshot else args.snapshot_dir,
+            rebuild_snapshot=args.rebuild_snapshot
+        )
     except Exception as e:
         print(f"Error: {str(e)}")
\ No newline at end of file
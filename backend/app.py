@@ -1,25 +1,71 @@
-from fastapi import FastAPI, HTTPException
+import os
+import random
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from cosmos_db import CosmosDBManager
-from typing import List, Dict, Any, Optional
+from fastapi.middleware.gzip import GZipMiddleware
+from cosmos_db_async import AsyncCosmosDBManager, close_shared_clients
+from response_cache import TTLCache, CachedResponse
+from metrics import REGISTRY, CONTENT_TYPE, MetricsMiddleware
+from cosmos_telemetry import caller_tag
+from recommendation_payload import EmployeeRecommendations, payload_from_record
+from azure.cosmos import exceptions
+from datetime import datetime
 from pydantic import BaseModel, Field
-import json
+from pydantic_core import to_json
+from typing import Any, Dict, List, Literal, Optional, Union
 
-# Define models for our API responses
-class CompetencyRecommendation(BaseModel):
-    id: str
-    name: str  # This is the competency name
-    level: str  # One of: "beginner", "intermediate", "advanced", "expert"
-    confidence: int  # Percentage (0-100)
-    reasoning: str = Field(..., description="The reasoning provided by the agent")
+# Logging: warnings and errors are always logged; lower levels only for a sample of requests
+API_LOG_LEVEL = os.getenv("API_LOG_LEVEL", "INFO").upper()
+API_LOG_SAMPLE_RATE = float(os.getenv("API_LOG_SAMPLE_RATE", "0.01"))
 
-class EmployeeRecommendations(BaseModel):
+class SampledLogFilter(logging.Filter):
+    """Pass every WARNING and above, and `rate` of the records below it."""
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("api")
+for _logger in (logger, logging.getLogger("cosmos_db_async")):
+    _logger.setLevel(API_LOG_LEVEL)
+    _logger.addFilter(SampledLogFilter(API_LOG_SAMPLE_RATE))
+
+# Request models for approval decisions
+class CompetencyDecision(BaseModel):
+    competency: str  # Competency name, as in the recommendation's "name"
+    decision: Literal["approve", "reject"]
+    level: Optional[Literal["beginner", "intermediate", "advanced", "expert"]] = None  # Re-level when approving
+
+class DecisionsRequest(BaseModel):
+    decisions: List[CompetencyDecision] = Field(..., min_length=1)
+
+# Response model of the bulk fetch (GET /api/recommendations?ids=...)
+class BulkRecommendations(BaseModel):
+    items: List[EmployeeRecommendations]
+    missing: List[str]  # Requested employee ids without a record
+
+# Response of POST /api/recommendations/{employee_id}/decisions; with a response model FastAPI
+# serializes it to bytes with pydantic-core instead of jsonable_encoder + json.dumps
+class DecisionsResponse(BaseModel):
     employee_id: str
-    employee_name: str
-    recommendations: List[CompetencyRecommendation]
+    decisions: Dict[str, Dict[str, Any]]
+    approved: bool
+    etag: Optional[str]
+
+# Release the shared Cosmos DB connection pool on shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_shared_clients()
 
 # Initialize FastAPI app
-app = FastAPI(title="Employee Competencies API")
+app = FastAPI(title="Employee Competencies API", lifespan=lifespan)
 
 # Add CORS middleware to allow frontend to call our API
 app.add_middleware(
@@ -30,98 +76,301 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger responses (team listings, long recommendation lists)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+# Request latency per route and status, and requests in flight (served on /metrics)
+app.add_middleware(MetricsMiddleware)
+
 # Cosmos DB configuration
 DATABASE_ID = "test_db"
 CONTAINER_ID = "people"
 
-# Create a CosmosDBManager instance
-cosmos_manager = CosmosDBManager(
-    cosmos_database_id=DATABASE_ID,
-    cosmos_container_id=CONTAINER_ID
+# AsyncCosmosDBManager of the app, created by get_cosmos_manager() on the first request so that importing
+# the app needs no Cosmos DB configuration (tests and benchmarks may assign their own)
+cosmos_manager: Optional[AsyncCosmosDBManager] = None
+
+def get_cosmos_manager() -> AsyncCosmosDBManager:
+    """The app's Cosmos DB manager (connects on its first operation, shares one client per process)."""
+    global cosmos_manager
+    if cosmos_manager is None:
+        cosmos_manager = AsyncCosmosDBManager(
+            cosmos_database_id=DATABASE_ID,
+            cosmos_container_id=CONTAINER_ID
+        )
+    return cosmos_manager
+
+# In-process cache of serialized responses. Entries are invalidated by writes made through this API;
+# records rewritten by the agent (another process) are picked up once the entry expires.
+RECOMMENDATIONS_CACHE_TTL_SECONDS = float(os.getenv("RECOMMENDATIONS_CACHE_TTL_SECONDS", "30"))
+RECOMMENDATIONS_CACHE_MAX_ENTRIES = int(os.getenv("RECOMMENDATIONS_CACHE_MAX_ENTRIES", "10000"))
+
+recommendations_cache = TTLCache(
+    max_entries=RECOMMENDATIONS_CACHE_MAX_ENTRIES,
+    ttl_seconds=RECOMMENDATIONS_CACHE_TTL_SECONDS
+)
+REGISTRY.gauge("api_cache_hit_ratio", "Hit ratio of in-process caches", ["cache"]).set_function(
+    lambda: recommendations_cache.stats()["hit_rate"], cache="recommendations"
+)
+REGISTRY.gauge("api_cache_entries", "Entries in in-process caches", ["cache"]).set_function(
+    lambda: recommendations_cache.stats()["entries"], cache="recommendations"
 )
 
-# Function to get recommendations for an employee
-def get_employee_recommendations(employee_id: str):
+# Bulk fetch and listing limits
+MAX_BATCH_IDS = 100
+MAX_PAGE_SIZE = 500
+
+# Fields needed to build a response (whole documents are not read for bulk fetches and listings)
+RESPONSE_FIELDS = ["id", "employee_id", "employee_name", "recommendations_payload",
+                   "recommendations_schema_version", "analysis_result", "_etag"]
+
+# Attempts to apply decisions when the record changes between read and patch (no If-Match from the client)
+DECISION_MAX_ATTEMPTS = 3
+
+# Loads in progress, so concurrent requests for the same employee share one Cosmos DB read
+_pending_loads: Dict[str, asyncio.Future] = {}
+
+# Bumped when an employee's record is changed through this API; a read that started before the
+# change does not cache what it got (one counter per employee ever changed)
+_generations: Dict[str, int] = {}
+
+def invalidate_employee_recommendations(employee_id: str) -> None:
+    """
+    Drop the cached response for an employee after their record changes.
+
+    Reads already in flight no longer cache their result, and later requests do not join them.
+    """
+    _generations[employee_id] = _generations.get(employee_id, 0) + 1
+    recommendations_cache.invalidate(employee_id)
+    _pending_loads.pop(employee_id, None)
+
+async def _load_employee_recommendations(employee_id: str) -> CachedResponse:
+    # The document id is the employee_id and every record lives in the "people" partition
+    employee_record = await get_cosmos_manager().read_item(employee_id, "people")
+    if not employee_record:
+        raise HTTPException(status_code=404, detail=f"Employee {employee_id} not found")
+    
+    # The agent stores the serialized response with the record; older records are rebuilt here
+    logger.info("Loaded recommendations for employee %s", employee_id)
+    return CachedResponse(body=payload_from_record(employee_record), etag=employee_record.get('_etag'))
+
+# Function to get the serialized recommendations for an employee
+async def get_employee_recommendations(employee_id: str) -> CachedResponse:
+    cached = recommendations_cache.get(employee_id)
+    if cached is not None:
+        return cached
+    
+    pending = _pending_loads.get(employee_id)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    
+    pending = asyncio.get_running_loop().create_future()
+    _pending_loads[employee_id] = pending
+    generation = _generations.get(employee_id, 0)
     try:
-        # Query for the employee document
-        query = "SELECT * FROM c WHERE c.employee_id = @employee_id AND c.partitionKey = 'people'"
-        parameters = [{"name": "@employee_id", "value": employee_id}]
-        
-        items = cosmos_manager.query_items(
-            query=query,
-            parameters=parameters
+        cached = await _load_employee_recommendations(employee_id)
+        if _generations.get(employee_id, 0) == generation:
+            recommendations_cache.set(employee_id, cached)
+        pending.set_result(cached)
+        return cached
+    except HTTPException as e:
+        pending.set_exception(e)
+        raise
+    except Exception as e:
+        logger.exception("Error retrieving recommendations for employee %s", employee_id)
+        error = HTTPException(status_code=500, detail=f"Error: {str(e)}")
+        pending.set_exception(error)
+        raise error
+    finally:
+        if _pending_loads.get(employee_id) is pending:
+            del _pending_loads[employee_id]
+        if not pending.done():
+            # This request was cancelled mid-load; release anyone waiting on it
+            pending.set_exception(HTTPException(status_code=503, detail="Load interrupted, please retry"))
+        # Mark the exception as retrieved when no other request was waiting for it
+        pending.exception()
+
+def _etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    if not if_none_match or not etag:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def recommendations_response(cached: CachedResponse, request: Request) -> Response:
+    """Serve the cached bytes, or 304 Not Modified if the client already has this version."""
+    headers = {"Cache-Control": "private, no-cache"}
+    if cached.etag:
+        headers["ETag"] = cached.etag
+    if _etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+# Function to get the serialized recommendations for several employees with one query
+async def get_many_employee_recommendations(employee_ids: List[str]) -> Response:
+    bodies: Dict[str, bytes] = {}
+    to_read = []
+    for employee_id in employee_ids:
+        cached = recommendations_cache.get(employee_id)
+        if cached is not None:
+            bodies[employee_id] = cached.body
+        else:
+            to_read.append(employee_id)
+    
+    if to_read:
+        generations = {employee_id: _generations.get(employee_id, 0) for employee_id in to_read}
+        try:
+            records = await get_cosmos_manager().read_items(to_read, "people", fields=RESPONSE_FIELDS)
+        except Exception as e:
+            logger.exception("Error retrieving recommendations for %s employees", len(to_read))
+            raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+        for record in records:
+            cached = CachedResponse(body=payload_from_record(record), etag=record.get('_etag'))
+            if _generations.get(record['id'], 0) == generations.get(record['id']):
+                recommendations_cache.set(record['id'], cached)
+            bodies[record['id']] = cached.body
+    
+    # Stored payloads are already JSON, so the response is assembled from bytes in the requested order
+    items = b",".join(bodies[employee_id] for employee_id in employee_ids if employee_id in bodies)
+    missing = [employee_id for employee_id in employee_ids if employee_id not in bodies]
+    body = b'{"items":[' + items + b'],"missing":' + to_json(missing) + b"}"
+    return Response(content=body, media_type="application/json")
+
+# Function to list recommendations one page at a time
+async def list_employee_recommendations(page_size: int, continuation_token: Optional[str],
+                                        approved: Optional[bool], notification_sent: Optional[bool]) -> Response:
+    conditions = []
+    parameters = []
+    if approved is not None:
+        conditions.append("c.approved = @approved")
+        parameters.append({"name": "@approved", "value": approved})
+    if notification_sent is not None:
+        conditions.append("c.notification_sent = @notification_sent")
+        parameters.append({"name": "@notification_sent", "value": notification_sent})
+    query = f"SELECT {', '.join('c.' + field for field in RESPONSE_FIELDS)} FROM c"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    
+    try:
+        records, next_token = await get_cosmos_manager().query_page(
+            query,
+            parameters=parameters,
+            partition_key="people",
+            max_item_count=page_size,
+            continuation_token=continuation_token
         )
-        
-        if not items:
+    except exceptions.CosmosHttpResponseError as e:
+        logger.warning("Error listing recommendations: %s", e.message)
+        status_code = 400 if e.status_code == 400 and continuation_token else 500
+        raise HTTPException(status_code=status_code, detail=f"Error: {e.message}")
+    
+    items = b",".join(payload_from_record(record) for record in records)
+    body = b'{"items":[' + items + b'],"continuation_token":' + to_json(next_token) + b"}"
+    return Response(content=body, media_type="application/json")
+
+# Define API endpoints
+# Paginated listing; pass the returned continuation_token back to get the next page (null on the last page)
+@app.get("/api/recommendations/page")
+async def read_recommendations_page(
+    page_size: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    continuation_token: Optional[str] = None,
+    approved: Optional[bool] = None,
+    notification_sent: Optional[bool] = None
+):
+    with caller_tag("api_list_recommendations"):
+        return await list_employee_recommendations(page_size, continuation_token, approved, notification_sent)
+
+# Function to apply an employee's approval decisions in one ETag-guarded patch
+async def apply_employee_decisions(employee_id: str, request: DecisionsRequest, if_match: Optional[str]) -> Dict[str, Any]:
+    """
+    Merge the decisions into the record's `decisions` map and update `approved` (True once every
+    recommended competency has a decision). The patch is conditional on the ETag of the record the
+    decisions were validated against, so decisions validated against an analysis the agent has
+    since replaced, or merged without a concurrent approval, are never written. The agent in turn
+    replaces the record only at the ETag it read and carries the decisions over (store_employee_analysis).
+    With a client If-Match a stale ETag is returned as 412; otherwise the read is retried.
+    """
+    attempts = 1 if if_match else DECISION_MAX_ATTEMPTS
+    for attempt in range(attempts):
+        employee_record = await get_cosmos_manager().read_item(employee_id, "people")
+        if not employee_record:
             raise HTTPException(status_code=404, detail=f"Employee {employee_id} not found")
+        if if_match and if_match not in ("*", employee_record.get('_etag')):
+            raise HTTPException(status_code=412, detail="Recommendations changed since they were loaded")
         
-        employee_record = items[0]
-        print(f"Raw employee record: {json.dumps(employee_record, indent=2)}")
-        
-        # Extract and format recommendations
-        recommendations = []
+        recommended = {
+            comp.get('competency', '').casefold(): comp.get('competency')
+            for comp in (employee_record.get('analysis_result') or {}).get('new_competencies') or []
+        }
+        unknown = [d.competency for d in request.decisions if d.competency.casefold() not in recommended]
+        if unknown:
+            raise HTTPException(status_code=409, detail=f"Not among the current recommendations: {', '.join(unknown)}")
         
-        if 'analysis_result' in employee_record and 'new_competencies' in employee_record['analysis_result']:
-            print(f"Found {len(employee_record['analysis_result']['new_competencies'])} competencies")
-            
-            for i, comp in enumerate(employee_record['analysis_result']['new_competencies']):
-                print(f"Processing competency {i+1}: {comp}")
-                
-                # Create the recommendation with explicit debug for each field
-                try:
-                    recommendation = CompetencyRecommendation(
-                        id=str(i+1),
-                        name=comp['competency'],
-                        level=comp['level'],
-                        confidence=comp['confidence'],
-                        reasoning=comp.get('reasoning', "No reasoning provided")
-                    )
-                    print(f"Created recommendation: {recommendation}")
-                    recommendations.append(recommendation)
-                except Exception as e:
-                    print(f"Error creating recommendation object: {e}")
-                    # Try to create with debug info
-                    recommendation = CompetencyRecommendation(
-                        id=str(i+1),
-                        name=comp.get('competency', 'Unknown'),
-                        level=comp.get('level', 'beginner'),
-                        confidence=comp.get('confidence', 0),
-                        reasoning=f"Error processing: {str(e)}"
-                    )
-                    recommendations.append(recommendation)
-            
-            # Sort recommendations by confidence (highest first)
-            recommendations.sort(key=lambda x: x.confidence, reverse=True)
+        timestamp = datetime.now().isoformat()
+        decisions = dict(employee_record.get('decisions') or {})
+        for d in request.decisions:
+            decisions[recommended[d.competency.casefold()]] = {"decision": d.decision, "level": d.level, "timestamp": timestamp}
+        approved = all(name in decisions for name in recommended.values())
         
-        result = EmployeeRecommendations(
-            employee_id=employee_record['employee_id'],
-            employee_name=employee_record['employee_name'],
-            recommendations=recommendations
-        )
+        try:
+            patched_record = await get_cosmos_manager().patch_item(
+                employee_id,
+                "people",
+                [
+                    {"op": "set", "path": "/decisions", "value": decisions},
+                    {"op": "set", "path": "/approved", "value": approved},
+                    {"op": "set", "path": "/approved_timestamp", "value": timestamp if approved else None},
+                    {"op": "set", "path": "/last_updated", "value": timestamp}
+                ],
+                etag=employee_record['_etag']
+            )
+        except exceptions.CosmosAccessConditionFailedError:
+            if attempt + 1 < attempts:
+                continue
+            raise HTTPException(status_code=412, detail="Recommendations changed while saving decisions, please reload")
+        finally:
+            invalidate_employee_recommendations(employee_id)
         
-        # Debug the final result - fix the deprecated json method
-        print(f"Final API response: {result.model_dump_json(indent=2)}")
-        return result
-    
-    except Exception as e:
-        import traceback
-        print(f"Error retrieving recommendations: {str(e)}")
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+        if not patched_record:
+            raise HTTPException(status_code=500, detail="Error: decisions could not be saved")
+        return {
+            "employee_id": employee_id,
+            "decisions": patched_record.get('decisions'),
+            "approved": patched_record.get('approved'),
+            "etag": patched_record.get('_etag')
+        }
 
-# Define API endpoints
 @app.get("/api/recommendations/{employee_id}", response_model=EmployeeRecommendations)
-def read_recommendations(employee_id: str):
-    return get_employee_recommendations(employee_id)
+async def read_recommendations(employee_id: str, request: Request):
+    with caller_tag("api_get_recommendations"):
+        return recommendations_response(await get_employee_recommendations(employee_id), request)
+
+# Record approve/reject/re-level decisions; send If-Match with the ETag from the GET to reject stale writes
+@app.post("/api/recommendations/{employee_id}/decisions", response_model=DecisionsResponse)
+async def save_decisions(employee_id: str, decisions: DecisionsRequest, request: Request):
+    with caller_tag("api_decisions"):
+        return await apply_employee_decisions(employee_id, decisions, request.headers.get("if-match"))
+
+# Bulk fetch with ?ids=1,2,3 -> {"items": [...], "missing": [...]}
+# For testing - without ids this is a hardcoded endpoint for employee 11707953
+@app.get("/api/recommendations", response_model=Union[BulkRecommendations, EmployeeRecommendations])
+async def read_hardcoded_recommendations(request: Request, ids: Optional[str] = None):
+    if ids is not None:
+        employee_ids = list(dict.fromkeys(employee_id.strip() for employee_id in ids.split(",") if employee_id.strip()))
+        if not employee_ids or len(employee_ids) > MAX_BATCH_IDS:
+            raise HTTPException(status_code=400, detail=f"ids must list between 1 and {MAX_BATCH_IDS} employee ids")
+        with caller_tag("api_bulk_fetch"):
+            return await get_many_employee_recommendations(employee_ids)
+    with caller_tag("api_get_recommendations"):
+        return recommendations_response(await get_employee_recommendations("11707953"), request)
 
-# For testing - hardcoded endpoint for employee 11707953
-@app.get("/api/recommendations", response_model=EmployeeRecommendations)
-def read_hardcoded_recommendations():
-    return get_employee_recommendations("11707953")
+# Prometheus metrics: API latency, Cosmos DB latency and RU charges, cache hit ratio
+@app.get("/metrics")
+async def read_metrics():
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
 
 # Root endpoint
 @app.get("/")
-def root():
+async def root():
     return {"message": "Employee Competencies API is running"}
 
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+"""
+### azure_credentials.py ###
+
+DefaultAzureCredential options shared by CosmosDBManager and AsyncCosmosDBManager.
+
+DefaultAzureCredential tries its sources in order until one returns a token. Sources that do not
+apply to the host are slow to rule out: off Azure, managed identity waits for the instance
+metadata endpoint to time out, and the developer-tool sources start `az`, `pwsh` or `azd`
+subprocesses. Listing them in AZURE_CREDENTIAL_EXCLUDE (comma-separated) skips them, so the first
+Cosmos DB call of a cold process does not pay for them:
+
+    # App Service / Container Apps with a managed identity
+    AZURE_CREDENTIAL_EXCLUDE=environment,workload_identity,shared_token_cache,visual_studio_code,cli,powershell,developer_cli
+    # Laptop signed in with `az login`
+    AZURE_CREDENTIAL_EXCLUDE=managed_identity,shared_token_cache,visual_studio_code,powershell,developer_cli
+
+Only the listed sources are passed to DefaultAzureCredential, so older azure-identity versions
+work as long as the list names sources they know.
+"""
+
+import os
+from typing import Any, Dict, Iterable, Optional
+
+# Source names accepted in AZURE_CREDENTIAL_EXCLUDE, in DefaultAzureCredential's order
+CREDENTIAL_SOURCES = (
+    "environment", "workload_identity", "managed_identity", "shared_token_cache",
+    "visual_studio_code", "cli", "powershell", "developer_cli", "interactive_browser"
+)
+
+
+def excluded_sources(exclude: Optional[Iterable[str]] = None) -> tuple:
+    """Credential sources to skip: `exclude`, or AZURE_CREDENTIAL_EXCLUDE."""
+    if exclude is None:
+        exclude = os.getenv("AZURE_CREDENTIAL_EXCLUDE", "").split(",")
+    sources = tuple(source.strip().lower().replace("-", "_") for source in exclude if source and source.strip())
+    unknown = [source for source in sources if source not in CREDENTIAL_SOURCES]
+    if unknown:
+        raise ValueError(f"Unknown credential source(s) {', '.join(unknown)}; expected any of {', '.join(CREDENTIAL_SOURCES)}")
+    return sources
+
+
+def credential_options(tenant_id: str, exclude: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Keyword arguments of DefaultAzureCredential (sync or aio) for `tenant_id`, without the excluded sources."""
+    options = {
+        "interactive_browser_tenant_id": tenant_id,
+        "visual_studio_code_tenant_id": tenant_id,
+        "workload_identity_tenant_id": tenant_id,
+        "shared_cache_tenant_id": tenant_id
+    }
+    for source in excluded_sources(exclude):
+        options[f"exclude_{source}_credential"] = True
+    return options
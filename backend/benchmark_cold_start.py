@@ -0,0 +1,149 @@
+"""
+### benchmark_cold_start.py ###
+
+Tracks the cold-start latency of the API (app.py) and the batch agent (agent_v2.py): each module
+is imported in fresh Python processes, without any Azure configuration in the environment, and
+the import time is reported with the modules that account for most of it (from -X importtime).
+For the API, the time of the first request served (/metrics, which needs no Cosmos DB) is
+reported too.
+
+Importing either module must not build Azure clients; an import that fails without Azure
+configuration is reported as an error. With --max-import-ms the script exits with status 1 when
+a median import time exceeds the budget, so it can gate CI.
+
+Usage:
+    python benchmark_cold_start.py
+    python benchmark_cold_start.py --modules app --runs 20 --max-import-ms 1500
+    python benchmark_cold_start.py --json cold_start.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+MODULES = ["app", "agent_v2"]
+
+# Environment variables removed from the child processes, so imports are measured unconfigured
+AZURE_VARIABLE_PREFIXES = ("AOAI_", "COSMOS_", "COMMUNICATION_SERVICES_", "AZURE_")
+
+CHILD_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import {module}
+result = {{"import_seconds": time.perf_counter() - started}}
+if "{module}" == "app":
+    import asyncio, httpx
+    async def first_request():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://cold-start") as client:
+            request_started = time.perf_counter()
+            response = await client.get("/metrics")
+            return time.perf_counter() - request_started, response.status_code
+    result["first_request_seconds"], result["first_request_status"] = asyncio.run(first_request())
+print(json.dumps(result))
+"""
+
+
+def _child_environment():
+    return {key: value for key, value in os.environ.items() if not key.startswith(AZURE_VARIABLE_PREFIXES)}
+
+
+def _run_child(module, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD_SCRIPT.format(module=module)]
+    completed = subprocess.run(command, capture_output=True, text=True, env=_child_environment(),
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f"exit status {completed.returncode}"
+        raise RuntimeError(f"Importing {module} failed: {error}")
+    return json.loads(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+
+def _slowest_imports(importtime_output, module, top):
+    """Direct imports of `module` with the largest cumulative import time, from -X importtime output."""
+    # importtime lists a module after everything it imports: top-level modules are indented by one
+    # space and their direct imports by three
+    children, imports = [], []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = len(name) - len(name.lstrip())
+        if depth == 1:
+            if name.strip() == module:
+                imports = children
+            children = []
+        elif depth == 3:
+            children.append((int(cumulative) / 1e6, name.strip()))
+    return [{"module": name, "seconds": round(seconds, 4)} for seconds, name in sorted(imports, reverse=True)[:top]]
+
+
+def measure(module, runs, top):
+    # The first process compiles bytecode; it is not counted
+    _run_child(module)
+    samples = [_run_child(module)[0] for _ in range(runs)]
+    _, importtime_output = _run_child(module, importtime=True)
+
+    import_seconds = sorted(sample["import_seconds"] for sample in samples)
+    result = {
+        "module": module,
+        "runs": runs,
+        "import_median_seconds": round(statistics.median(import_seconds), 4),
+        "import_max_seconds": round(import_seconds[-1], 4),
+        "slowest_imports": _slowest_imports(importtime_output, module, top)
+    }
+    if "first_request_seconds" in samples[0]:
+        result["first_request_median_seconds"] = round(statistics.median(sample["first_request_seconds"] for sample in samples), 4)
+        result["first_request_status"] = samples[0]["first_request_status"]
+    return result
+
+
+def print_results(results):
+    print(f"\n{'module':<10} {'import p50 ms':>14} {'import max ms':>14} {'first request ms':>17}")
+    print("-" * 58)
+    for result in results:
+        if "error" in result:
+            print(f"{result['module']:<10} ERROR: {result['error']}")
+            continue
+        first_request = result.get("first_request_median_seconds")
+        print(f"{result['module']:<10} {result['import_median_seconds'] * 1000:>14.1f} {result['import_max_seconds'] * 1000:>14.1f} "
+              f"{first_request * 1000 if first_request is not None else float('nan'):>17.1f}")
+    for result in results:
+        if result.get("slowest_imports"):
+            print(f"\n{result['module']}: slowest imports")
+            for entry in result["slowest_imports"]:
+                print(f"  {entry['module']:<40} {entry['seconds'] * 1000:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import (cold-start) time of the API and the agent")
+    parser.add_argument("--modules", nargs="+", choices=MODULES, default=MODULES)
+    parser.add_argument("--runs", type=int, default=10, help="Fresh processes per module")
+    parser.add_argument("--top", type=int, default=8, help="Slowest direct imports listed per module")
+    parser.add_argument("--max-import-ms", type=float,
+                        help="Exit with status 1 if a module's median import time exceeds this budget")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    cold_start_results = []
+    for name in args.modules:
+        print(f"Measuring {name}...")
+        try:
+            cold_start_results.append(measure(name, max(1, args.runs), args.top))
+        except RuntimeError as e:
+            cold_start_results.append({"module": name, "error": str(e)})
+    print_results(cold_start_results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(cold_start_results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+    failed = [result["module"] for result in cold_start_results if "error" in result]
+    if args.max_import_ms is not None:
+        failed += [result["module"] for result in cold_start_results
+                   if "error" not in result and result["import_median_seconds"] * 1000 > args.max_import_ms]
+    sys.exit(1 if failed else 0)
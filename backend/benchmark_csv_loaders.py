@@ -0,0 +1,184 @@
+"""
+### benchmark_csv_loaders.py ###
+
+Benchmarks the vectorized CSV loaders in agent_v2.py against the original iterrows-based
+implementations on synthetic Workday/PSE files of increasing size, and checks that both
+produce the same structures. With pyarrow installed it also times the HR snapshot
+(hr_snapshot.py): building it, opening it on a re-run, and reading every employee and every
+employee's projects from it, which must match the CSV loaders.
+
+Usage:
+    python benchmark_csv_loaders.py                       # 10k, 100k and 1M rows
+    python benchmark_csv_loaders.py --sizes 10000 100000 --legacy-max-rows 100000
+    python benchmark_csv_loaders.py --no-snapshot
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+import pandas as pd
+
+from agent_v2 import load_hr_inputs, read_employees_csv, read_pse_data_csv
+from hr_snapshot import snapshots_available
+from synthetic_hr_data import generate_approved_values_csv, generate_workday_csv, generate_pse_csv
+
+# Average number of PSE rows per employee in the synthetic files
+PSE_ROWS_PER_EMPLOYEE = 5
+
+
+# -------------------------------
+# Original (iterrows) loaders, kept for comparison
+# -------------------------------
+def legacy_read_employees_csv(file_path):
+    df = pd.read_csv(file_path)
+    employees = []
+    for _, row in df.iterrows():
+        competencies = {}
+        if pd.notna(row.get('competencies')):
+            for comp in row['competencies'].split(','):
+                if ':' in comp:
+                    skill, level = comp.split(':', 1)
+                    competencies[skill.strip()] = level.strip()
+        certifications = []
+        if pd.notna(row.get('certifications')):
+            certifications = [cert.strip() for cert in row['certifications'].split(',')]
+        cloud_skills = []
+        if pd.notna(row.get('cloud_skills')):
+            cloud_skills = [skill.strip() for skill in row['cloud_skills'].split(',')]
+        employees.append({
+            'employee_id': row['employee_id'],
+            'name': row['name'],
+            'email': row['email'],
+            'competencies': competencies,
+            'certifications': certifications,
+            'cloud_skills': cloud_skills
+        })
+    return employees
+
+
+def legacy_read_pse_data_csv(file_path):
+    df = pd.read_csv(file_path)
+    grouped_data = {}
+    for _, row in df.iterrows():
+        employee_id = row['employee_id']
+        if employee_id not in grouped_data:
+            grouped_data[employee_id] = []
+        grouped_data[employee_id].append(row.to_dict())
+    return grouped_data
+
+
+# -------------------------------
+# Benchmark helpers
+# -------------------------------
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def _check_employees(legacy, vectorized):
+    assert len(legacy) == len(vectorized), "employee count differs"
+    for old, new in zip(legacy, vectorized):
+        assert str(old['employee_id']) == new['employee_id'], "employee_id differs"
+        for key in ('competencies', 'certifications', 'cloud_skills'):
+            assert old[key] == new[key], f"{key} differs for employee {new['employee_id']}"
+
+
+def _check_pse(legacy, vectorized):
+    assert len(legacy) == len(vectorized), "PSE employee count differs"
+    for employee_id, projects in legacy.items():
+        new_projects = vectorized[str(employee_id)]
+        assert len(projects) == len(new_projects), f"project count differs for employee {employee_id}"
+        for old, new in zip(projects, new_projects):
+            assert str(old['project_id']) == new['project_id'], f"project order differs for employee {employee_id}"
+
+
+def _canonical(value):
+    # NaN (empty CSV cells) compares unequal to itself; its JSON form does not
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _time_snapshot(workday_path, pse_path, approved_path, snapshot_dir, employees, pse):
+    """Seconds to build, open and fully read the snapshot of the files, checked against the CSV loaders."""
+    def load():
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            snapshot_employees, snapshot_pse, _, snapshot = load_hr_inputs(workday_path, pse_path, approved_path, snapshot_dir)
+        assert snapshot is not None, "the snapshot could not be used"
+        return snapshot_employees, snapshot_pse
+
+    _, build_time = _timed(load)
+    (snapshot_employees, snapshot_pse), open_time = _timed(load)
+    (read_employees, read_pse), read_time = _timed(
+        lambda: (list(snapshot_employees), {employee_id: snapshot_pse[employee_id] for employee_id in snapshot_pse}))
+    assert _canonical(read_employees) == _canonical(employees), "snapshot employees differ"
+    assert _canonical(read_pse) == _canonical(pse), "snapshot PSE data differs"
+    return {"snapshot_build": build_time, "snapshot_open": open_time, "snapshot_read": read_time}
+
+
+def run_benchmark(sizes, legacy_max_rows, snapshot=True):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        approved_path = generate_approved_values_csv(os.path.join(tmp_dir, "approved_values.csv"))
+        for rows in sizes:
+            num_employees = max(1, rows // PSE_ROWS_PER_EMPLOYEE)
+            workday_path = generate_workday_csv(os.path.join(tmp_dir, f"workday_{rows}.csv"), rows)
+            pse_path = generate_pse_csv(os.path.join(tmp_dir, f"pse_{rows}.csv"), rows, num_employees)
+
+            employees, employees_time = _timed(read_employees_csv, workday_path)
+            pse, pse_time = _timed(read_pse_data_csv, pse_path)
+            row = {"rows": rows, "employees_new": employees_time, "pse_new": pse_time,
+                   "employees_legacy": None, "pse_legacy": None}
+
+            if rows <= legacy_max_rows:
+                legacy_employees, row["employees_legacy"] = _timed(legacy_read_employees_csv, workday_path)
+                legacy_pse, row["pse_legacy"] = _timed(legacy_read_pse_data_csv, pse_path)
+                _check_employees(legacy_employees, employees)
+                _check_pse(legacy_pse, pse)
+            if snapshot:
+                row.update(_time_snapshot(workday_path, pse_path, approved_path, os.path.join(tmp_dir, "hr_snapshots"),
+                                          employees, pse))
+            results.append(row)
+    return results
+
+
+def print_results(results):
+    def fmt(seconds):
+        return f"{seconds:9.2f}s" if seconds is not None else "  skipped"
+
+    def speedup(legacy, new):
+        return f"{legacy / new:7.1f}x" if legacy is not None and new else "       -"
+
+    print(f"\n{'rows':>10} | {'workday legacy':>14} {'vectorized':>10} {'speedup':>8} | {'pse legacy':>10} {'vectorized':>10} {'speedup':>8}")
+    print("-" * 86)
+    for r in results:
+        print(f"{r['rows']:>10} | {fmt(r['employees_legacy']):>14} {fmt(r['employees_new']):>10} "
+              f"{speedup(r['employees_legacy'], r['employees_new']):>8} | {fmt(r['pse_legacy']):>10} "
+              f"{fmt(r['pse_new']):>10} {speedup(r['pse_legacy'], r['pse_new']):>8}")
+
+    if not any("snapshot_open" in r for r in results):
+        return
+    print(f"\n{'rows':>10} | {'csv (both)':>10} | {'snapshot build':>14} {'open':>10} {'read all':>10} {'speedup':>8}")
+    print("-" * 72)
+    for r in results:
+        csv_time = r['employees_new'] + r['pse_new']
+        print(f"{r['rows']:>10} | {fmt(csv_time):>10} | {fmt(r['snapshot_build']):>14} {fmt(r['snapshot_open']):>10} "
+              f"{fmt(r['snapshot_read']):>10} {speedup(csv_time, r['snapshot_open'] + r['snapshot_read']):>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the agent's CSV loaders")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="Number of rows in each synthetic Workday and PSE file")
+    parser.add_argument("--legacy-max-rows", type=int, default=1_000_000,
+                        help="Skip the (slow) iterrows loaders above this many rows")
+    parser.add_argument("--no-snapshot", action="store_true", help="Skip the HR snapshot timings")
+    args = parser.parse_args()
+
+    use_snapshot = not args.no_snapshot and snapshots_available()
+    if not args.no_snapshot and not use_snapshot:
+        print("pyarrow is not installed: skipping the HR snapshot timings")
+    print_results(run_benchmark(args.sizes, args.legacy_max_rows, use_snapshot))
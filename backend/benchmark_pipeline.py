@@ -0,0 +1,429 @@
+"""
+### benchmark_pipeline.py ###
+
+Offline end-to-end benchmark of the batch agent (agent_v2.main) and the recommendations API
+(app.py). Azure is replaced by test doubles: FakeLLM returns structured CompetencyAnalysis
+outputs after a log-normal latency, Cosmos DB is an InMemoryContainer and email goes to
+notifications.FakeEmailClient. Inputs are generated with synthetic_hr_data.
+
+Each scenario runs in a fresh process and reports employees per second, peak RSS and
+per-stage latency (from the agent's run report, or per API route), so pipeline regressions
+show up on a laptop. Peak RSS comes from the resource module, which Windows does not have;
+there it is reported as unavailable. tests/test_benchmark_pipeline.py runs every scenario at
+a small scale.
+
+Usage:
+    python benchmark_pipeline.py                                      # every scenario, 1000 employees
+    python benchmark_pipeline.py --scenarios agent agent_batched --employees 5000 --llm-latency-ms 200
+    python benchmark_pipeline.py --scenarios agent --snapshot         # inputs from an HR snapshot
+    python benchmark_pipeline.py --json benchmark_results.json
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+from typing import Optional
+
+from synthetic_hr_data import APPROVED_COMPETENCIES, LEVELS, generate_dataset
+
+if os.name != "nt":
+    import resource
+
+SCENARIOS = ["agent", "agent_stream", "agent_batched", "api"]
+
+# Average number of PSE rows per employee in the synthetic files
+PSE_ROWS_PER_EMPLOYEE = 5
+
+EMPLOYEE_ID_PATTERN = re.compile(r"### Employee ID: (\S+) ###")
+
+
+# -------------------------------
+# Test doubles
+# -------------------------------
+class FakeLLM:
+    """
+    Stand-in for the AzureChatOpenAI client used by call_llm_structured.
+
+    `with_structured_output(schema, include_raw=True).invoke(messages)` sleeps for a log-normal
+    latency (median `latency_ms`, shape `sigma`) and returns a valid `schema` instance with
+    usage metadata. Batched requests get one analysis per "### Employee ID" in the prompt.
+    """
+
+    def __init__(self, latency_ms: float = 50.0, sigma: float = 0.5, seed: int = 7):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def with_structured_output(self, schema, include_raw=False):
+        return _FakeStructuredRunnable(self, schema, include_raw)
+
+    def model_copy(self, update=None):
+        return self
+
+    def _latency(self) -> float:
+        with self._lock:
+            self.calls += 1
+            if self.latency_ms <= 0:
+                return 0.0
+            return self._random.lognormvariate(math.log(self.latency_ms / 1000), self.sigma)
+
+    def _analysis(self, rng: random.Random) -> dict:
+        competencies = rng.sample(APPROVED_COMPETENCIES, rng.randint(1, 4))
+        return {
+            "thought_process": "Matched project requirements and certifications against the approved competencies.",
+            "new_competencies": [
+                {
+                    "competency": competency,
+                    "level": rng.choice(LEVELS),
+                    "confidence": rng.randint(50, 99),
+                    "reasoning": f"Delivered several projects requiring {competency}."
+                }
+                for competency in competencies
+            ]
+        }
+
+
+class _FakeStructuredRunnable:
+    def __init__(self, llm: FakeLLM, schema, include_raw: bool):
+        self.llm = llm
+        self.schema = schema
+        self.include_raw = include_raw
+
+    def invoke(self, messages):
+        from langchain_core.messages import AIMessage
+        from prompt_builder import estimate_prompt_tokens
+
+        time.sleep(self.llm._latency())
+        prompt = "\n".join(message["content"] for message in messages)
+        rng = random.Random(prompt)
+        if "results" in self.schema.model_fields:
+            data = {"results": [{"employee_id": employee_id, "analysis": self.llm._analysis(rng)}
+                                for employee_id in EMPLOYEE_ID_PATTERN.findall(prompt)]}
+        else:
+            data = self.llm._analysis(rng)
+        parsed = self.schema.model_validate(data)
+        if not self.include_raw:
+            return parsed
+
+        input_tokens = estimate_prompt_tokens(messages)
+        output_tokens = len(parsed.model_dump_json()) // 4
+        raw = AIMessage(content="", usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens
+        })
+        return {"raw": raw, "parsed": parsed, "parsing_error": None}
+
+
+# -------------------------------
+# Scenario helpers
+# -------------------------------
+def _configure_environment(options):
+    # Every FakeLLM call must be measured, not answered from the response cache
+    os.environ["LLM_CACHE_ENABLED"] = "0"
+    os.environ["AOAI_TPM_LIMIT"] = str(options["tpm_limit"])
+    os.environ["AOAI_RPM_LIMIT"] = str(max(1, options["tpm_limit"] * 6 // 1000))
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB, or None where it is not available (Windows)."""
+    if os.name == "nt":
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _latency_summary(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+
+    def percentile(fraction):
+        return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+    return {
+        "count": len(values),
+        "p50_seconds": round(percentile(0.50), 4),
+        "p95_seconds": round(percentile(0.95), 4),
+        "p99_seconds": round(percentile(0.99), 4),
+        "max_seconds": round(values[-1], 4)
+    }
+
+
+# -------------------------------
+# Scenarios (each runs in its own process)
+# -------------------------------
+def run_agent_scenario(paths, options, stream=False, batch_size=1):
+    """Run agent_v2.main over the synthetic dataset with FakeLLM, in-memory Cosmos DB and a fake email client."""
+    _configure_environment(options)
+    report_dir = tempfile.mkdtemp(prefix="benchmark_reports_")
+    # The run journal (checkpointing included in the measurement) goes next to the report
+    os.environ["AGENT_JOURNAL_DIR"] = report_dir
+    import agent_v2
+    from cosmos_db import CosmosDBManager
+    from cosmos_db_memory import InMemoryContainer
+    from cosmos_telemetry import LEDGER
+    from notifications import FakeEmailClient
+
+    fake_llm = FakeLLM(options["llm_latency_ms"], options["llm_latency_sigma"])
+    email_client = FakeEmailClient(options["email_latency_ms"], sigma=options["llm_latency_sigma"], keep_messages=False)
+    agent_v2.llm = fake_llm
+    agent_v2.email_client = email_client
+    agent_v2.ENABLE_EMAIL_NOTIFICATIONS = options["email"]
+    container = InMemoryContainer()
+
+    with open(os.devnull, "w") as devnull:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(devnull):
+            report = agent_v2.main(
+                max_concurrency=options["concurrency"],
+                stream=stream,
+                chunksize=options["chunk_size"],
+                employees_csv=paths["workday"],
+                pse_csv=paths["pse"],
+                approved_values_csv=paths["approved"],
+                force=True,
+                batch_size=batch_size,
+                report_dir=report_dir,
+                max_employees=options["employees"],
+                cosmos_db_manager=CosmosDBManager.from_container(container),
+                journal_backend=options["journal"],
+                snapshot_dir=paths.get("snapshot_dir")
+            )
+        elapsed = time.perf_counter() - started
+    shutil.rmtree(report_dir, ignore_errors=True)
+
+    processed = report["summary"]["processed"]
+    return {
+        "employees": processed,
+        "seconds": round(elapsed, 3),
+        "employees_per_second": round(processed / elapsed, 2) if elapsed else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "failed": report["summary"]["failed"],
+        "llm_calls": fake_llm.calls,
+        "emails": email_client.sent,
+        "tokens": report["tokens"],
+        "request_charge": round(LEDGER.total("request_charge"), 2),
+        "stages": report["stages"]
+    }
+
+
+def _seed_recommendations(container, workday_csv, seed=11):
+    """Store one analyzed-employee document per Workday row, as the agent would."""
+    import csv
+    from recommendation_payload import RECOMMENDATIONS_SCHEMA_VERSION, build_recommendations_payload
+
+    fake_llm = FakeLLM(latency_ms=0)
+    rng = random.Random(seed)
+    employee_ids = []
+    with open(workday_csv, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            analysis = fake_llm._analysis(rng)
+            container.upsert_item({
+                "id": row["employee_id"],
+                "partitionKey": "people",
+                "employee_id": row["employee_id"],
+                "employee_name": row["name"],
+                "employee_email": row["email"],
+                "analysis_result": analysis,
+                "notification_sent": rng.random() < 0.5,
+                "approved": False,
+                "recommendations_payload": build_recommendations_payload(
+                    row["employee_id"], row["name"], analysis["new_competencies"]),
+                "recommendations_schema_version": RECOMMENDATIONS_SCHEMA_VERSION
+            })
+            employee_ids.append(row["employee_id"])
+    return employee_ids
+
+
+def run_api_scenario(paths, options):
+    """Serve every synthetic employee through app.py (in-memory Cosmos DB) and time each route."""
+    _configure_environment(options)
+    os.environ.setdefault("API_LOG_LEVEL", "WARNING")
+    import httpx
+    import app
+    from cosmos_db_async import AsyncCosmosDBManager
+    from cosmos_db_memory import AsyncInMemoryContainer, InMemoryContainer
+
+    container = InMemoryContainer()
+    employee_ids = _seed_recommendations(container, paths["workday"])[:options["employees"]]
+    app.cosmos_manager = AsyncCosmosDBManager.from_container(AsyncInMemoryContainer(container))
+    bulk_size = min(options["bulk_size"], app.MAX_BATCH_IDS)
+
+    async def timed_requests(client, urls):
+        queue = list(reversed(urls))
+        latencies = []
+
+        async def worker():
+            while queue:
+                url = queue.pop()
+                started = time.perf_counter()
+                response = await client.get(url)
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, f"{url} returned {response.status_code}"
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(options["concurrency"])))
+        return latencies, time.perf_counter() - started
+
+    async def walk_pages(client):
+        latencies, served, token = [], 0, None
+        started = time.perf_counter()
+        while True:
+            params = {"page_size": 100}
+            if token:
+                params["continuation_token"] = token
+            request_started = time.perf_counter()
+            response = await client.get("/api/recommendations/page", params=params)
+            latencies.append(time.perf_counter() - request_started)
+            body = response.json()
+            served += len(body["items"])
+            token = body["continuation_token"]
+            if not token:
+                return latencies, time.perf_counter() - started, served
+
+    async def run():
+        transport = httpx.ASGITransport(app=app.app)
+        routes = {}
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            single = [f"/api/recommendations/{employee_id}" for employee_id in employee_ids]
+            for phase in ("get_one_cold", "get_one_cached"):
+                latencies, seconds = await timed_requests(client, single)
+                routes[phase] = (latencies, seconds, len(employee_ids))
+
+            app.recommendations_cache.clear()
+            bulk = ["/api/recommendations?ids=" + ",".join(employee_ids[i:i + bulk_size])
+                    for i in range(0, len(employee_ids), bulk_size)]
+            latencies, seconds = await timed_requests(client, bulk)
+            routes["get_many_cold"] = (latencies, seconds, len(employee_ids))
+
+            routes["list_pages"] = await walk_pages(client)
+        await app.close_shared_clients()
+        return routes
+
+    started = time.perf_counter()
+    routes = asyncio.run(run())
+    elapsed = time.perf_counter() - started
+
+    stages = {}
+    for name, (latencies, seconds, served) in routes.items():
+        stages[name] = {**_latency_summary(latencies), "employees_per_second": round(served / seconds, 2) if seconds else 0.0}
+    return {
+        "employees": len(employee_ids),
+        "seconds": round(elapsed, 3),
+        "employees_per_second": stages["get_one_cold"]["employees_per_second"],
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": stages
+    }
+
+
+def _run_scenario(name, paths, options):
+    if name == "agent":
+        return run_agent_scenario(paths, options)
+    if name == "agent_stream":
+        return run_agent_scenario(paths, options, stream=True)
+    if name == "agent_batched":
+        return run_agent_scenario(paths, options, batch_size=options["batch_size"])
+    if name == "api":
+        return run_api_scenario(paths, options)
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+def _build_snapshot(paths, data_dir):
+    """Build the HR snapshot of the dataset, so the agent scenarios measure a warm re-run."""
+    from agent_v2 import load_hr_inputs
+    from hr_snapshot import snapshots_available
+
+    if not snapshots_available():
+        raise SystemExit("--snapshot needs pyarrow")
+    snapshot_dir = os.path.join(data_dir, "hr_snapshots")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        load_hr_inputs(paths["workday"], paths["pse"], paths["approved"], snapshot_dir)
+    return snapshot_dir
+
+
+def run_benchmark(scenarios, options):
+    """Generate the dataset once, then run each scenario in a fresh process (so peak RSS is its own)."""
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as data_dir:
+        paths = generate_dataset(data_dir, options["employees"], options["employees"] * PSE_ROWS_PER_EMPLOYEE, options["seed"])
+        if options["snapshot"]:
+            paths["snapshot_dir"] = _build_snapshot(paths, data_dir)
+        for name in scenarios:
+            print(f"Running {name}...", flush=True)
+            with context.Pool(1) as pool:
+                results[name] = pool.apply(_run_scenario, (name, paths, options))
+    return results
+
+
+def print_results(results):
+    print(f"\n{'scenario':<16} {'employees':>9} {'seconds':>9} {'employees/s':>12} {'peak RSS MB':>12}")
+    print("-" * 62)
+    for name, result in results.items():
+        print(f"{name:<16} {result['employees']:>9} {result['seconds']:>9.2f} "
+              f"{result['employees_per_second']:>12.1f} "
+              + (f"{result['peak_rss_mb']:>12.1f}" if result['peak_rss_mb'] is not None else f"{'n/a':>12}"))
+
+    for name, result in results.items():
+        print(f"\n{name}: latency per stage")
+        print(f"  {'stage':<18} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for stage, summary in result["stages"].items():
+            if not summary.get("count"):
+                continue
+            print(f"  {stage:<18} {summary['count']:>7} {summary['p50_seconds'] * 1000:>9.1f} "
+                  f"{summary['p95_seconds'] * 1000:>9.1f} {summary['p99_seconds'] * 1000:>9.1f} "
+                  f"{summary['max_seconds'] * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the agent pipeline and the API")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--employees", type=int, default=1000,
+                        help="Number of synthetic employees (PSE rows are generated at 5 per employee)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Agent employees in flight, or concurrent API clients")
+    parser.add_argument("--batch-size", type=int, default=4, help="LLM batch size of the agent_batched scenario")
+    parser.add_argument("--chunk-size", type=int, default=20000, help="Rows per chunk of the agent_stream scenario")
+    parser.add_argument("--bulk-size", type=int, default=50, help="Employee ids per bulk API request")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="Median FakeLLM latency")
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.5,
+                        help="Shape of the log-normal FakeLLM latency (0 makes it constant)")
+    parser.add_argument("--tpm-limit", type=int, default=100_000_000,
+                        help="Tokens-per-minute quota given to the LLM scheduler (default effectively unlimited)")
+    parser.add_argument("--email", action="store_true", help="Enable notifications (sent to the fake email client)")
+    parser.add_argument("--email-latency-ms", type=float, default=200.0,
+                        help="Median time for the fake email client to finish a send (with --email)")
+    parser.add_argument("--journal", choices=["file", "cosmos", "off"], default="file",
+                        help="Run journal backend of the agent scenarios (cosmos uses the in-memory container)")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="Load the agent inputs from an HR snapshot built before the scenarios (needs pyarrow)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    benchmark_options = {
+        "employees": args.employees, "concurrency": args.concurrency, "batch_size": args.batch_size,
+        "chunk_size": args.chunk_size, "bulk_size": args.bulk_size, "llm_latency_ms": args.llm_latency_ms,
+        "llm_latency_sigma": args.llm_latency_sigma, "tpm_limit": args.tpm_limit, "email": args.email,
+        "email_latency_ms": args.email_latency_ms, "journal": args.journal, "snapshot": args.snapshot,
+        "seed": args.seed
+    }
+    benchmark_results = run_benchmark(args.scenarios, benchmark_options)
+    print_results(benchmark_results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"options": benchmark_options, "results": benchmark_results}, f, indent=2)
+        print(f"\nResults written to {args.json}")
@@ -0,0 +1,166 @@
+"""
+### competency_rules.py ###
+
+Deterministic pre-analysis stage for the competencies agent. Direct evidence is resolved with
+set operations instead of an LLM call:
+
+    * a PSE project required an approved competency the employee does not have listed, or
+    * a certification or cloud skill (the employee's own, or one a project required) is itself
+      the name of an approved competency.
+
+These become 100%-confidence recommendations. What is left for the LLM is the residual
+inference work: approved competencies with no direct evidence, and certifications, cloud
+skills and project requirements that do not name an approved competency, plus every other
+non-empty project field (name, role, description, ...) apart from ids and dates. When either
+side is empty there is nothing to infer and the LLM call can be skipped.
+
+The requirement columns (PSE_*_COLUMNS) are optional: PSE exports that only describe projects
+in free text (name/role/duration/description) send every employee with projects to the LLM.
+missing_pse_columns reports which configured columns a PSE file lacks.
+
+Recommendations are returned as plain dicts with the fields of CompetencyRecommendation.
+"""
+
+from typing import Any, Dict, Iterable, List
+
+# PSE columns listing what a project required (comma separated values)
+PSE_COMPETENCY_COLUMNS = ("required_competencies",)
+PSE_CERTIFICATION_COLUMNS = ("required_certifications",)
+PSE_CLOUD_SKILL_COLUMNS = ("required_cloud_skills",)
+PSE_PROJECT_NAME_COLUMNS = ("project_name", "name", "project_id")
+# PSE columns that identify or date a project; they are not evidence of a competency
+PSE_METADATA_COLUMNS = ("employee_id", "project_id", "start_date", "end_date", "duration", "hours")
+
+# Level assigned from the number of independent pieces of evidence (projects, certifications, skills)
+LEVEL_THRESHOLDS = ((7, "expert"), (4, "advanced"), (2, "intermediate"), (1, "beginner"))
+
+
+def normalize(name: Any) -> str:
+    """Case- and whitespace-insensitive form of a competency, certification or skill name."""
+    return " ".join(str(name).split()).casefold()
+
+
+def split_values(value: Any) -> List[str]:
+    """Split a comma separated cell into stripped, non-empty values (missing cells give [])."""
+    if not isinstance(value, str):
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _column_values(project: Dict[str, Any], columns: Iterable[str]) -> List[str]:
+    values = []
+    for column in columns:
+        values.extend(split_values(project.get(column)))
+    return values
+
+
+def _project_label(project: Dict[str, Any], index: int) -> str:
+    for column in PSE_PROJECT_NAME_COLUMNS:
+        if isinstance(project.get(column), str) and project[column].strip():
+            return project[column].strip()
+    return f"Project {index}"
+
+
+def missing_pse_columns(columns: Iterable[str]) -> Dict[str, List[str]]:
+    """Configured PSE column groups of which none is in `columns` (a PSE file's header)."""
+    present = set(columns)
+    groups = {
+        "required_competencies": PSE_COMPETENCY_COLUMNS,
+        "required_certifications": PSE_CERTIFICATION_COLUMNS,
+        "required_cloud_skills": PSE_CLOUD_SKILL_COLUMNS,
+        "project_name": PSE_PROJECT_NAME_COLUMNS
+    }
+    return {group: list(names) for group, names in groups.items() if not present.intersection(names)}
+
+
+def level_for_evidence(count: int) -> str:
+    for threshold, level in LEVEL_THRESHOLDS:
+        if count >= threshold:
+            return level
+    return "beginner"
+
+
+def derive_direct_competencies(employee: Dict[str, Any], employee_pse_data: List[Dict[str, Any]],
+                               approved_competencies: List[str]) -> Dict[str, Any]:
+    """
+    Compute direct competency matches for one employee.
+
+    :return: {
+        "recommendations": [{competency, level, confidence, reasoning}, ...],
+        "candidate_competencies": approved competencies neither held nor directly matched,
+        "unmapped_evidence": {"certifications": [...], "cloud_skills": [...], "project_requirements": [...],
+                              "project_details": ["<project>: <column>", ...]},
+        "needs_llm": True if residual inference work remains,
+        "summary": one paragraph describing the deterministic matches
+    }
+    """
+    approved = {normalize(name): name for name in approved_competencies}
+    held = {normalize(name) for name in (employee.get("competencies") or {})}
+
+    # evidence[normalized approved competency] -> list of human readable sources
+    evidence: Dict[str, List[str]] = {}
+
+    def add_evidence(name: str, source: str) -> bool:
+        key = normalize(name)
+        if key not in approved:
+            return False
+        if key not in held:
+            sources = evidence.setdefault(key, [])
+            if source not in sources:
+                sources.append(source)
+        return True
+
+    unmapped_certifications = [c for c in employee.get("certifications") or [] if not add_evidence(c, f"certification '{c}'")]
+    unmapped_cloud_skills = [s for s in employee.get("cloud_skills") or [] if not add_evidence(s, f"cloud skill '{s}'")]
+
+    # Columns the rules match exactly; the others (besides ids and dates) are left to the LLM
+    consumed_columns = set(PSE_COMPETENCY_COLUMNS + PSE_CERTIFICATION_COLUMNS + PSE_CLOUD_SKILL_COLUMNS + PSE_METADATA_COLUMNS)
+    unmapped_requirements = set()
+    project_details = []
+    for index, project in enumerate(employee_pse_data, 1):
+        label = _project_label(project, index)
+        project_details.extend(
+            f"{label}: {column}" for column, value in project.items()
+            if column not in consumed_columns and isinstance(value, str) and value.strip()
+        )
+        requirements = (
+            _column_values(project, PSE_COMPETENCY_COLUMNS)
+            + _column_values(project, PSE_CERTIFICATION_COLUMNS)
+            + _column_values(project, PSE_CLOUD_SKILL_COLUMNS)
+        )
+        for requirement in requirements:
+            if not add_evidence(requirement, f"project '{label}'"):
+                unmapped_requirements.add(requirement)
+
+    recommendations = []
+    for key, sources in sorted(evidence.items(), key=lambda item: (-len(item[1]), item[0])):
+        recommendations.append({
+            "competency": approved[key],
+            "level": level_for_evidence(len(sources)),
+            "confidence": 100,
+            "reasoning": (f"Direct match: required or held via {len(sources)} source(s): {', '.join(sources[:10])}"
+                          f"{' and more' if len(sources) > 10 else ''}. Level derived from the amount of evidence.")
+        })
+
+    candidate_competencies = [name for key, name in approved.items() if key not in held and key not in evidence]
+    unmapped_evidence = {
+        "certifications": unmapped_certifications,
+        "cloud_skills": unmapped_cloud_skills,
+        "project_requirements": sorted(unmapped_requirements),
+        "project_details": project_details
+    }
+    has_residual_evidence = any(unmapped_evidence.values())
+
+    if recommendations:
+        summary = ("Deterministic matching found " + ", ".join(r["competency"] for r in recommendations)
+                   + " directly in the employee's certifications, cloud skills or project requirements.")
+    else:
+        summary = "Deterministic matching found no approved competencies directly in the employee's data."
+
+    return {
+        "recommendations": recommendations,
+        "candidate_competencies": candidate_competencies,
+        "unmapped_evidence": unmapped_evidence,
+        "needs_llm": bool(candidate_competencies) and has_residual_evidence,
+        "summary": summary
+    }
@@ -6,27 +6,90 @@ and CRUD operations on documents. It automatically selects between key-based and
 authentication based on the presence of COSMOS_MASTER_KEY. Logging is configured to show only
 custom messages.
 
+read_item and patch_item are point operations by id and partition key; patch_item updates individual
+fields (optionally guarded by an ETag) instead of replacing the whole document.
+
+Every container call records its latency, request charge and retries, per operation and caller tag
+(see cosmos_telemetry.py).
+
+The CosmosClient and credential are shared by every manager in the process (one connection pool
+per account), and each database/container is created or looked up only once per process. With
+COSMOS_CONTAINER_MUST_EXIST=1 the database and container are assumed to exist and no create calls
+are made. Slow DefaultAzureCredential sources can be skipped with AZURE_CREDENTIAL_EXCLUDE
+(see azure_credentials.py).
+cosmos_db_async.AsyncCosmosDBManager offers the same surface on azure.cosmos.aio.
+
+Bulk writes (bulk_upsert_items, bulk_patch_items) group documents by partition key and run batches
+concurrently.
+For offline use, wrap cosmos_db_memory.InMemoryContainer with CosmosDBManager.from_container.
+
 Requirements:
-    azure-cosmos==4.5.1
+    azure-cosmos==4.7.0
     azure-identity==1.12.0
 """
 
 import os
-from typing import List, Dict, Any, Optional
+import time
+import random
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Optional
 from dotenv import load_dotenv
+from azure.core import MatchConditions
 from azure.cosmos import CosmosClient, exceptions, PartitionKey
 from azure.cosmos.container import ContainerProxy
 from azure.cosmos.database import DatabaseProxy
-from azure.identity import DefaultAzureCredential
+from azure_credentials import credential_options
+from cosmos_telemetry import track_operation
+
+# Maximum number of operations in one Cosmos DB transactional batch
+TRANSACTIONAL_BATCH_LIMIT = 100
+
+# Attach to an existing database and container without create calls (no control-plane requests
+# at startup); a missing container then surfaces as a 404 on the first operation
+CONTAINER_MUST_EXIST = os.getenv("COSMOS_CONTAINER_MUST_EXIST", "0") != "0"
+
+# Process-wide clients keyed by (host, tenant) and containers keyed by (host, database, container)
+_shared_clients: Dict[tuple, CosmosClient] = {}
+_shared_containers: Dict[tuple, tuple] = {}
+_shared_lock = threading.Lock()
+
+
+def _retry_after_seconds(error: exceptions.CosmosHttpResponseError, attempt: int) -> float:
+    """Delay before retrying a throttled operation: the service's hint, else jittered exponential backoff."""
+    retry_after_ms = (getattr(error, 'headers', None) or {}).get('x-ms-retry-after-ms')
+    if retry_after_ms:
+        return float(retry_after_ms) / 1000.0
+    return random.uniform(0, min(30.0, 0.1 * (2 ** attempt)))
+
 
 class CosmosDBManager:
-    def __init__(self, cosmos_host=None, cosmos_database_id=None, cosmos_container_id=None):
+    def __init__(self, cosmos_host=None, cosmos_database_id=None, cosmos_container_id=None,
+                 container_must_exist: bool = CONTAINER_MUST_EXIST):
+        self.container_must_exist = container_must_exist
         self._load_env_variables(cosmos_host, cosmos_database_id, cosmos_container_id)
         self.client = self._get_cosmos_client()
         self.database: Optional[DatabaseProxy] = None
         self.container: Optional[ContainerProxy] = None
         self._initialize_database_and_container()
 
+    @classmethod
+    def from_container(cls, container, cosmos_database_id: str = "local", cosmos_container_id: Optional[str] = None) -> "CosmosDBManager":
+        """
+        Build a manager around an existing container, without connecting to Cosmos DB.
+
+        Used with cosmos_db_memory.InMemoryContainer to run and test code offline.
+        """
+        manager = cls.__new__(cls)
+        manager.cosmos_host = None
+        manager.cosmos_database_id = cosmos_database_id
+        manager.cosmos_container_id = cosmos_container_id or getattr(container, 'id', None)
+        manager.client = None
+        manager.database = None
+        manager.container = container
+        return manager
+
     def _load_env_variables(self, cosmos_host=None, cosmos_database_id=None, cosmos_container_id=None):
         load_dotenv()
         self.cosmos_host = cosmos_host or os.environ.get("COSMOS_HOST")
@@ -38,23 +101,40 @@ class CosmosDBManager:
             raise ValueError("Cosmos DB configuration is incomplete")
 
     def _get_cosmos_client(self) -> CosmosClient:
-        print("Initializing Cosmos DB client")
-        print("Using DefaultAzureCredential for Cosmos DB authentication")
-        credential = DefaultAzureCredential(
-            interactive_browser_tenant_id=self.tenant_id,
-            visual_studio_code_tenant_id=self.tenant_id,
-            workload_identity_tenant_id=self.tenant_id,
-            shared_cache_tenant_id=self.tenant_id
-        )
-        return CosmosClient(self.cosmos_host, credential=credential)
+        """Return the process-wide client for this host, creating it (and its credential) on first use."""
+        key = (self.cosmos_host, self.tenant_id)
+        with _shared_lock:
+            client = _shared_clients.get(key)
+            if client is None:
+                # Imported on first use: azure.identity is a large import that only this path needs
+                from azure.identity import DefaultAzureCredential
+                print("Initializing Cosmos DB client")
+                print("Using DefaultAzureCredential for Cosmos DB authentication")
+                credential = DefaultAzureCredential(**credential_options(self.tenant_id))
+                client = CosmosClient(self.cosmos_host, credential=credential)
+                _shared_clients[key] = client
+            return client
 
     def _initialize_database_and_container(self) -> None:
+        key = (self.cosmos_host, self.cosmos_database_id, self.cosmos_container_id)
+        with _shared_lock:
+            shared = _shared_containers.get(key)
+        if shared is not None:
+            self.database, self.container = shared
+            return
         try:
-            self.database = self._create_or_get_database()
-            self.container = self._create_or_get_container()
+            if self.container_must_exist:
+                # Proxies only: no request is made until the first operation
+                self.database = self.client.get_database_client(self.cosmos_database_id)
+                self.container = self.database.get_container_client(self.cosmos_container_id)
+            else:
+                self.database = self._create_or_get_database()
+                self.container = self._create_or_get_container()
         except exceptions.CosmosHttpResponseError as e:
             print(f'An error occurred: {e.message}')
             raise
+        with _shared_lock:
+            _shared_containers[key] = (self.database, self.container)
 
     def _create_or_get_database(self) -> DatabaseProxy:
         try:
@@ -82,7 +162,8 @@ class CosmosDBManager:
         :return: The created item, or None if creation failed
         """
         try:
-            created_item = self.container.create_item(body=item)
+            with track_operation("create") as hook:
+                created_item = self.container.create_item(body=item, response_hook=hook)
             print(f"Item created with id: {created_item['id']}")
             return created_item
         except exceptions.CosmosResourceExistsError:
@@ -92,17 +173,24 @@ class CosmosDBManager:
             print(f"An error occurred during creation: {e.message}")
             return None
 
-    def update_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+    def update_item(self, item: Dict[str, Any], etag: Optional[str] = None) -> Dict[str, Any]:
         """
         Update an existing item in the container. Fails if the item doesn't exist.
 
         :param item: The item to update (must include 'id' and 'partitionKey')
+        :param etag: If given, the item is only replaced while it still has this ETag
         :return: The updated item, or None if update failed
+        :raises CosmosAccessConditionFailedError: If `etag` no longer matches (HTTP 412)
         """
+        kwargs = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
         try:
-            updated_item = self.container.replace_item(item=item['id'], body=item)
+            with track_operation("replace") as hook:
+                updated_item = self.container.replace_item(item=item['id'], body=item, response_hook=hook, **kwargs)
             print(f"Item updated with id: {updated_item['id']}")
             return updated_item
+        except exceptions.CosmosAccessConditionFailedError:
+            print(f"Item with id {item['id']} was modified since it was read. Update not applied.")
+            raise
         except exceptions.CosmosResourceNotFoundError:
             print(f"Item with id {item['id']} not found. Unable to update.")
             return None
@@ -118,21 +206,65 @@ class CosmosDBManager:
         :return: The upserted item, or None if upsert failed
         """
         try:
-            upserted_item = self.container.upsert_item(body=item)
+            with track_operation("upsert") as hook:
+                upserted_item = self.container.upsert_item(body=item, response_hook=hook)
             print(f"Item upserted with id: {upserted_item['id']}")
             return upserted_item
         except exceptions.CosmosHttpResponseError as e:
             print(f"An error occurred during upsert: {e.message}")
             return None
 
+    def read_item(self, item_id: str, partition_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Point read of one item by id and partition key (much cheaper than a query).
+
+        :return: The item, or None if it does not exist or the read failed
+        """
+        try:
+            with track_operation("read") as hook:
+                return self.container.read_item(item=item_id, partition_key=partition_key, response_hook=hook)
+        except exceptions.CosmosResourceNotFoundError:
+            print(f"Item with id {item_id} not found.")
+            return None
+        except exceptions.CosmosHttpResponseError as e:
+            print(f"An error occurred during read: {e.message}")
+            return None
+
+    def patch_item(self, item_id: str, partition_key: str, patch_operations: List[Dict[str, Any]], etag: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Apply field-level patch operations to an item without replacing the whole document.
+
+        :param patch_operations: e.g. [{"op": "set", "path": "/notification_sent", "value": True}]
+        :param etag: If given, the patch only applies while the item still has this ETag
+        :return: The patched item, or None if it does not exist or the patch failed
+        :raises CosmosAccessConditionFailedError: If `etag` no longer matches (HTTP 412)
+        """
+        kwargs = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
+        try:
+            with track_operation("patch") as hook:
+                patched_item = self.container.patch_item(item=item_id, partition_key=partition_key, patch_operations=patch_operations, response_hook=hook, **kwargs)
+            print(f"Item patched with id: {item_id}")
+            return patched_item
+        except exceptions.CosmosAccessConditionFailedError:
+            print(f"Item with id {item_id} was modified since it was read. Patch not applied.")
+            raise
+        except exceptions.CosmosResourceNotFoundError:
+            print(f"Item with id {item_id} not found. Unable to patch.")
+            return None
+        except exceptions.CosmosHttpResponseError as e:
+            print(f"An error occurred during patch: {e.message}")
+            return None
+
     def query_items(self, query: str, parameters: Optional[List[Dict[str, Any]]] = None, partition_key: Optional[str] = None) -> List[Dict[str, Any]]:
         try:
-            items = list(self.container.query_items(
-                query=query,
-                parameters=parameters,
-                partition_key=partition_key,
-                enable_cross_partition_query=(partition_key is None)
-            ))
+            with track_operation("query", query=query) as hook:
+                items = list(self.container.query_items(
+                    query=query,
+                    parameters=parameters,
+                    partition_key=partition_key,
+                    enable_cross_partition_query=(partition_key is None),
+                    response_hook=hook
+                ))
             print(f"Query returned {len(items)} items")
             return items
         except exceptions.CosmosHttpResponseError as e:
@@ -141,7 +273,8 @@ class CosmosDBManager:
 
     def delete_item(self, item_id: str, partition_key: str) -> bool:
         try:
-            self.container.delete_item(item=item_id, partition_key=partition_key)
+            with track_operation("delete") as hook:
+                self.container.delete_item(item=item_id, partition_key=partition_key, response_hook=hook)
             print(f"Item deleted with id: {item_id}")
             return True
         except exceptions.CosmosResourceNotFoundError:
@@ -151,6 +284,128 @@ class CosmosDBManager:
             print(f"An error occurred during deletion: {e.message}")
             return False
 
+    def bulk_upsert_items(self, items: Iterable[Dict[str, Any]], max_concurrency: int = 8, max_retries: int = 5) -> Dict[str, Any]:
+        """
+        Upsert many items, grouped by partitionKey and written concurrently.
+
+        Items sharing a partition key are written as transactional batches of up to 100
+        operations (execute_item_batch); when an operation of a batch fails, the batch is
+        rolled back and its items are written one by one, so each gets its own outcome. Throttled (429) operations are retried after the
+        service's retry-after interval, on top of the SDK's own retries.
+
+        :param items: The items to upsert (each must include 'id' and 'partitionKey')
+        :param max_concurrency: Maximum number of batches written at the same time
+        :param max_retries: Retries per throttled operation
+        :return: {"results": [{id, partitionKey, success, status_code, request_charge, error}, ...],
+                  "succeeded": int, "failed": int, "request_charge": float}
+        """
+        return self._bulk_write(items, "upsert", max_concurrency, max_retries)
+
+    def bulk_patch_items(self, patches: Iterable[Dict[str, Any]], max_concurrency: int = 8, max_retries: int = 5) -> Dict[str, Any]:
+        """
+        Apply field-level patch operations to many items, grouped by partitionKey like bulk_upsert_items.
+
+        A transactional batch fails as a whole if one of its items no longer exists; its patches
+        are then applied one by one, so only the missing items are reported as failed (404).
+
+        :param patches: [{"id": ..., "partitionKey": ..., "operations": [{"op": "set", ...}]}, ...]
+        :return: Same shape as bulk_upsert_items
+        """
+        return self._bulk_write(patches, "patch", max_concurrency, max_retries)
+
+    def _bulk_write(self, items: Iterable[Dict[str, Any]], operation: str, max_concurrency: int, max_retries: int) -> Dict[str, Any]:
+        groups = defaultdict(list)
+        for item in items:
+            groups[item.get('partitionKey')].append(item)
+        chunks = [
+            (partition_key, group[start:start + TRANSACTIONAL_BATCH_LIMIT])
+            for partition_key, group in groups.items()
+            for start in range(0, len(group), TRANSACTIONAL_BATCH_LIMIT)
+        ]
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="cosmos-bulk") as executor:
+            chunk_results = list(executor.map(lambda chunk: self._write_chunk(chunk[0], chunk[1], operation, max_retries), chunks))
+
+        results = [result for chunk in chunk_results for result in chunk]
+        succeeded = sum(1 for result in results if result['success'])
+        request_charge = sum(result['request_charge'] for result in results)
+        print(f"Bulk {operation}: {succeeded} succeeded, {len(results) - succeeded} failed, {request_charge:.2f} RU")
+        return {
+            "results": results,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "request_charge": request_charge
+        }
+
+    def _call_with_throttle_retry(self, call, max_retries: int, operation: str = "upsert"):
+        """Run call(response_hook), retrying 429s. Returns (result, request charge of the successful attempt)."""
+        attempt = 0
+        while True:
+            try:
+                with track_operation(operation) as hook:
+                    # Each attempt gets a fresh hook: count this one retry, not the running total
+                    if attempt:
+                        hook.retries += 1
+                    result = call(hook)
+                return result, hook.request_charge
+            except exceptions.CosmosHttpResponseError as e:
+                if e.status_code != 429 or attempt >= max_retries:
+                    raise
+                time.sleep(_retry_after_seconds(e, attempt))
+                attempt += 1
+
+    @staticmethod
+    def _item_outcome(item: Dict[str, Any], success: bool, status_code: int, request_charge: float, error: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "id": item.get('id'),
+            "partitionKey": item.get('partitionKey'),
+            "success": success,
+            "status_code": status_code,
+            "request_charge": request_charge,
+            "error": error
+        }
+
+    def _write_chunk(self, partition_key: Any, items: List[Dict[str, Any]], operation: str, max_retries: int) -> List[Dict[str, Any]]:
+        """Upsert or patch items of one partition key: as one transactional batch if possible, else one by one."""
+        if operation == "patch":
+            batch_operation = lambda item: ("patch", (item['id'], item['operations']))
+            write_one = lambda item, hook: self.container.patch_item(
+                item=item['id'], partition_key=partition_key, patch_operations=item['operations'], response_hook=hook)
+        else:
+            batch_operation = lambda item: ("upsert", (item,))
+            write_one = lambda item, hook: self.container.upsert_item(body=item, response_hook=hook)
+
+        if len(items) > 1:
+            try:
+                _, charge = self._call_with_throttle_retry(
+                    lambda hook: self.container.execute_item_batch(
+                        batch_operations=[batch_operation(item) for item in items],
+                        partition_key=partition_key,
+                        response_hook=hook
+                    ),
+                    max_retries,
+                    operation="batch"
+                )
+                return [self._item_outcome(item, True, 200, charge / len(items)) for item in items]
+            except exceptions.CosmosBatchOperationError as e:
+                # One operation failed (the others report 424) and nothing was applied
+                failed_id = items[e.error_index].get('id') if e.error_index is not None else None
+                print(f"Transactional batch for partition {partition_key} failed on item {failed_id} "
+                      f"({e.status_code}); writing items individually")
+            except exceptions.CosmosHttpResponseError as e:
+                print(f"Transactional batch for partition {partition_key} failed ({e.status_code}); writing items individually")
+
+        outcomes = []
+        for item in items:
+            try:
+                _, charge = self._call_with_throttle_retry(lambda hook: write_one(item, hook), max_retries, operation=operation)
+                outcomes.append(self._item_outcome(item, True, 200, charge))
+            except exceptions.CosmosHttpResponseError as e:
+                print(f"An error occurred during bulk {operation} of {item.get('id')}: {e.message}")
+                outcomes.append(self._item_outcome(item, False, e.status_code, 0.0, e.message))
+        return outcomes
+
+
 def example_create_item():
     cosmos_db = CosmosDBManager()
     new_item = {
@@ -0,0 +1,337 @@
+"""
+### cosmos_db_async.py ###
+
+Async counterpart of cosmos_db.CosmosDBManager, built on azure.cosmos.aio, for code running on an
+event loop (the FastAPI app, async pipelines). It exposes the same create/update/upsert/query/delete
+surface as coroutines, so Cosmos DB calls no longer block the loop.
+
+All managers in a process share one aio CosmosClient (and so one aiohttp connection pool) and one
+DefaultAzureCredential per account, and each database/container is created or looked up only once.
+Creating a manager does no I/O; the first awaited operation (or `await manager.initialize()`)
+connects. COSMOS_CONTAINER_MUST_EXIST and AZURE_CREDENTIAL_EXCLUDE apply as in cosmos_db.py. Call `await close_shared_clients()` on shutdown to release the connection pools.
+Messages go to the "cosmos_db_async" logger rather than stdout.
+
+Usage:
+    cosmos_db = AsyncCosmosDBManager(cosmos_database_id="test_db", cosmos_container_id="people")
+    items = await cosmos_db.query_items("SELECT * FROM c WHERE c.partitionKey = 'people'")
+
+Requirements:
+    azure-cosmos==4.7.0
+    azure-identity==1.12.0
+    aiohttp
+"""
+
+import os
+import asyncio
+import logging
+import weakref
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+from dotenv import load_dotenv
+from azure.core import MatchConditions
+from azure.cosmos import exceptions, PartitionKey
+from azure.cosmos.aio import CosmosClient, ContainerProxy, DatabaseProxy
+from azure_credentials import credential_options
+from cosmos_db import CONTAINER_MUST_EXIST
+from cosmos_telemetry import track_operation
+
+# Per-operation messages are logged at DEBUG so they cost nothing on the request path by default
+logger = logging.getLogger(__name__)
+
+# Process-wide clients keyed by (host, tenant): (client, credential, event loop)
+_shared_clients: Dict[tuple, tuple] = {}
+# Containers keyed by (host, database, container): (database, container, event loop)
+_shared_containers: Dict[tuple, tuple] = {}
+# One lock per event loop (asyncio locks cannot be shared between loops)
+_shared_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+
+def _lock() -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    lock = _shared_locks.get(loop)
+    if lock is None:
+        lock = _shared_locks[loop] = asyncio.Lock()
+    return lock
+
+
+async def close_shared_clients() -> None:
+    """Close every shared client and credential created on the running event loop."""
+    loop = asyncio.get_running_loop()
+    async with _lock():
+        for key, (client, credential, client_loop) in list(_shared_clients.items()):
+            if client_loop is not loop:
+                continue
+            await client.close()
+            await credential.close()
+            del _shared_clients[key]
+        for key, (_, _, container_loop) in list(_shared_containers.items()):
+            if container_loop is loop:
+                del _shared_containers[key]
+
+
+class AsyncCosmosDBManager:
+    def __init__(self, cosmos_host=None, cosmos_database_id=None, cosmos_container_id=None,
+                 container_must_exist: bool = CONTAINER_MUST_EXIST):
+        self.container_must_exist = container_must_exist
+        self._load_env_variables(cosmos_host, cosmos_database_id, cosmos_container_id)
+        self.client: Optional[CosmosClient] = None
+        self.database: Optional[DatabaseProxy] = None
+        self.container: Optional[ContainerProxy] = None
+
+    @classmethod
+    def from_container(cls, container, cosmos_database_id: str = "local", cosmos_container_id: Optional[str] = None) -> "AsyncCosmosDBManager":
+        """
+        Build a manager around an existing async container, without connecting to Cosmos DB.
+
+        Used with cosmos_db_memory.AsyncInMemoryContainer to run and test code offline.
+        """
+        manager = cls.__new__(cls)
+        manager.cosmos_host = None
+        manager.cosmos_database_id = cosmos_database_id
+        manager.cosmos_container_id = cosmos_container_id or getattr(container, 'id', None)
+        manager.client = None
+        manager.database = None
+        manager.container = container
+        return manager
+
+    def _load_env_variables(self, cosmos_host=None, cosmos_database_id=None, cosmos_container_id=None):
+        load_dotenv()
+        self.cosmos_host = cosmos_host or os.environ.get("COSMOS_HOST")
+        self.cosmos_database_id = cosmos_database_id or os.environ.get("COSMOS_DATABASE_ID")
+        self.cosmos_container_id = cosmos_container_id or os.environ.get("COSMOS_CONTAINER_ID")
+        self.tenant_id = os.environ.get("TENANT_ID", '16b3c013-d300-468d-ac64-7eda0820b6d3')
+
+        if not all([self.cosmos_host, self.cosmos_database_id, self.cosmos_container_id]):
+            raise ValueError("Cosmos DB configuration is incomplete")
+
+    async def initialize(self) -> ContainerProxy:
+        """Attach the shared client and container, creating them on first use in this process."""
+        if self.container is not None:
+            return self.container
+
+        loop = asyncio.get_running_loop()
+        async with _lock():
+            self.client = self._get_cosmos_client(loop)
+            key = (self.cosmos_host, self.cosmos_database_id, self.cosmos_container_id)
+            shared = _shared_containers.get(key)
+            if shared is not None and shared[2] is loop:
+                self.database, self.container = shared[0], shared[1]
+                return self.container
+            try:
+                if self.container_must_exist:
+                    # Proxies only: no request is made until the first operation
+                    self.database = self.client.get_database_client(self.cosmos_database_id)
+                    self.container = self.database.get_container_client(self.cosmos_container_id)
+                else:
+                    self.database = await self._create_or_get_database()
+                    self.container = await self._create_or_get_container()
+            except exceptions.CosmosHttpResponseError as e:
+                logger.warning("An error occurred: %s", e.message)
+                raise
+            _shared_containers[key] = (self.database, self.container, loop)
+        return self.container
+
+    def _get_cosmos_client(self, loop: asyncio.AbstractEventLoop) -> CosmosClient:
+        """Return the shared client for this host; aio clients are bound to the loop that created them."""
+        key = (self.cosmos_host, self.tenant_id)
+        shared = _shared_clients.get(key)
+        if shared is not None and shared[2] is loop:
+            return shared[0]
+
+        # Imported on first use: azure.identity is a large import that only this path needs
+        from azure.identity.aio import DefaultAzureCredential
+        logger.info("Initializing async Cosmos DB client")
+        logger.info("Using DefaultAzureCredential for Cosmos DB authentication")
+        credential = DefaultAzureCredential(**credential_options(self.tenant_id))
+        client = CosmosClient(self.cosmos_host, credential=credential)
+        _shared_clients[key] = (client, credential, loop)
+        return client
+
+    async def _create_or_get_database(self) -> DatabaseProxy:
+        try:
+            database = await self.client.create_database(id=self.cosmos_database_id)
+            logger.info("Database with id '%s' created", self.cosmos_database_id)
+        except exceptions.CosmosResourceExistsError:
+            database = self.client.get_database_client(self.cosmos_database_id)
+            logger.info("Database with id '%s' was found", self.cosmos_database_id)
+        return database
+
+    async def _create_or_get_container(self) -> ContainerProxy:
+        try:
+            container = await self.database.create_container(id=self.cosmos_container_id, partition_key=PartitionKey(path='/partitionKey'))
+            logger.info("Container with id '%s' created", self.cosmos_container_id)
+        except exceptions.CosmosResourceExistsError:
+            container = self.database.get_container_client(self.cosmos_container_id)
+            logger.info("Container with id '%s' was found", self.cosmos_container_id)
+        return container
+
+    async def create_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Create a new item in the container. Fails if an item with the same ID already exists.
+
+        :param item: The item to create
+        :return: The created item, or None if creation failed
+        """
+        container = await self.initialize()
+        try:
+            with track_operation("create") as hook:
+                created_item = await container.create_item(body=item, response_hook=hook)
+            logger.debug("Item created with id: %s", created_item['id'])
+            return created_item
+        except exceptions.CosmosResourceExistsError:
+            logger.debug("Item with id %s already exists. Use update_item or upsert_item to modify.", item['id'])
+            return None
+        except exceptions.CosmosHttpResponseError as e:
+            logger.warning("An error occurred during creation: %s", e.message)
+            return None
+
+    async def update_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Update an existing item in the container. Fails if the item doesn't exist.
+
+        :param item: The item to update (must include 'id' and 'partitionKey')
+        :return: The updated item, or None if update failed
+        """
+        container = await self.initialize()
+        try:
+            with track_operation("replace") as hook:
+                updated_item = await container.replace_item(item=item['id'], body=item, response_hook=hook)
+            logger.debug("Item updated with id: %s", updated_item['id'])
+            return updated_item
+        except exceptions.CosmosResourceNotFoundError:
+            logger.debug("Item with id %s not found. Unable to update.", item['id'])
+            return None
+        except exceptions.CosmosHttpResponseError as e:
+            logger.warning("An error occurred during update: %s", e.message)
+            return None
+
+    async def upsert_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Upsert (create or update) an item in the container.
+
+        :param item: The item to upsert
+        :return: The upserted item, or None if upsert failed
+        """
+        container = await self.initialize()
+        try:
+            with track_operation("upsert") as hook:
+                upserted_item = await container.upsert_item(body=item, response_hook=hook)
+            logger.debug("Item upserted with id: %s", upserted_item['id'])
+            return upserted_item
+        except exceptions.CosmosHttpResponseError as e:
+            logger.warning("An error occurred during upsert: %s", e.message)
+            return None
+
+    async def read_item(self, item_id: str, partition_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Point read of one item by id and partition key (much cheaper than a query).
+
+        :return: The item, or None if it does not exist or the read failed
+        """
+        container = await self.initialize()
+        try:
+            with track_operation("read") as hook:
+                return await container.read_item(item=item_id, partition_key=partition_key, response_hook=hook)
+        except exceptions.CosmosResourceNotFoundError:
+            logger.debug("Item with id %s not found.", item_id)
+            return None
+        except exceptions.CosmosHttpResponseError as e:
+            logger.warning("An error occurred during read: %s", e.message)
+            return None
+
+    async def patch_item(self, item_id: str, partition_key: str, patch_operations: List[Dict[str, Any]], etag: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Apply field-level patch operations to an item without replacing the whole document.
+
+        :param patch_operations: e.g. [{"op": "set", "path": "/notification_sent", "value": True}]
+        :param etag: If given, the patch only applies while the item still has this ETag
+        :return: The patched item, or None if it does not exist or the patch failed
+        :raises CosmosAccessConditionFailedError: If `etag` no longer matches (HTTP 412)
+        """
+        container = await self.initialize()
+        kwargs = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
+        try:
+            with track_operation("patch") as hook:
+                patched_item = await container.patch_item(item=item_id, partition_key=partition_key, patch_operations=patch_operations, response_hook=hook, **kwargs)
+            logger.debug("Item patched with id: %s", item_id)
+            return patched_item
+        except exceptions.CosmosAccessConditionFailedError:
+            logger.debug("Item with id %s was modified since it was read. Patch not applied.", item_id)
+            raise
+        except exceptions.CosmosResourceNotFoundError:
+            logger.debug("Item with id %s not found. Unable to patch.", item_id)
+            return None
+        except exceptions.CosmosHttpResponseError as e:
+            logger.warning("An error occurred during patch: %s", e.message)
+            return None
+
+    async def query_items(self, query: str, parameters: Optional[List[Dict[str, Any]]] = None, partition_key: Optional[str] = None) -> List[Dict[str, Any]]:
+        container = await self.initialize()
+        try:
+            # The aio SDK runs a cross-partition query whenever no partition key is given
+            kwargs = {"partition_key": partition_key} if partition_key is not None else {}
+            with track_operation("query", query=query) as hook:
+                items = [item async for item in container.query_items(query=query, parameters=parameters, response_hook=hook, **kwargs)]
+            logger.debug("Query returned %s items", len(items))
+            return items
+        except exceptions.CosmosHttpResponseError as e:
+            logger.warning("An error occurred during query: %s", e.message)
+            return []
+
+    async def read_items(self, item_ids: Iterable[str], partition_key: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Read several items of one partition with a single query (ids that do not exist are left out).
+
+        :param fields: Top-level fields to return (default: whole documents)
+        :raises CosmosHttpResponseError: If the query fails
+        """
+        container = await self.initialize()
+        item_ids = list(dict.fromkeys(item_ids))
+        if not item_ids:
+            return []
+        select = ", ".join(f"c.{field}" for field in fields) if fields else "*"
+        query = f"SELECT {select} FROM c WHERE ARRAY_CONTAINS(@ids, c.id)"
+        with track_operation("read_many", query=query) as hook:
+            items = [item async for item in container.query_items(
+                query=query,
+                parameters=[{"name": "@ids", "value": item_ids}],
+                partition_key=partition_key,
+                response_hook=hook
+            )]
+        logger.debug("Read %s of %s items", len(items), len(item_ids))
+        return items
+
+    async def query_page(self, query: str, parameters: Optional[List[Dict[str, Any]]] = None, partition_key: Optional[str] = None,
+                         max_item_count: int = 100, continuation_token: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Fetch one page of query results, so callers can page through large result sets.
+
+        :param max_item_count: Maximum number of items in the page (Cosmos DB may return fewer)
+        :param continuation_token: Token returned with the previous page, or None for the first page
+        :return: (items, continuation token for the next page or None when there are no more results)
+        :raises CosmosHttpResponseError: If the query fails (e.g. an invalid continuation token)
+        """
+        container = await self.initialize()
+        kwargs = {"partition_key": partition_key} if partition_key is not None else {}
+        with track_operation("query_page", query=query) as hook:
+            pages = container.query_items(query=query, parameters=parameters, max_item_count=max_item_count,
+                                          response_hook=hook, **kwargs).by_page(continuation_token)
+            try:
+                page = await pages.__anext__()
+            except StopAsyncIteration:
+                return [], None
+            items = [item async for item in page]
+        return items, pages.continuation_token
+
+    async def delete_item(self, item_id: str, partition_key: str) -> bool:
+        container = await self.initialize()
+        try:
+            with track_operation("delete") as hook:
+                await container.delete_item(item=item_id, partition_key=partition_key, response_hook=hook)
+            logger.debug("Item deleted with id: %s", item_id)
+            return True
+        except exceptions.CosmosResourceNotFoundError:
+            logger.debug("Item with id %s not found. Unable to delete.", item_id)
+            return False
+        except exceptions.CosmosHttpResponseError as e:
+            logger.warning("An error occurred during deletion: %s", e.message)
+            return False
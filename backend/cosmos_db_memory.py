@@ -0,0 +1,359 @@
+"""
+### cosmos_db_memory.py ###
+
+In-memory stand-in for an Azure Cosmos DB ContainerProxy, for exercising CosmosDBManager
+(and the code built on it) without an Azure account. It implements the subset of the
+container API this project uses, raises the same azure.cosmos exceptions, reports a
+synthetic request charge through `response_hook`, and can simulate throttling.
+
+Usage:
+    container = InMemoryContainer()
+    cosmos_db = CosmosDBManager.from_container(container)
+
+    # azure.cosmos.aio equivalent, for AsyncCosmosDBManager (both views share the same items)
+    async_cosmos_db = AsyncCosmosDBManager.from_container(AsyncInMemoryContainer(container))
+
+Query support is limited to the shapes used in this repo:
+    SELECT * | SELECT c.a, c.b | SELECT VALUE c.a FROM c
+    [WHERE <cond> AND <cond> ...]   where <cond> is c.field = <@param | 'string' | number | true | false>,
+                                    IS_DEFINED(c.field) or ARRAY_CONTAINS(@param, c.field)
+"""
+
+import re
+import copy
+import json
+import uuid
+import random
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from azure.cosmos import exceptions
+
+# Synthetic request charges (RU) per operation
+REQUEST_CHARGES = {"read": 1.0, "create": 6.0, "replace": 10.0, "upsert": 10.0, "patch": 10.0, "delete": 6.0, "query": 3.0}
+
+
+def _throttled_error() -> exceptions.CosmosHttpResponseError:
+    error = exceptions.CosmosHttpResponseError(status_code=429, message="Request rate is large (simulated)")
+    error.headers = {"x-ms-retry-after-ms": "10"}
+    return error
+
+
+class InMemoryContainer:
+    """Thread-safe dict-backed container keyed by (partition key, id)."""
+
+    def __init__(self, container_id: str = "people", partition_key_path: str = "/partitionKey",
+                 throttle_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        :param throttle_rate: Fraction of write operations that fail with a simulated 429
+        """
+        self.id = container_id
+        self.partition_key_field = partition_key_path.lstrip("/")
+        self.throttle_rate = throttle_rate
+        self._items: Dict[Tuple[Any, str], Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+        self._random = random.Random(seed)
+        self.operation_counts: Dict[str, int] = {}
+
+    # ---------------------------
+    # Helpers
+    # ---------------------------
+    def _record(self, operation: str, response_hook: Optional[Callable], result: Any, count: int = 1) -> None:
+        self.operation_counts[operation] = self.operation_counts.get(operation, 0) + 1
+        if response_hook:
+            headers = {"x-ms-request-charge": str(REQUEST_CHARGES.get(operation, 1.0) * count),
+                       "etag": result.get("_etag") if isinstance(result, dict) else None}
+            response_hook(headers, result)
+
+    def _maybe_throttle(self) -> None:
+        if self.throttle_rate and self._random.random() < self.throttle_rate:
+            raise _throttled_error()
+
+    def _key(self, item: Dict[str, Any]) -> Tuple[Any, str]:
+        return item.get(self.partition_key_field), item["id"]
+
+    def _store(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        stored = copy.deepcopy(item)
+        stored["_etag"] = f'"{uuid.uuid4()}"'
+        self._items[self._key(stored)] = stored
+        return copy.deepcopy(stored)
+
+    @staticmethod
+    def _check_etag(existing: Dict[str, Any], kwargs: Dict[str, Any]) -> None:
+        etag = kwargs.get("etag")
+        if etag and kwargs.get("match_condition") is not None and existing.get("_etag") != etag:
+            raise exceptions.CosmosAccessConditionFailedError(status_code=412, message="Precondition failed")
+
+    def items(self) -> List[Dict[str, Any]]:
+        """Snapshot of every stored item (for assertions)."""
+        with self._lock:
+            return [copy.deepcopy(item) for item in self._items.values()]
+
+    # ---------------------------
+    # ContainerProxy API
+    # ---------------------------
+    def create_item(self, body: Dict[str, Any], response_hook: Optional[Callable] = None, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            self._maybe_throttle()
+            if self._key(body) in self._items:
+                raise exceptions.CosmosResourceExistsError(status_code=409, message=f"Item {body['id']} already exists")
+            result = self._store(body)
+        self._record("create", response_hook, result)
+        return result
+
+    def replace_item(self, item: Any, body: Dict[str, Any], response_hook: Optional[Callable] = None, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            self._maybe_throttle()
+            existing = self._items.get(self._key(body))
+            if existing is None:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"Item {body['id']} not found")
+            self._check_etag(existing, kwargs)
+            result = self._store(body)
+        self._record("replace", response_hook, result)
+        return result
+
+    def upsert_item(self, body: Dict[str, Any], response_hook: Optional[Callable] = None, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            self._maybe_throttle()
+            result = self._store(body)
+        self._record("upsert", response_hook, result)
+        return result
+
+    def read_item(self, item: Any, partition_key: Any, response_hook: Optional[Callable] = None, **kwargs) -> Dict[str, Any]:
+        item_id = item["id"] if isinstance(item, dict) else item
+        with self._lock:
+            existing = self._items.get((partition_key, item_id))
+            if existing is None:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"Item {item_id} not found")
+            result = copy.deepcopy(existing)
+        self._record("read", response_hook, result)
+        return result
+
+    def patch_item(self, item: Any, partition_key: Any, patch_operations: List[Dict[str, Any]],
+                   response_hook: Optional[Callable] = None, **kwargs) -> Dict[str, Any]:
+        """Apply set/replace/add/remove/incr operations on top-level or nested paths."""
+        item_id = item["id"] if isinstance(item, dict) else item
+        with self._lock:
+            self._maybe_throttle()
+            existing = self._items.get((partition_key, item_id))
+            if existing is None:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"Item {item_id} not found")
+            self._check_etag(existing, kwargs)
+            patched = copy.deepcopy(existing)
+            for operation in patch_operations:
+                _apply_patch(patched, operation)
+            result = self._store(patched)
+        self._record("patch", response_hook, result)
+        return result
+
+    def delete_item(self, item: Any, partition_key: Any, response_hook: Optional[Callable] = None, **kwargs) -> None:
+        item_id = item["id"] if isinstance(item, dict) else item
+        with self._lock:
+            self._maybe_throttle()
+            if self._items.pop((partition_key, item_id), None) is None:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"Item {item_id} not found")
+        self._record("delete", response_hook, None)
+
+    def execute_item_batch(self, batch_operations: List[Tuple[str, tuple]], partition_key: Any,
+                           response_hook: Optional[Callable] = None, **kwargs) -> List[Dict[str, Any]]:
+        """
+        Transactional batch: all operations succeed or none are applied.
+
+        Like the SDK, a failed operation raises CosmosBatchOperationError with its index and one
+        response per operation (the others get 424); a throttled batch raises a 429.
+        """
+        with self._lock:
+            self._maybe_throttle()
+            snapshot = dict(self._items)
+            results = []
+            try:
+                for operation, args in batch_operations:
+                    if operation == "patch":
+                        item_id, patch_operations = args[0], args[1]
+                        existing = self._items.get((partition_key, item_id))
+                        if existing is None:
+                            raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"Item {item_id} not found")
+                        patched = copy.deepcopy(existing)
+                        for patch_operation in patch_operations:
+                            _apply_patch(patched, patch_operation)
+                        results.append({"statusCode": 200, "resourceBody": self._store(patched)})
+                        continue
+                    body = args[0]
+                    if body.get(self.partition_key_field) != partition_key:
+                        raise exceptions.CosmosHttpResponseError(status_code=400, message="Partition key mismatch in batch")
+                    if operation == "create" and self._key(body) in self._items:
+                        raise exceptions.CosmosResourceExistsError(status_code=409, message=f"Item {body['id']} already exists")
+                    if operation in ("create", "upsert", "replace"):
+                        results.append({"statusCode": 200, "resourceBody": self._store(body)})
+                    else:
+                        raise exceptions.CosmosHttpResponseError(status_code=400, message=f"Unsupported batch operation {operation}")
+            except exceptions.CosmosHttpResponseError as e:
+                self._items = snapshot
+                error_index = len(results)
+                responses = [{"statusCode": 424} for _ in batch_operations]
+                responses[error_index] = {"statusCode": e.status_code}
+                raise exceptions.CosmosBatchOperationError(
+                    error_index=error_index, headers={}, status_code=e.status_code,
+                    message=f"There was an error in the transactional batch on index {error_index}: {e.message}",
+                    operation_responses=responses)
+        patches_only = all(operation == "patch" for operation, _ in batch_operations)
+        self._record("patch" if patches_only else "upsert", response_hook, results, count=len(batch_operations))
+        return results
+
+    def query_items(self, query: str, parameters: Optional[List[Dict[str, Any]]] = None,
+                    partition_key: Any = None, response_hook: Optional[Callable] = None, **kwargs) -> Iterable[Dict[str, Any]]:
+        projection, conditions = _parse_query(query)
+        values = {p["name"]: p["value"] for p in (parameters or [])}
+        with self._lock:
+            items = [copy.deepcopy(item) for key, item in self._items.items()
+                     if partition_key is None or key[0] == partition_key]
+        matches = [item for item in items if all(condition(item, values) for condition in conditions)]
+        self._record("query", response_hook, None)
+        return [projection(item) for item in matches]
+
+
+class _AsyncItemPaged:
+    """Async iterable over query results with azure-core style by_page(continuation_token) paging."""
+
+    def __init__(self, items: List[Any], max_item_count: Optional[int]):
+        self._items = items
+        self._page_size = max_item_count or max(1, len(items))
+
+    def __aiter__(self):
+        return self._iterate(self._items)
+
+    @staticmethod
+    async def _iterate(items: List[Any]):
+        for item in items:
+            yield item
+
+    def by_page(self, continuation_token: Optional[str] = None) -> "_AsyncPageIterator":
+        return _AsyncPageIterator(self._items, self._page_size, int(continuation_token or 0))
+
+
+class _AsyncPageIterator:
+    def __init__(self, items: List[Any], page_size: int, start: int):
+        self._items = items
+        self._page_size = page_size
+        self._start = start
+        self._done = False
+        self.continuation_token: Optional[str] = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._done or (self._start >= len(self._items) and self._start > 0):
+            raise StopAsyncIteration
+        page = self._items[self._start:self._start + self._page_size]
+        self._start += self._page_size
+        self._done = self._start >= len(self._items)
+        self.continuation_token = None if self._done else str(self._start)
+        return _AsyncItemPaged._iterate(page)
+
+
+class AsyncInMemoryContainer:
+    """azure.cosmos.aio ContainerProxy facade over an InMemoryContainer."""
+
+    def __init__(self, container: Optional[InMemoryContainer] = None):
+        self.sync = container or InMemoryContainer()
+        self.id = self.sync.id
+
+    async def create_item(self, body, **kwargs):
+        return self.sync.create_item(body, **kwargs)
+
+    async def replace_item(self, item, body, **kwargs):
+        return self.sync.replace_item(item, body, **kwargs)
+
+    async def upsert_item(self, body, **kwargs):
+        return self.sync.upsert_item(body, **kwargs)
+
+    async def read_item(self, item, partition_key, **kwargs):
+        return self.sync.read_item(item, partition_key, **kwargs)
+
+    async def patch_item(self, item, partition_key, patch_operations, **kwargs):
+        return self.sync.patch_item(item, partition_key, patch_operations, **kwargs)
+
+    async def delete_item(self, item, partition_key, **kwargs):
+        return self.sync.delete_item(item, partition_key, **kwargs)
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        return self.sync.execute_item_batch(batch_operations, partition_key, **kwargs)
+
+    def query_items(self, query: str, parameters: Optional[List[Dict[str, Any]]] = None, partition_key: Any = None,
+                    max_item_count: Optional[int] = None, **kwargs) -> _AsyncItemPaged:
+        return _AsyncItemPaged(self.sync.query_items(query, parameters=parameters, partition_key=partition_key, **kwargs), max_item_count)
+
+
+def _apply_patch(item: Dict[str, Any], operation: Dict[str, Any]) -> None:
+    *parents, field = [part for part in operation["path"].split("/") if part]
+    target = item
+    for part in parents:
+        target = target[part]
+    op = operation["op"]
+    if op in ("set", "add"):
+        target[field] = operation["value"]
+    elif op == "replace":
+        if field not in target:
+            raise exceptions.CosmosHttpResponseError(status_code=400, message=f"Path {operation['path']} does not exist")
+        target[field] = operation["value"]
+    elif op == "remove":
+        target.pop(field, None)
+    elif op == "incr":
+        target[field] = target.get(field, 0) + operation["value"]
+    else:
+        raise exceptions.CosmosHttpResponseError(status_code=400, message=f"Unsupported patch operation {op}")
+
+
+# -------------------------------
+# Minimal query support
+# -------------------------------
+_QUERY_RE = re.compile(r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+c\s*(?:WHERE\s+(?P<where>.+?))?\s*$", re.IGNORECASE | re.DOTALL)
+_FIELD_RE = re.compile(r"^c\.(\w+)$")
+
+
+def _literal(token: str) -> Callable[[Dict[str, Any]], Any]:
+    token = token.strip()
+    if token.startswith("@"):
+        return lambda values: values[token]
+    if token.startswith("'") and token.endswith("'"):
+        return lambda values: token[1:-1]
+    if token.lower() in ("true", "false"):
+        return lambda values: token.lower() == "true"
+    return lambda values: json.loads(token)
+
+
+def _parse_condition(text: str) -> Callable[[Dict[str, Any], Dict[str, Any]], bool]:
+    text = text.strip()
+    match = re.match(r"^IS_DEFINED\(\s*c\.(\w+)\s*\)$", text, re.IGNORECASE)
+    if match:
+        field = match.group(1)
+        return lambda item, values: field in item
+    match = re.match(r"^ARRAY_CONTAINS\(\s*(@\w+)\s*,\s*c\.(\w+)\s*\)$", text, re.IGNORECASE)
+    if match:
+        parameter, field = match.groups()
+        return lambda item, values: item.get(field) in values[parameter]
+    match = re.match(r"^c\.(\w+)\s*=\s*(.+)$", text)
+    if match:
+        field, value = match.group(1), _literal(match.group(2))
+        return lambda item, values: field in item and item[field] == value(values)
+    raise ValueError(f"Unsupported query condition for InMemoryContainer: {text}")
+
+
+def _parse_query(query: str):
+    match = _QUERY_RE.match(query)
+    if not match:
+        raise ValueError(f"Unsupported query for InMemoryContainer: {query}")
+    select = match.group("select").strip()
+    if select == "*":
+        projection = lambda item: item
+    elif select.upper().startswith("VALUE "):
+        field = _FIELD_RE.match(select[6:].strip()).group(1)
+        projection = lambda item: item.get(field)
+    else:
+        fields = [_FIELD_RE.match(part.strip()).group(1) for part in select.split(",")]
+        projection = lambda item: {field: item[field] for field in fields if field in item}
+
+    where = match.group("where")
+    conditions = [_parse_condition(part) for part in re.split(r"\s+AND\s+", where, flags=re.IGNORECASE)] if where else []
+    return projection, conditions
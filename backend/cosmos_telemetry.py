@@ -0,0 +1,274 @@
+"""
+### cosmos_telemetry.py ###
+
+Latency and request-charge (RU) instrumentation for CosmosDBManager and AsyncCosmosDBManager.
+Every container call is wrapped in `track_operation`, which passes a RequestChargeHook to the SDK
+as `response_hook` and records the outcome in two places:
+
+    * the metrics registry (served on the API's /metrics):
+        cosmos_operation_duration_seconds{operation, status}
+        cosmos_request_charge{operation, status}
+        cosmos_request_charge_total{operation, caller}
+        cosmos_retries_total{operation, caller}
+    * LEDGER, which aggregates RU, latency, retries and query pages per operation and caller
+      tag, keeps the most expensive queries, prints a summary and checks RU budgets.
+
+Callers tag their Cosmos DB calls with `caller_tag`, as a context manager or a decorator:
+
+    @caller_tag("send_notification")
+    def send_notification(...): ...
+
+    with caller_tag("api_list"):
+        await cosmos_manager.query_page(...)
+
+Tests assert RU budgets with:
+
+    with LEDGER.budget(max_request_charge=20, caller="send_notification"):
+        send_notification(...)
+"""
+
+import time
+import heapq
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from azure.cosmos import exceptions
+
+from metrics import REGISTRY
+
+# RU buckets: a 1 KB point read is 1 RU, writes ~5-15 RU, cross-partition scans can reach thousands
+REQUEST_CHARGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+# Number of most expensive queries kept by the ledger
+TOP_QUERIES = 10
+
+UNTAGGED = "untagged"
+
+COSMOS_OPERATION_DURATION = REGISTRY.histogram(
+    "cosmos_operation_duration_seconds", "Cosmos DB operation latency (including SDK retries)",
+    ["operation", "status"]
+)
+COSMOS_REQUEST_CHARGE = REGISTRY.histogram(
+    "cosmos_request_charge", "Request units charged per Cosmos DB operation",
+    ["operation", "status"], buckets=REQUEST_CHARGE_BUCKETS
+)
+COSMOS_REQUEST_CHARGE_TOTAL = REGISTRY.counter(
+    "cosmos_request_charge_total", "Request units charged, by operation and caller tag", ["operation", "caller"]
+)
+COSMOS_RETRIES_TOTAL = REGISTRY.counter(
+    "cosmos_retries_total", "Throttling retries (SDK and application level), by operation and caller tag", ["operation", "caller"]
+)
+
+_caller = contextvars.ContextVar("cosmos_caller_tag", default=UNTAGGED)
+
+
+def request_charge(headers) -> float:
+    """The x-ms-request-charge of a response, or 0 if missing."""
+    try:
+        return float((headers or {}).get('x-ms-request-charge', 0) or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _throttle_retries(headers) -> int:
+    try:
+        return int((headers or {}).get('x-ms-throttle-retry-count', 0) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+@contextmanager
+def caller_tag(tag: str) -> Iterator[str]:
+    """Attribute Cosmos DB calls made inside the block (or decorated function) to `tag`."""
+    token = _caller.set(tag)
+    try:
+        yield tag
+    finally:
+        _caller.reset(token)
+
+
+def current_caller_tag() -> str:
+    return _caller.get()
+
+
+class RequestChargeHook:
+    """
+    response_hook accumulating the request charge of every response of one operation.
+
+    Queries call the hook once per page fetched, so `page_charges` holds the RU of each page.
+    The SDK also calls it once when the query is created, with the previous request's headers
+    and the pager as result; that call is ignored.
+    """
+
+    def __init__(self):
+        self.request_charge = 0.0
+        self.page_charges: List[float] = []
+        self.retries = 0
+
+    def __call__(self, headers, result: Any) -> None:
+        if hasattr(result, "by_page"):
+            return
+        charge = request_charge(headers)
+        self.request_charge += charge
+        self.page_charges.append(charge)
+        self.retries += _throttle_retries(headers)
+
+
+class RequestChargeBudgetExceeded(AssertionError):
+    """Raised by RequestChargeLedger.budget when a block used more RU than allowed."""
+
+
+class RequestChargeLedger:
+    """Thread-safe aggregate of Cosmos DB usage per (operation, caller tag)."""
+
+    def __init__(self, top_queries: int = TOP_QUERIES):
+        self.top_queries = top_queries
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._entries: Dict[tuple, Dict[str, float]] = {}
+            self._queries: List[tuple] = []
+            self._sequence = 0
+
+    def record(self, operation: str, caller: str, status: str, seconds: float, hook: RequestChargeHook,
+               query: Optional[str] = None) -> None:
+        with self._lock:
+            entry = self._entries.get((operation, caller))
+            if entry is None:
+                entry = self._entries[(operation, caller)] = {
+                    "count": 0, "errors": 0, "request_charge": 0.0, "max_request_charge": 0.0,
+                    "seconds": 0.0, "max_seconds": 0.0, "retries": 0, "pages": 0, "max_page_charge": 0.0
+                }
+            entry["count"] += 1
+            entry["errors"] += status != "ok"
+            entry["request_charge"] += hook.request_charge
+            entry["max_request_charge"] = max(entry["max_request_charge"], hook.request_charge)
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["retries"] += hook.retries
+            entry["pages"] += len(hook.page_charges)
+            entry["max_page_charge"] = max([entry["max_page_charge"]] + hook.page_charges)
+
+            if query is not None and self.top_queries:
+                self._sequence += 1
+                record = (hook.request_charge, self._sequence, {
+                    "operation": operation, "caller": caller, "query": " ".join(query.split())[:300],
+                    "request_charge": hook.request_charge, "pages": len(hook.page_charges),
+                    "page_charges": list(hook.page_charges), "seconds": seconds
+                })
+                if len(self._queries) < self.top_queries:
+                    heapq.heappush(self._queries, record)
+                else:
+                    heapq.heappushpop(self._queries, record)
+
+    # ---------------------------
+    # Reading the ledger
+    # ---------------------------
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """One row per (operation, caller) with totals and averages, most expensive first."""
+        with self._lock:
+            entries = {key: dict(value) for key, value in self._entries.items()}
+        rows = []
+        for (operation, caller), entry in entries.items():
+            count = entry["count"] or 1
+            rows.append({
+                "operation": operation,
+                "caller": caller,
+                **entry,
+                "avg_request_charge": entry["request_charge"] / count,
+                "avg_seconds": entry["seconds"] / count,
+                "avg_page_charge": entry["request_charge"] / entry["pages"] if entry["pages"] else 0.0
+            })
+        return sorted(rows, key=lambda row: row["request_charge"], reverse=True)
+
+    def expensive_queries(self) -> List[Dict[str, Any]]:
+        """The most expensive queries recorded, highest RU first, with the RU of each page."""
+        with self._lock:
+            queries = list(self._queries)
+        return [record for _, _, record in sorted(queries, key=lambda item: (-item[0], item[1]))]
+
+    def total(self, field: str = "request_charge", operation: Optional[str] = None, caller: Optional[str] = None) -> float:
+        """Sum of `field` (request_charge, count, retries, seconds, ...) over the matching entries."""
+        with self._lock:
+            return sum(entry[field] for (op, tag), entry in self._entries.items()
+                       if (operation is None or op == operation) and (caller is None or tag == caller))
+
+    @contextmanager
+    def budget(self, max_request_charge: Optional[float] = None, max_operations: Optional[int] = None,
+               operation: Optional[str] = None, caller: Optional[str] = None) -> Iterator[Dict[str, float]]:
+        """
+        Assert that the Cosmos DB calls made inside the block stay within a budget.
+
+        Usage is measured as the ledger's growth during the block, restricted to `operation` and
+        `caller` if given; the yielded dict is filled with it on exit.
+
+        :raises RequestChargeBudgetExceeded: If the block used more RU or operations than allowed
+        """
+        start_charge = self.total("request_charge", operation, caller)
+        start_count = self.total("count", operation, caller)
+        usage: Dict[str, float] = {}
+        yield usage
+        usage["request_charge"] = self.total("request_charge", operation, caller) - start_charge
+        usage["operations"] = self.total("count", operation, caller) - start_count
+        scope = f" (operation={operation or '*'}, caller={caller or '*'})"
+        if max_request_charge is not None and usage["request_charge"] > max_request_charge:
+            raise RequestChargeBudgetExceeded(
+                f"Used {usage['request_charge']:.2f} RU, budget is {max_request_charge:.2f} RU{scope}")
+        if max_operations is not None and usage["operations"] > max_operations:
+            raise RequestChargeBudgetExceeded(
+                f"Made {int(usage['operations'])} Cosmos DB calls, budget is {max_operations}{scope}")
+
+    def print_summary(self) -> None:
+        """Print RU, latency and retries per operation and caller, and the most expensive queries."""
+        rows = self.snapshot()
+        print("\n==== COSMOS DB USAGE ====")
+        if not rows:
+            print("No Cosmos DB operations recorded")
+            return
+        print(f"{'operation':<12} {'caller':<28} {'calls':>7} {'errors':>6} {'RU total':>11} {'RU avg':>8} "
+              f"{'RU max':>8} {'ms avg':>8} {'retries':>7} {'pages':>6} {'RU/page':>8}")
+        for row in rows:
+            print(f"{row['operation']:<12} {row['caller'][:28]:<28} {row['count']:>7} {row['errors']:>6} "
+                  f"{row['request_charge']:>11.2f} {row['avg_request_charge']:>8.2f} {row['max_request_charge']:>8.2f} "
+                  f"{row['avg_seconds'] * 1000:>8.1f} {row['retries']:>7} {row['pages']:>6} {row['avg_page_charge']:>8.2f}")
+        print(f"Total: {self.total('request_charge'):.2f} RU in {int(self.total('count'))} operations, "
+              f"{int(self.total('retries'))} throttling retries")
+
+        queries = self.expensive_queries()
+        if queries:
+            print("Most expensive queries:")
+            for query in queries[:5]:
+                print(f"  {query['request_charge']:.2f} RU over {query['pages']} page(s) [{query['caller']}]: {query['query'][:120]}")
+
+
+# Process-wide ledger
+LEDGER = RequestChargeLedger()
+
+
+@contextmanager
+def track_operation(operation: str, query: Optional[str] = None) -> Iterator[RequestChargeHook]:
+    """Time a Cosmos DB call and record its latency, RU charge and retries, labelled with the outcome."""
+    hook = RequestChargeHook()
+    status = "ok"
+    started = time.perf_counter()
+    try:
+        yield hook
+    except exceptions.CosmosHttpResponseError as e:
+        status = str(e.status_code)
+        raise
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        caller = _caller.get()
+        COSMOS_OPERATION_DURATION.observe(seconds, operation=operation, status=status)
+        COSMOS_REQUEST_CHARGE.observe(hook.request_charge, operation=operation, status=status)
+        COSMOS_REQUEST_CHARGE_TOTAL.inc(hook.request_charge, operation=operation, caller=caller)
+        if hook.retries:
+            COSMOS_RETRIES_TOTAL.inc(hook.retries, operation=operation, caller=caller)
+        LEDGER.record(operation, caller, status, seconds, hook, query=query)
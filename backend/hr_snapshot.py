@@ -0,0 +1,425 @@
+"""
+### hr_snapshot.py ###
+
+Columnar snapshot of the parsed HR inputs (Workday export, PSE export and approved values), so
+agent runs and benchmarks over unchanged files skip the CSV parsing and the competency /
+certification splitting. The snapshot is a set of uncompressed Arrow IPC files that are
+memory-mapped when loaded: opening one costs a few stats and reads, and employees and their
+projects are converted to Python dicts only when they are used.
+
+    employees-<id>.arrow   one row per Workday employee, in file order; competencies are stored
+                           as two aligned list<string> columns (skills and levels)
+    pse-<id>.arrow         the PSE rows grouped by employee_id (in Workday order), every column
+                           as string
+    pse_index-<id>.arrow   employee_id -> (offset, length) of the employee's rows in pse
+    manifest.json          source files (path, size, mtime, SHA-256), file names, approved values
+
+Every set of source paths gets its own directory under HR_SNAPSHOT_DIR. A snapshot is used
+when the size and mtime of every source match the manifest; a source whose mtime changed is
+hashed, and only a different checksum triggers a rebuild. Rebuilt files get new names and the
+manifest is replaced last, so processes holding the previous snapshot open keep a consistent
+view.
+
+Snapshots need pyarrow (in requirements.txt). Where it is not installed (see
+snapshots_available) the agent reads the CSV files as before.
+
+Usage:
+    snapshot = HRSnapshot.load({"employees": workday_csv, "pse": pse_csv, "approved_values": approved_csv}, parse)
+    for employee in snapshot.employees():
+        projects = snapshot.projects().get(employee["employee_id"], [])
+"""
+
+import os
+import json
+import math
+import bisect
+import operator
+import hashlib
+import threading
+import importlib.util
+from datetime import datetime
+from collections.abc import Mapping, Sequence
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+DEFAULT_SNAPSHOT_DIR = os.getenv("HR_SNAPSHOT_DIR", "hr_snapshots")
+
+# Bumped when the layout of the snapshot files changes; older snapshots are rebuilt
+SNAPSHOT_FORMAT_VERSION = 1
+
+SOURCE_NAMES = ("employees", "pse", "approved_values")
+
+# Rows per record batch; employees and PSE rows are converted to Python one batch at a time
+BATCH_ROWS = 10000
+# Converted PSE batches kept for lookups of neighbouring employees
+PSE_CACHED_BATCHES = 4
+
+MANIFEST_NAME = "manifest.json"
+
+
+def snapshots_available() -> bool:
+    """True when pyarrow is installed."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _pyarrow():
+    # Imported on first use so importing the agent stays cheap
+    import pyarrow
+    import pyarrow.ipc
+    return pyarrow
+
+
+def file_checksum(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Arrays are converted through numpy: Array.to_pylist builds a scalar object per value and is
+# several times slower
+def _string_values(array) -> List[Any]:
+    """Python values of a string array, with nulls back to the NaN that pandas gives empty CSV cells."""
+    return [math.nan if value is None else value for value in array.to_numpy(zero_copy_only=False).tolist()]
+
+
+def _list_values(array) -> List[List[str]]:
+    """Python lists of a list<string> array (without nulls)."""
+    offsets = array.offsets.to_numpy().tolist()
+    values = array.flatten().to_numpy(zero_copy_only=False).tolist()
+    # The offsets of a sliced array do not start at 0, its flattened values do
+    first = offsets[0]
+    return [values[start - first:end - first] for start, end in zip(offsets, offsets[1:])]
+
+
+# -------------------------------
+# Arrow conversion
+# -------------------------------
+def _employees_table(employees: List[Dict[str, Any]]):
+    pa = _pyarrow()
+    strings, string_lists = pa.string(), pa.list_(pa.string())
+    competencies = [employee["competencies"] for employee in employees]
+    return pa.table({
+        "employee_id": pa.array([employee["employee_id"] for employee in employees], strings, from_pandas=True),
+        "name": pa.array([employee["name"] for employee in employees], strings, from_pandas=True),
+        "email": pa.array([employee["email"] for employee in employees], strings, from_pandas=True),
+        "competency_skills": pa.array([list(skills) for skills in competencies], string_lists),
+        "competency_levels": pa.array([list(skills.values()) for skills in competencies], string_lists),
+        "certifications": pa.array([employee["certifications"] for employee in employees], string_lists),
+        "cloud_skills": pa.array([employee["cloud_skills"] for employee in employees], string_lists)
+    })
+
+
+def _employees_from_batch(batch) -> List[Dict[str, Any]]:
+    columns = {name: _string_values(batch.column(name)) for name in ("employee_id", "name", "email")}
+    columns.update({name: _list_values(batch.column(name))
+                    for name in ("competency_skills", "competency_levels", "certifications", "cloud_skills")})
+    return [
+        {
+            "employee_id": employee_id,
+            "name": name,
+            "email": email,
+            "competencies": dict(zip(skills, levels)),
+            "certifications": certifications,
+            "cloud_skills": cloud_skills
+        }
+        for employee_id, name, email, skills, levels, certifications, cloud_skills in zip(
+            columns["employee_id"], columns["name"], columns["email"], columns["competency_skills"],
+            columns["competency_levels"], columns["certifications"], columns["cloud_skills"]
+        )
+    ]
+
+
+def _pse_tables(pse_data: Dict[str, List[Dict[str, Any]]], employees: List[Dict[str, Any]]):
+    """
+    The PSE rows grouped by employee and the offset index of each employee.
+
+    Groups follow the Workday order (then the employees only found in PSE), so an agent run
+    looks up the rows of one record batch after the other.
+    """
+    pa = _pyarrow()
+    ordered = {employee["employee_id"]: pse_data[employee["employee_id"]]
+               for employee in employees if employee["employee_id"] in pse_data}
+    ordered.update(pse_data)
+    pse_data = ordered
+    rows = [project for projects in pse_data.values() for project in projects]
+    columns = list(rows[0]) if rows else ["employee_id"]
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+    schema = pa.schema([(column, pa.string()) for column in columns])
+    pse = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+    lengths = [len(projects) for projects in pse_data.values()]
+    offsets, offset = [], 0
+    for length in lengths:
+        offsets.append(offset)
+        offset += length
+    index = pa.table({
+        "employee_id": pa.array(list(pse_data), pa.string()),
+        "offset": pa.array(offsets, pa.int64()),
+        "length": pa.array(lengths, pa.int64())
+    })
+    return pse, index
+
+
+class SnapshotEmployees(Sequence):
+    """Read-only list of employee dicts backed by the memory-mapped employees table."""
+
+    def __init__(self, table):
+        self._table = table
+
+    def __len__(self) -> int:
+        return self._table.num_rows
+
+    def __getitem__(self, index):
+        """The employee at `index`, or a list of employees for a slice (as list.__getitem__)."""
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[position] for position in range(start, stop, step)]
+            employees = []
+            for batch in self._table.slice(start, max(0, stop - start)).to_batches():
+                employees.extend(_employees_from_batch(batch))
+            return employees
+        index = operator.index(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("employee index out of range")
+        return _employees_from_batch(self._table.slice(index, 1).to_batches()[0])[0]
+
+    def __iter__(self):
+        for batch in self._table.to_batches():
+            yield from _employees_from_batch(batch)
+
+
+class SnapshotProjects(Mapping):
+    """
+    {employee_id: [project dict, ...]} view of the memory-mapped PSE table.
+
+    A lookup converts the record batch holding the employee's rows to Python lists and keeps
+    the last PSE_CACHED_BATCHES of them; each lookup returns new dicts. Safe to share between
+    threads.
+    """
+
+    def __init__(self, table, index):
+        self._batches = table.to_batches()
+        self._columns = table.schema.names
+        self._batch_starts = []
+        start = 0
+        for batch in self._batches:
+            self._batch_starts.append(start)
+            start += batch.num_rows
+        self._positions = dict(zip(index.column("employee_id").to_numpy().tolist(),
+                                   zip(index.column("offset").to_numpy().tolist(), index.column("length").to_numpy().tolist())))
+        self._converted = {}
+        self._lock = threading.Lock()
+
+    def _batch_values(self, batch_index: int) -> List[List[Any]]:
+        """Column values of one record batch, with nulls restored to NaN."""
+        with self._lock:
+            values = self._converted.pop(batch_index, None)
+            if values is None:
+                batch = self._batches[batch_index]
+                values = [_string_values(batch.column(column)) for column in self._columns]
+                while len(self._converted) >= PSE_CACHED_BATCHES:
+                    self._converted.pop(next(iter(self._converted)))
+            # Most recently used last
+            self._converted[batch_index] = values
+            return values
+
+    def __getitem__(self, employee_id: str) -> List[Dict[str, Any]]:
+        offset, length = self._positions[employee_id]
+        projects = []
+        batch_index = bisect.bisect_right(self._batch_starts, offset) - 1
+        while len(projects) < length:
+            values = self._batch_values(batch_index)
+            start = offset + len(projects) - self._batch_starts[batch_index]
+            stop = min(start + length - len(projects), len(values[0]))
+            projects.extend(dict(zip(self._columns, row)) for row in zip(*(column[start:stop] for column in values)))
+            batch_index += 1
+        return projects
+
+    @property
+    def columns(self) -> List[str]:
+        """Columns of the PSE export."""
+        return list(self._columns)
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, employee_id) -> bool:
+        return employee_id in self._positions
+
+
+# -------------------------------
+# Snapshot files
+# -------------------------------
+def _source_info(path: str, checksum: Optional[str] = None) -> Dict[str, Any]:
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "sha256": checksum or file_checksum(path)}
+
+
+def _write_atomic(path: str, write: Callable[[str], None]) -> None:
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    write(temp_path)
+    try:
+        os.replace(temp_path, path)
+    except OSError:
+        # Another process published the same file first (and may have it mapped)
+        os.remove(temp_path)
+        if not os.path.exists(path):
+            raise
+
+
+def _write_table(table, path: str) -> None:
+    pa = _pyarrow()
+
+    def write(temp_path):
+        with pa.OSFile(temp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=BATCH_ROWS)
+
+    _write_atomic(path, write)
+
+
+def _read_table(path: str):
+    pa = _pyarrow()
+    # The table's buffers point into the memory map, which stays open while they are referenced
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+class HRSnapshot:
+    """Memory-mapped snapshot of the parsed HR inputs; use HRSnapshot.load."""
+
+    def __init__(self, directory: str, manifest: Dict[str, Any], rebuilt: bool = False):
+        self.directory = directory
+        self.manifest = manifest
+        self.rebuilt = rebuilt
+        files = manifest["files"]
+        self._employees = SnapshotEmployees(_read_table(os.path.join(directory, files["employees"])))
+        self._projects = SnapshotProjects(_read_table(os.path.join(directory, files["pse"])),
+                                          _read_table(os.path.join(directory, files["pse_index"])))
+
+    @property
+    def snapshot_id(self) -> str:
+        return self.manifest["snapshot_id"]
+
+    def employees(self) -> SnapshotEmployees:
+        """The Workday employees, as read_employees_csv returns them."""
+        return self._employees
+
+    def projects(self) -> SnapshotProjects:
+        """The PSE rows by employee_id, as read_pse_data_csv returns them."""
+        return self._projects
+
+    def approved_values(self) -> Dict[str, Any]:
+        """The approved values, as read_approved_values_csv returns them."""
+        return {"approved_competencies": list(self.manifest["approved_values"]["approved_competencies"])}
+
+    # ---------------------------
+    # Loading and rebuilding
+    # ---------------------------
+    @staticmethod
+    def directory_for(sources: Dict[str, str], snapshot_dir: str = DEFAULT_SNAPSHOT_DIR) -> str:
+        """Snapshot directory of a set of source files."""
+        paths = "\n".join(os.path.abspath(sources[name]) for name in SOURCE_NAMES)
+        return os.path.join(snapshot_dir, hashlib.sha256(paths.encode("utf-8")).hexdigest()[:16])
+
+    @staticmethod
+    def _read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            return None
+        if not all(os.path.exists(os.path.join(directory, name)) for name in manifest["files"].values()):
+            return None
+        return manifest
+
+    @staticmethod
+    def _write_manifest(directory: str, manifest: Dict[str, Any]) -> None:
+        def write(temp_path):
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+
+        _write_atomic(os.path.join(directory, MANIFEST_NAME), write)
+
+    @staticmethod
+    def _check_sources(manifest: Optional[Dict[str, Any]], sources: Dict[str, str]) -> Tuple[bool, Dict[str, Any]]:
+        """(fresh, current source info); files whose size and mtime match the manifest are not hashed."""
+        recorded = manifest["sources"] if manifest else {}
+        current, fresh = {}, manifest is not None
+        for name in SOURCE_NAMES:
+            stat = os.stat(sources[name])
+            entry = recorded.get(name)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                current[name] = dict(entry)
+                continue
+            current[name] = _source_info(sources[name])
+            if not entry or entry["sha256"] != current[name]["sha256"]:
+                fresh = False
+        return fresh, current
+
+    @classmethod
+    def load(cls, sources: Dict[str, str], parse: Callable[[], Tuple[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]], Dict[str, Any]]],
+             snapshot_dir: str = DEFAULT_SNAPSHOT_DIR, rebuild: bool = False) -> "HRSnapshot":
+        """
+        Open the snapshot of `sources` ({"employees", "pse", "approved_values"} -> CSV path),
+        building it first when it is missing, stale or `rebuild` is set.
+
+        `parse()` reads the sources and returns (employees, pse_data, approved_values) in the
+        shapes of the agent's CSV loaders; it must raise rather than return partial data.
+        """
+        directory = cls.directory_for(sources, snapshot_dir)
+        manifest = None if rebuild else cls._read_manifest(directory)
+        fresh, current = cls._check_sources(manifest, sources)
+        if fresh:
+            if current != manifest["sources"]:
+                # Touched but unchanged files: record the new mtimes so they are not hashed again
+                manifest["sources"] = current
+                cls._write_manifest(directory, manifest)
+            return cls(directory, manifest)
+        return cls._build(directory, current, parse)
+
+    @classmethod
+    def _build(cls, directory: str, sources: Dict[str, Any], parse: Callable) -> "HRSnapshot":
+        # Checksums are taken before parsing, so a file changed meanwhile is rebuilt on the next load
+        employees, pse_data, approved_values = parse()
+        snapshot_id = hashlib.sha256(json.dumps(
+            [SNAPSHOT_FORMAT_VERSION] + [sources[name]["sha256"] for name in SOURCE_NAMES]).encode("utf-8")).hexdigest()
+        files = {name: f"{name}-{snapshot_id[:16]}.arrow" for name in ("employees", "pse", "pse_index")}
+
+        os.makedirs(directory, exist_ok=True)
+        pse, pse_index = _pse_tables(pse_data, employees)
+        _write_table(_employees_table(employees), os.path.join(directory, files["employees"]))
+        _write_table(pse, os.path.join(directory, files["pse"]))
+        _write_table(pse_index, os.path.join(directory, files["pse_index"]))
+
+        manifest = {
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "snapshot_id": snapshot_id,
+            "created_at": datetime.now().isoformat(),
+            "sources": sources,
+            "files": files,
+            "counts": {"employees": len(employees), "pse_employees": len(pse_data), "pse_rows": pse.num_rows},
+            "approved_values": {"approved_competencies": list(approved_values.get("approved_competencies", []))}
+        }
+        cls._write_manifest(directory, manifest)
+
+        # Files of earlier snapshots; on Windows they stay until no process has them mapped
+        for name in os.listdir(directory):
+            if name.endswith(".arrow") and name not in files.values():
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+        return cls(directory, manifest, rebuilt=True)
@@ -0,0 +1,196 @@
+"""
+### llm_cache.py ###
+
+Disk-backed cache of structured LLM responses, so re-runs (after a crash, a template change
+or a staging replay) do not pay for identical requests again. Entries are keyed by a hash
+of the deployment, sampling settings, output schema and the exact messages, and hold the
+parsed structured result as JSON.
+
+The cache is a SQLite database in WAL mode, which makes it safe to share between worker
+threads and processes on the same machine. Entries are evicted least-recently-used first
+once the total stored size exceeds `max_bytes` or the entry count exceeds `max_entries`.
+The totals are kept in a one-row `meta` table, updated in the same transaction as each write,
+so a write does not scan the table to check the limits.
+
+Configuration (environment variables):
+    LLM_CACHE_ENABLED     "0" disables the cache (default "1")
+    LLM_CACHE_PATH        Database file (default "llm_cache.sqlite3")
+    LLM_CACHE_MAX_BYTES   Maximum total size of cached values (default 512 MB)
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Type
+
+from pydantic import BaseModel
+
+DEFAULT_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+DEFAULT_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+DEFAULT_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+
+
+class LLMResponseCache:
+    """SQLite-backed LRU cache of structured LLM results."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_entries: Optional[int] = None, enabled: bool = DEFAULT_ENABLED):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+
+    # ---------------------------
+    # Connection handling
+    # ---------------------------
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; SQLite handles locking between threads and processes."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )""")
+            # Covers the eviction scan (oldest first, with sizes) without reading the values
+            connection.execute("DROP INDEX IF EXISTS entries_last_access")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_access, size)")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    total_bytes INTEGER NOT NULL,
+                    total_entries INTEGER NOT NULL
+                )""")
+            if connection.execute("SELECT 1 FROM meta").fetchone() is None:
+                # New database, or one written before the totals were kept: count once
+                connection.execute("INSERT OR IGNORE INTO meta SELECT 0, COALESCE(SUM(size), 0), COUNT(*) FROM entries")
+            self._local.connection = connection
+        return connection
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += amount
+
+    # ---------------------------
+    # Keys
+    # ---------------------------
+    @staticmethod
+    def make_key(deployment: Optional[str], temperature: float, max_tokens: Optional[int],
+                 schema: Type[BaseModel], messages: List[Dict[str, str]]) -> str:
+        """Hash of everything that determines the response for a request."""
+        request = {
+            "deployment": deployment,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "schema": schema.model_json_schema(),
+            "messages": messages
+        }
+        canonical = json.dumps(request, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    # ---------------------------
+    # Public API
+    # ---------------------------
+    def get_model(self, key: str, model: Type[BaseModel]) -> Optional[BaseModel]:
+        """Return the cached result for `key` parsed as `model`, or None on a miss."""
+        if not self.enabled:
+            return None
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            result = model.model_validate_json(row[0])
+        except Exception as e:
+            print(f"LLM cache read failed: {e}")
+            self._count("errors")
+            self._count("misses")
+            return None
+        self._count("hits")
+        return result
+
+    def put_model(self, key: str, value: BaseModel) -> None:
+        """Store a structured result and evict old entries if the cache is over budget."""
+        if not self.enabled:
+            return
+        payload = value.model_dump_json()
+        size = len(payload.encode("utf-8"))
+        now = time.time()
+        try:
+            connection = self._connection()
+            # The limit check and eviction see the totals of every writer, not a stale read
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                replaced = connection.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, size, now, now)
+                )
+                total_bytes, total_entries = connection.execute("SELECT total_bytes, total_entries FROM meta").fetchone()
+                total_bytes += size - (replaced[0] if replaced else 0)
+                total_entries += 0 if replaced else 1
+                evicted, total_bytes, total_entries = self._evict(connection, total_bytes, total_entries)
+                connection.execute("UPDATE meta SET total_bytes = ?, total_entries = ?", (total_bytes, total_entries))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            self._count("writes")
+            self._count("evictions", evicted)
+        except Exception as e:
+            print(f"LLM cache write failed: {e}")
+            self._count("errors")
+
+    def _over_budget(self, total_bytes: int, total_entries: int) -> bool:
+        return total_bytes > self.max_bytes or (self.max_entries is not None and total_entries > self.max_entries)
+
+    def _evict(self, connection: sqlite3.Connection, total_bytes: int, total_entries: int):
+        """Delete least-recently-used entries until the limits are met; returns (evicted, bytes, entries).
+
+        Runs inside the caller's transaction.
+        """
+        evicted = 0
+        while self._over_budget(total_bytes, total_entries):
+            rows = connection.execute("SELECT key, size FROM entries ORDER BY last_access LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if not self._over_budget(total_bytes, total_entries):
+                    break
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total_bytes -= size
+                total_entries -= 1
+                evicted += 1
+        return evicted, total_bytes, total_entries
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters for this process."""
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def print_stats(self) -> None:
+        """Print a short hit/miss summary."""
+        if not self.enabled:
+            print("\n==== LLM CACHE ====\nDisabled")
+            return
+        stats = self.stats()
+        print("\n==== LLM CACHE ====")
+        print(f"Hits: {stats['hits']}, misses: {stats['misses']} (hit rate {stats['hit_rate']:.0%})")
+        print(f"Writes: {stats['writes']}, evictions: {stats['evictions']}, errors: {stats['errors']}")
@@ -0,0 +1,252 @@
+"""
+### llm_scheduler.py ###
+
+This module meters Azure OpenAI calls so concurrent workers stay within a deployment's
+requests-per-minute (RPM) and tokens-per-minute (TPM) quota. Every request is first
+costed (prompt tokens + max completion tokens, which is how Azure OpenAI meters TPM),
+then admitted through an RPM and a TPM token bucket. Throttled (429) and transient
+failures are retried with Retry-After aware, jittered exponential backoff, and a 429
+pauses every worker until the service's cool-down has elapsed.
+
+Configuration (environment variables):
+    AOAI_TPM_LIMIT      Tokens-per-minute quota of the deployment (default 80000)
+    AOAI_RPM_LIMIT      Requests-per-minute quota (default: 6 per 1000 TPM, as Azure assigns)
+"""
+
+import os
+import time
+import random
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken is optional; fall back to a character heuristic
+    _ENCODING = None
+
+# Tokens Azure adds per chat message for role/formatting
+TOKENS_PER_MESSAGE = 4
+# Rough characters-per-token ratio used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+DEFAULT_TPM_LIMIT = int(os.getenv("AOAI_TPM_LIMIT", "80000"))
+DEFAULT_RPM_LIMIT = int(os.getenv("AOAI_RPM_LIMIT", str(max(1, DEFAULT_TPM_LIMIT * 6 // 1000))))
+
+def retryable_errors() -> tuple:
+    """OpenAI errors worth retrying, RateLimitError first.
+
+    openai is a large import, so it is loaded when a request fails rather than with this module.
+    """
+    import openai
+    return (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def count_text_tokens(text: str) -> int:
+    """Count (or estimate, without tiktoken) the tokens in a piece of text."""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    """Estimate the prompt tokens of a list of chat messages."""
+    return sum(TOKENS_PER_MESSAGE + count_text_tokens(message.get("content", "")) for message in messages) + 3
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `per_minute` / 60 tokens per second."""
+
+    def __init__(self, per_minute: int, burst_seconds: float = 10.0):
+        self.per_minute = max(1, int(per_minute))
+        self.refill_per_second = self.per_minute / 60.0
+        # Azure evaluates quotas over short windows too, so only allow a short burst
+        self.capacity = max(1.0, self.refill_per_second * burst_seconds)
+        self.tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last_refill) * self.refill_per_second)
+        self._last_refill = now
+
+    def try_acquire(self, amount: float) -> float:
+        """
+        Take `amount` tokens if available.
+
+        :return: 0 if the tokens were taken, otherwise the seconds to wait before retrying
+        """
+        # A request larger than the bucket can never fit; admit it once the bucket is full
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.refill_per_second
+
+    def refund(self, amount: float) -> None:
+        """Return tokens taken for a request that was never sent."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class LLMRequestScheduler:
+    """Admits LLM calls through RPM/TPM token buckets and retries throttled calls."""
+
+    def __init__(self, tokens_per_minute: int = DEFAULT_TPM_LIMIT, requests_per_minute: int = DEFAULT_RPM_LIMIT,
+                 max_retries: int = 6, base_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.tpm_bucket = TokenBucket(tokens_per_minute)
+        self.rpm_bucket = TokenBucket(requests_per_minute)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._cooldown_until = 0.0
+        self._window = deque()  # (timestamp, estimated tokens) of requests sent in the last minute
+        self._counters = {
+            "requests": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "throttled": 0,
+            "retries": 0,
+            "in_flight": 0,
+            "estimated_tokens": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "wait_seconds": 0.0
+        }
+
+    # ---------------------------
+    # Admission control
+    # ---------------------------
+    def _acquire(self, estimated_tokens: int) -> None:
+        """Block until both buckets admit the request and no 429 cool-down is active."""
+        waited = 0.0
+        while True:
+            delay = self._cooldown_until - time.monotonic()
+            if delay <= 0:
+                delay = self.rpm_bucket.try_acquire(1)
+                if delay <= 0:
+                    delay = self.tpm_bucket.try_acquire(estimated_tokens)
+                    if delay <= 0:
+                        break
+                    self.rpm_bucket.refund(1)
+            time.sleep(delay)
+            waited += delay
+
+        with self._lock:
+            now = time.monotonic()
+            self._window.append((now, estimated_tokens))
+            self._prune_window(now)
+            self._counters["requests"] += 1
+            self._counters["in_flight"] += 1
+            self._counters["estimated_tokens"] += estimated_tokens
+            self._counters["wait_seconds"] += waited
+
+    def _prune_window(self, now: float) -> None:
+        """Drop requests older than a minute from the utilization window (caller holds the lock)."""
+        cutoff = now - 60.0
+        while self._window and self._window[0][0] < cutoff:
+            self._window.popleft()
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        """Seconds to wait before retrying, honouring Retry-After headers when present."""
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        retry_after = None
+        try:
+            if headers.get("retry-after-ms"):
+                retry_after = float(headers["retry-after-ms"]) / 1000.0
+            elif headers.get("retry-after"):
+                retry_after = float(headers["retry-after"])
+        except (TypeError, ValueError):
+            retry_after = None
+
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.base_backoff)
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+
+    # ---------------------------
+    # Public API
+    # ---------------------------
+    def run(self, call: Callable[[], Any], estimated_tokens: int,
+            usage_getter: Optional[Callable[[Any], Optional[Dict[str, int]]]] = None) -> Any:
+        """
+        Run `call` once the quota allows it, retrying throttled and transient failures.
+
+        :param call: Zero-argument function performing the LLM request
+        :param estimated_tokens: Prompt tokens + max completion tokens for the request
+        :param usage_getter: Optional function extracting {"input_tokens", "output_tokens"} from the result
+        :return: The result of `call`
+        """
+        attempt = 0
+        while True:
+            self._acquire(estimated_tokens)
+            try:
+                result = call()
+            except retryable_errors() as e:
+                throttled = isinstance(e, retryable_errors()[0])
+                delay = self._retry_delay(e, attempt)
+                with self._lock:
+                    self._counters["in_flight"] -= 1
+                    if throttled:
+                        self._counters["throttled"] += 1
+                        # Pause every worker, not just this one, to avoid a 429 storm
+                        self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+                    if attempt >= self.max_retries:
+                        self._counters["failed"] += 1
+                        raise
+                    self._counters["retries"] += 1
+                attempt += 1
+                print(f"LLM request {'throttled' if throttled else 'failed'} ({e.__class__.__name__}), "
+                      f"retrying in {delay:.1f}s (attempt {attempt}/{self.max_retries})")
+                time.sleep(delay)
+                continue
+            except Exception:
+                with self._lock:
+                    self._counters["in_flight"] -= 1
+                    self._counters["failed"] += 1
+                raise
+
+            usage = usage_getter(result) if usage_getter else None
+            with self._lock:
+                self._counters["in_flight"] -= 1
+                self._counters["succeeded"] += 1
+                if usage:
+                    self._counters["prompt_tokens"] += usage.get("input_tokens", 0)
+                    self._counters["completion_tokens"] += usage.get("output_tokens", 0)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Return live counters plus the RPM/TPM utilization over the last minute."""
+        with self._lock:
+            self._prune_window(time.monotonic())
+            requests_last_minute = len(self._window)
+            tokens_last_minute = sum(tokens for _, tokens in self._window)
+            stats = dict(self._counters)
+        stats.update({
+            "requests_last_minute": requests_last_minute,
+            "tokens_last_minute": tokens_last_minute,
+            "rpm_utilization": requests_last_minute / self.rpm_bucket.per_minute,
+            "tpm_utilization": tokens_last_minute / self.tpm_bucket.per_minute
+        })
+        return stats
+
+    def print_stats(self) -> None:
+        """Print a short utilization summary."""
+        stats = self.stats()
+        print("\n==== LLM QUOTA USAGE ====")
+        print(f"Requests: {stats['requests']} (succeeded: {stats['succeeded']}, failed: {stats['failed']}, "
+              f"throttled: {stats['throttled']}, retries: {stats['retries']})")
+        print(f"Tokens: estimated {stats['estimated_tokens']}, "
+              f"actual prompt {stats['prompt_tokens']}, completion {stats['completion_tokens']}")
+        print(f"Utilization (last minute): RPM {stats['rpm_utilization']:.0%}, TPM {stats['tpm_utilization']:.0%}")
+        print(f"Time spent waiting for quota: {stats['wait_seconds']:.1f}s")
@@ -3,6 +3,7 @@ one for skills (including certifications) and one for projects. """
 
 import json
 from cosmos_db import CosmosDBManager
+from cosmos_telemetry import caller_tag
 
 def validate_employee_data(data):
     """Validate the structure of the employee data."""
@@ -26,6 +27,7 @@ def validate_employee_data(data):
                     if field not in item:
                         raise ValueError(f"Missing required field '{field}' in {section} for employee: {item.get('name', 'Unknown')}")
 
+@caller_tag("load_employee_data")
 def load_data_to_cosmos():
     """Load the employee data from JSON into Cosmos DB."""
     # Initialize Cosmos DB manager
@@ -62,35 +64,30 @@ def load_data_to_cosmos():
     else:
         print("Failed to load metadata")
     
-    # Load employee skills
-    print("\nLoading employee skills...")
-    for skill_doc in data['employee_skills']:
-        employee_doc = {
+    # Load employee skills and projects in one concurrent bulk upsert
+    print("\nLoading employee skills and projects...")
+    skill_docs = [
+        {
             **skill_doc,
             'partitionKey': 'employee',
             'type': 'skills'  # Ensure type is explicitly set
         }
-        print(f"Loading skills for employee: {employee_doc['name']}")
-        result = cosmos_db.upsert_item(employee_doc)
-        if result:
-            print(f"Successfully loaded skills for {employee_doc['name']}")
-        else:
-            print(f"Failed to load skills for {employee_doc['name']}")
-    
-    # Load employee projects
-    print("\nLoading employee projects...")
-    for project_doc in data['employee_projects']:
-        project_history_doc = {
+        for skill_doc in data['employee_skills']
+    ]
+    project_history_docs = [
+        {
             **project_doc,
             'partitionKey': 'project_history',
             'type': 'projects'  # Ensure type is explicitly set
         }
-        print(f"Loading projects for employee: {project_history_doc['name']}")
-        result = cosmos_db.upsert_item(project_history_doc)
-        if result:
-            print(f"Successfully loaded projects for {project_history_doc['name']}")
-        else:
-            print(f"Failed to load projects for {project_history_doc['name']}")
+        for project_doc in data['employee_projects']
+    ]
+    result = cosmos_db.bulk_upsert_items(skill_docs + project_history_docs)
+    for outcome in result['results']:
+        if not outcome['success']:
+            print(f"Failed to load {outcome['partitionKey']} document {outcome['id']}: {outcome['error']}")
+    print(f"Loaded {result['succeeded']} of {len(skill_docs) + len(project_history_docs)} documents "
+          f"({result['request_charge']:.2f} RU)")
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,474 @@
+"""
+### notifications.py ###
+
+Notification emails for the batch agent, sent without holding up the analysis pipeline.
+
+The email HTML is rendered from templates compiled once at import (string.Template, with the
+stylesheet kept out of the per-employee work), and every field taken from the employee or the
+LLM output is HTML-escaped.
+
+NotificationDispatcher takes rendered messages on a bounded queue (submit() blocks when it is
+full, which keeps memory flat on large runs) and:
+    * sends them from a pool of sender threads (email_client.begin_send returns a poller at once);
+    * checks every in-flight poller in one pass of a single poll thread, instead of blocking on
+      poller.result() per employee; at most `max_in_flight` sends are unfinished at a time;
+    * records the status of delivered messages (/notification_sent, /notification_timestamp) in
+      Cosmos DB with bulk_patch_items, in batches of `status_batch_size` or every
+      `status_flush_seconds`, then calls each message's on_done(sent) callback.
+
+Without an email client (notifications disabled) messages are not sent, but their status is
+still recorded, as the agent did before.
+
+FakeEmailClient stands in for azure.communication.email.EmailClient in tests and benchmarks.
+
+Usage:
+    with NotificationDispatcher(email_client, cosmos_db_manager, sender_address) as dispatcher:
+        dispatcher.submit(employee, analysis_result, on_done=lambda sent: ...)
+        dispatcher.drain()
+    dispatcher.print_stats()
+"""
+
+import os
+import html
+import time
+import queue
+import random
+import threading
+import contextvars
+from datetime import datetime
+from string import Template
+from typing import Any, Callable, Dict, List, Optional
+
+from azure.core.exceptions import HttpResponseError
+
+from cosmos_telemetry import caller_tag
+from tracing import TRACER
+
+# Threads calling email_client.begin_send
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))
+# Rendered messages waiting for a sender before submit() blocks
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "200"))
+# Sends whose pollers have not finished yet before the senders wait
+NOTIFY_MAX_IN_FLIGHT = int(os.getenv("NOTIFY_MAX_IN_FLIGHT", "100"))
+# Seconds between passes over the in-flight pollers
+NOTIFY_POLL_SECONDS = float(os.getenv("NOTIFY_POLL_SECONDS", "0.5"))
+# Sends still unfinished after this many seconds are counted as failed
+NOTIFY_SEND_TIMEOUT_SECONDS = float(os.getenv("NOTIFY_SEND_TIMEOUT_SECONDS", "300"))
+# Notification statuses written to Cosmos DB per batch, and the longest a status waits for one
+NOTIFY_STATUS_BATCH_SIZE = int(os.getenv("NOTIFY_STATUS_BATCH_SIZE", "50"))
+NOTIFY_STATUS_FLUSH_SECONDS = float(os.getenv("NOTIFY_STATUS_FLUSH_SECONDS", "2"))
+
+RECOMMENDATIONS_URL = os.getenv("RECOMMENDATIONS_URL", "http://localhost:3000/recommendations")
+
+# -------------------------------
+# Templates
+# -------------------------------
+EMAIL_STYLE = """
+body { font-family: Arial, sans-serif; line-height: 1.6; padding: 20px; background-color: #f4f4f4; }
+.container { max-width: 800px; margin: auto; background: #ffffff; padding: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1); }
+h1 { font-size: 24px; color: #333333; }
+h2 { font-size: 20px; color: #444444; margin-top: 20px; }
+h3 { font-size: 18px; color: #0066cc; margin-bottom: 5px; }
+.thought-process { background: #f9f9f9; padding: 15px; border-radius: 4px; margin: 15px 0; border-left: 4px solid #dddddd; }
+.recommendations { margin-top: 20px; }
+.recommendation { background: #f0f7ff; padding: 15px; border-radius: 4px; margin-bottom: 15px; border-left: 4px solid #0066cc; }
+.level { color: #008800; font-weight: bold; margin-right: 8px; }
+.confidence { color: #666666; font-weight: normal; font-size: 16px; }
+.recommendations-link { color: #0066cc; text-decoration: none; margin-bottom: 15px; display: inline-block; padding: 10px 15px; background: #e6f0ff; border-radius: 4px; }
+.recommendations-link:hover { background: #d4e6ff; text-decoration: underline; }
+"""
+
+EMAIL_TEMPLATE = Template("""<html>
+<head><style>""" + EMAIL_STYLE + """</style></head>
+<body>
+<div class="container">
+<h1>Skills &amp; Competencies Update Recommendation</h1>
+<a href="$recommendations_url" class="recommendations-link">View and Validate Recommendations</a>
+<p>Hello $name,</p>
+<p>Based on our analysis of your profile, we've identified potential competencies to add to your profile:</p>
+<h2>Recommended Competencies</h2>
+<div class="recommendations">
+$recommendations
+</div>
+<h2>Analysis Details</h2>
+<div class="thought-process">
+$thought_process
+</div>
+<p>Best regards,<br/>HR Team</p>
+</div>
+</body>
+</html>
+""")
+
+RECOMMENDATION_TEMPLATE = Template("""<div class="recommendation">
+<h3>$competency <span class="level">$level</span> <span class="confidence">($confidence% confidence)</span></h3>
+<p><strong>Reasoning:</strong> $reasoning</p>
+</div>""")
+
+SUBJECT_TEMPLATE = Template("Skills & Competencies Update Recommendation for $name")
+
+
+def render_notification(employee: Dict[str, Any], analysis_result: Dict[str, Any], sender_address: str) -> Dict[str, Any]:
+    """The Azure Communication Services email message for an employee's analysis."""
+    structured_data = analysis_result["structured_data"]
+    recommendations = "\n".join(
+        RECOMMENDATION_TEMPLATE.substitute(
+            competency=html.escape(str(comp.competency)),
+            level=html.escape(str(comp.level)),
+            confidence=comp.confidence,
+            reasoning=html.escape(str(comp.reasoning))
+        )
+        for comp in structured_data.new_competencies
+    )
+    html_content = EMAIL_TEMPLATE.substitute(
+        recommendations_url=RECOMMENDATIONS_URL,
+        name=html.escape(str(employee['name'])),
+        recommendations=recommendations,
+        thought_process=html.escape(str(structured_data.thought_process))
+    )
+    return {
+        "senderAddress": sender_address,
+        "recipients": {
+            "to": [{"address": employee['email']}]
+        },
+        "content": {
+            "subject": SUBJECT_TEMPLATE.substitute(name=employee['name']),
+            "plainText": analysis_result["text"],
+            "html": html_content
+        }
+    }
+
+
+def notification_status_patch(timestamp: str) -> List[Dict[str, Any]]:
+    return [
+        {"op": "set", "path": "/notification_sent", "value": True},
+        {"op": "set", "path": "/notification_timestamp", "value": timestamp}
+    ]
+
+
+# -------------------------------
+# Dispatcher
+# -------------------------------
+class _Notification:
+    __slots__ = ("employee_id", "address", "message", "on_done", "poller", "sent_at", "timestamp")
+
+    def __init__(self, employee_id: str, address: str, message: Optional[Dict[str, Any]], on_done: Optional[Callable[[bool], None]]):
+        self.employee_id = employee_id
+        self.address = address
+        self.message = message
+        self.on_done = on_done
+        self.poller = None
+        self.sent_at = None
+        self.timestamp = None
+
+
+class NotificationDispatcher:
+    """Sends notification emails concurrently and records their status in Cosmos DB in batches."""
+
+    def __init__(self, email_client, cosmos_db_manager, sender_address: Optional[str] = None,
+                 max_workers: int = NOTIFY_WORKERS, queue_size: int = NOTIFY_QUEUE_SIZE,
+                 max_in_flight: int = NOTIFY_MAX_IN_FLIGHT, poll_interval: float = NOTIFY_POLL_SECONDS,
+                 send_timeout: float = NOTIFY_SEND_TIMEOUT_SECONDS, status_batch_size: int = NOTIFY_STATUS_BATCH_SIZE,
+                 status_flush_seconds: float = NOTIFY_STATUS_FLUSH_SECONDS, partition_key: str = "people"):
+        """
+        :param email_client: EmailClient (or FakeEmailClient); None records the status without sending
+        """
+        self.email_client = email_client
+        self.cosmos_db_manager = cosmos_db_manager
+        self.sender_address = sender_address
+        self.poll_interval = poll_interval
+        self.send_timeout = send_timeout
+        self.status_batch_size = max(1, status_batch_size)
+        self.status_flush_seconds = status_flush_seconds
+        self.partition_key = partition_key
+
+        self._queue: "queue.Queue[Optional[_Notification]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._in_flight_slots = threading.BoundedSemaphore(max(1, max_in_flight))
+        self._in_flight: List[_Notification] = []
+        self._delivered: List[_Notification] = []
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._unfinished = 0
+        self._last_status_flush = time.monotonic()
+        self._closed = False
+        self._counters = {"queued": 0, "sent": 0, "failed": 0, "timed_out": 0, "status_written": 0,
+                          "status_failed": 0, "status_batches": 0}
+
+        # Threads run in a copy of the creating context, so their spans nest under the run's span
+        self._senders = [
+            threading.Thread(target=contextvars.copy_context().run, args=(self._send_loop,),
+                             name=f"notify-send-{index}", daemon=True)
+            for index in range(max(1, max_workers) if email_client is not None else 0)
+        ]
+        self._poll_thread = threading.Thread(target=contextvars.copy_context().run, args=(self._poll_loop,),
+                                             name="notify-poll", daemon=True)
+        for thread in self._senders:
+            thread.start()
+        self._poll_thread.start()
+
+    def __enter__(self) -> "NotificationDispatcher":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    # ---------------------------
+    # Submitting
+    # ---------------------------
+    def submit(self, employee: Dict[str, Any], analysis_result: Dict[str, Any],
+               on_done: Optional[Callable[[bool], None]] = None) -> None:
+        """
+        Queue the notification of an employee (blocks while the queue is full).
+
+        on_done(sent) is called from the dispatcher's poll thread once the email was delivered and
+        its status written (sent=True), or once sending failed (sent=False).
+        """
+        if self._closed:
+            raise RuntimeError("NotificationDispatcher is closed")
+        employee_id = str(employee['employee_id'])
+        with self._lock:
+            self._unfinished += 1
+            self._counters["queued"] += 1
+        if self.email_client is None:
+            print(f"Email notifications are disabled. Skipping email send for employee {employee_id}.")
+            notification = _Notification(employee_id, employee.get('email'), None, on_done)
+            notification.timestamp = datetime.now().isoformat()
+            with self._lock:
+                self._delivered.append(notification)
+            return
+        message = render_notification(employee, analysis_result, self.sender_address)
+        self._queue.put(_Notification(employee_id, employee['email'], message, on_done))
+
+    # ---------------------------
+    # Sender threads
+    # ---------------------------
+    def _send_loop(self) -> None:
+        while True:
+            notification = self._queue.get()
+            if notification is None:
+                return
+            self._in_flight_slots.acquire()
+            try:
+                with TRACER.span("email_send", employee_id=notification.employee_id):
+                    notification.poller = self.email_client.begin_send(notification.message)
+            except Exception as e:
+                self._in_flight_slots.release()
+                print(f"Failed to send email to {notification.address}: {e}")
+                self._finish(notification, False, "failed")
+                continue
+            # The rendered HTML is no longer needed once the service has it
+            notification.message = None
+            notification.sent_at = time.monotonic()
+            with self._lock:
+                self._in_flight.append(notification)
+
+    # ---------------------------
+    # Poll thread
+    # ---------------------------
+    def _poll_loop(self) -> None:
+        while True:
+            self._poll_in_flight()
+            self._flush_status()
+            with self._lock:
+                if self._closed and self._unfinished == 0:
+                    return
+                self._idle.wait(self.poll_interval)
+
+    def _poll_in_flight(self) -> None:
+        """One pass over the in-flight pollers: move finished sends on, leave the rest."""
+        with self._lock:
+            in_flight = list(self._in_flight)
+        if not in_flight:
+            return
+        now = time.monotonic()
+        finished = []
+        for notification in in_flight:
+            if notification.poller.done():
+                try:
+                    notification.poller.result()
+                    print(f"Notification sent successfully to {notification.address}")
+                    notification.timestamp = datetime.now().isoformat()
+                    finished.append((notification, True))
+                except Exception as e:
+                    print(f"Failed to send email to {notification.address}: {e}")
+                    finished.append((notification, False))
+            elif now - notification.sent_at > self.send_timeout:
+                print(f"Email to {notification.address} still not sent after {self.send_timeout:.0f}s; giving up")
+                with self._lock:
+                    self._counters["timed_out"] += 1
+                finished.append((notification, False))
+        if not finished:
+            return
+        done = {id(notification) for notification, _ in finished}
+        with self._lock:
+            self._in_flight = [notification for notification in self._in_flight if id(notification) not in done]
+            self._delivered.extend(notification for notification, sent in finished if sent)
+        for notification, sent in finished:
+            self._in_flight_slots.release()
+            if sent:
+                with self._lock:
+                    self._counters["sent"] += 1
+            else:
+                self._finish(notification, False, "failed")
+
+    def _flush_status(self) -> None:
+        """Write the status of delivered notifications once a batch is full or has waited long enough."""
+        while True:
+            with self._lock:
+                due = (len(self._delivered) >= self.status_batch_size
+                       or time.monotonic() - self._last_status_flush >= self.status_flush_seconds
+                       or self._closed)
+                if not self._delivered or not due:
+                    return
+                batch = self._delivered[:self.status_batch_size]
+                del self._delivered[:self.status_batch_size]
+                self._last_status_flush = time.monotonic()
+            self._write_status(batch)
+
+    def _write_status(self, batch: List[_Notification]) -> None:
+        with TRACER.span("notification_status", notifications=len(batch)) as span, caller_tag("send_notification"):
+            try:
+                result = self.cosmos_db_manager.bulk_patch_items([
+                    {"id": notification.employee_id, "partitionKey": self.partition_key,
+                     "operations": notification_status_patch(notification.timestamp)}
+                    for notification in batch
+                ])
+                written = {outcome["id"] for outcome in result["results"] if outcome["success"]}
+            except Exception as e:
+                print(f"Error updating notification status in Cosmos DB: {e}")
+                span.set_error(str(e))
+                written = set()
+        with self._lock:
+            self._counters["status_batches"] += 1
+        for notification in batch:
+            if notification.employee_id in written:
+                print(f"Updated Cosmos DB record for employee {notification.employee_id} with notification info")
+                self._finish(notification, True, "status_written")
+            else:
+                print(f"Warning: Notification status of employee {notification.employee_id} was not recorded in Cosmos DB")
+                # The email went out; on_done still reports it so it is not sent twice
+                self._finish(notification, True, "status_failed")
+
+    def _finish(self, notification: _Notification, sent: bool, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+        if notification.on_done:
+            try:
+                notification.on_done(sent)
+            except Exception as e:
+                print(f"Error in notification callback for employee {notification.employee_id}: {e}")
+        with self._lock:
+            self._unfinished -= 1
+            if self._unfinished == 0:
+                self._idle.notify_all()
+
+    # ---------------------------
+    # Draining
+    # ---------------------------
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every submitted notification is sent (or failed) and its status written."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            # Statuses waiting for a full batch are written now
+            self._last_status_flush = float("-inf")
+            self._idle.notify_all()
+            while self._unfinished:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(min(self.poll_interval, remaining) if remaining is not None else self.poll_interval)
+                self._last_status_flush = float("-inf")
+        return True
+
+    def close(self) -> None:
+        """Drain and stop the threads."""
+        if self._closed:
+            return
+        self.drain()
+        with self._lock:
+            self._closed = True
+            self._idle.notify_all()
+        for _ in self._senders:
+            self._queue.put(None)
+        for thread in self._senders:
+            thread.join()
+        self._poll_thread.join()
+
+    # ---------------------------
+    # Stats
+    # ---------------------------
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._in_flight)
+            stats["pending"] = self._unfinished
+        return stats
+
+    def print_stats(self) -> None:
+        stats = self.stats()
+        print("\n==== NOTIFICATIONS ====")
+        print(f"Queued: {stats['queued']}, sent: {stats['sent']}, failed: {stats['failed']} "
+              f"({stats['timed_out']} timed out)")
+        print(f"Status recorded in Cosmos DB: {stats['status_written']} in {stats['status_batches']} batches "
+              f"({stats['status_failed']} failed)")
+
+
+# -------------------------------
+# Local email client
+# -------------------------------
+class FakeEmailPoller:
+    """LROPoller stand-in that finishes `latency` seconds after the send, without a thread."""
+
+    def __init__(self, message_id: str, latency: float, failed: bool):
+        self.message_id = message_id
+        self._ready_at = time.monotonic() + latency
+        self._failed = failed
+
+    def done(self) -> bool:
+        return time.monotonic() >= self._ready_at
+
+    def status(self) -> str:
+        if not self.done():
+            return "Running"
+        return "Failed" if self._failed else "Succeeded"
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        delay = self._ready_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay if timeout is None else min(delay, timeout))
+
+    def result(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        self.wait(timeout)
+        if self._failed:
+            raise HttpResponseError(message=f"Email {self.message_id} failed to send (simulated)")
+        return {"id": self.message_id, "status": "Succeeded", "error": None}
+
+
+class FakeEmailClient:
+    """
+    EmailClient stand-in for tests and benchmarks: accepts every message and finishes each send
+    after a log-normal delay; `failure_rate` of them fail. Sent messages are kept in `messages`.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, sigma: float = 0.0, failure_rate: float = 0.0,
+                 seed: Optional[int] = None, keep_messages: bool = True):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.failure_rate = failure_rate
+        self.keep_messages = keep_messages
+        self.messages: List[Dict[str, Any]] = []
+        self.sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def begin_send(self, message: Dict[str, Any], **kwargs) -> FakeEmailPoller:
+        with self._lock:
+            self.sent += 1
+            message_id = f"fake-{self.sent}"
+            if self.keep_messages:
+                self.messages.append(message)
+            latency = self.latency_ms / 1000.0
+            if latency and self.sigma:
+                latency *= self._random.lognormvariate(0, self.sigma)
+            failed = self._random.random() < self.failure_rate
+        return FakeEmailPoller(message_id, latency, failed)
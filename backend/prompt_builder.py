@@ -0,0 +1,293 @@
+"""
+### prompt_builder.py ###
+
+Builds the chat messages for analyze_employee within a token budget. The project history
+(PSE data) is rendered as compactly as needed to fit:
+
+    1. every project, without empty fields, with fields shared by all projects printed once
+    2. the same, dropping low-value columns one at a time (LOW_VALUE_PSE_COLUMNS)
+    3. a summary: per-competency, per-certification and per-cloud-skill project counts with
+       the date each was last required, role frequencies and the most recent projects
+    4. the summary limited to the most frequent items
+
+The first rendering whose prompt fits PROMPT_INPUT_TOKEN_BUDGET is used. Small profiles can also
+be packed into one batched request that shares the system prompt and approved list.
+
+Configuration (environment variables):
+    PROMPT_INPUT_TOKEN_BUDGET   Maximum prompt tokens per analysis (default 6000)
+"""
+
+import os
+import math
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Tuple
+
+from llm_scheduler import count_text_tokens, estimate_prompt_tokens
+from competency_rules import (
+    PSE_COMPETENCY_COLUMNS, PSE_CERTIFICATION_COLUMNS, PSE_CLOUD_SKILL_COLUMNS, PSE_PROJECT_NAME_COLUMNS, split_values
+)
+
+PROMPT_INPUT_TOKEN_BUDGET = int(os.getenv("PROMPT_INPUT_TOKEN_BUDGET", "6000"))
+
+# PSE columns dropped, in this order, when the full project list does not fit the budget
+LOW_VALUE_PSE_COLUMNS = ("project_id", "hours", "client", "project_description")
+# Columns holding project dates, most relevant first (used for recency)
+PSE_DATE_COLUMNS = ("end_date", "start_date")
+PSE_ROLE_COLUMNS = ("role",)
+
+# Sizes of the summary renderings
+SUMMARY_RECENT_PROJECTS = 5
+SUMMARY_TOP_ITEMS = 15
+
+SYSTEM_PROMPT = """You are a competency updater agent specializing in making sure an employee's competencies are aligned with company standards and up to date. You will be provided an employee's 
+current certifications, cloud skills, existing approved competencies, and project history (PSE data). You will also be provided the company-approved list of competencies. Please do the following:
+
+1. Analyze the employee's existing certifications, cloud skills, existing competencies listed, and project history
+2. Compare their info to the company's approved competencies list
+3. Determine which approved competencies are missing and should be added to their profile based on the information provided
+4. Look at the certifications, cloud skills, and project history. Can we glean any approved competencies from these?
+5. For each recommended competency, determine the appropriate skill level: beginner, intermediate, advanced, or expert
+
+Our goal is to closely analyze all available information and produce a comprehensive list of company-approved competencies that the employee should have on their profile.
+
+###Data Source Info###
+
+Project history/PSE Data contains the projects the employee has worked on. Each project will have a list of the required competencies, certifications, and cloud skills. 
+If the employee has worked on a project, and the project required a competency that the employee does not have listed in their existing approved competencies, then the employee is very likely missing that competency.
+
+Direct matches (approved competencies required by a project, or named exactly by a certification or cloud skill) have already been identified and are listed under "Already Identified Competencies". They will be added automatically - do not repeat them.
+For employees with a long project history you may receive a summary instead of every project: how many projects required each competency, certification and cloud skill, and when it was last required.
+Only recommend competencies from the "Candidate Competencies" list, based on the remaining evidence.
+
+
+###Output Format###
+
+1. thought_process: A comprehensive analysis of the employee's skills, certifications, existing approved competencies, and project history. What skills and certifications can map to approved competencies? What can we discern from the projects they worked on?
+
+2. new_competencies: <new competency> <level: beginner/intermediate/advanced/expert> <confidence value> <reasoning - how did you come to this conclusion? what data points support this?>
+
+For each competency, include:
+- Competency name from the approved list
+- Competency level (beginner, intermediate, advanced, or expert) based on evidence from their background
+- A % confidence value (0-100). For obvious matches with the approved competencies, put 100%. For less obvious matches, put some % but be careful not to overstate the confidence.
+- Detailed reasoning that supports both the competency and the assigned level
+"""
+
+
+def _is_missing(value: Any) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, float) and math.isnan(value):
+        return True
+    return isinstance(value, str) and not value.strip()
+
+
+def _clean_projects(projects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop employee_id (redundant) and empty fields from every project."""
+    return [
+        {key: value for key, value in project.items() if key != 'employee_id' and not _is_missing(value)}
+        for project in projects
+    ]
+
+
+def _first_value(project: Dict[str, Any], columns) -> Any:
+    for column in columns:
+        if not _is_missing(project.get(column)):
+            return project[column]
+    return None
+
+
+# -------------------------------
+# Project history renderings
+# -------------------------------
+def format_project_rows(projects: List[Dict[str, Any]], dropped_columns=()) -> str:
+    """Render every project as key: value lines, printing fields shared by all projects once."""
+    projects = [{k: v for k, v in project.items() if k not in dropped_columns} for project in projects]
+    common = {}
+    if len(projects) > 1:
+        common = {
+            key: value for key, value in projects[0].items()
+            if all(project.get(key) == value for project in projects[1:])
+        }
+
+    text = "Project History (PSE Data):\n"
+    if common:
+        text += "Common to all projects:\n"
+        text += "".join(f"  {key}: {value}\n" for key, value in common.items())
+        text += "\n"
+    for idx, project in enumerate(projects, 1):
+        text += f"Project {idx}:\n"
+        text += "".join(f"  {key}: {value}\n" for key, value in project.items() if key not in common)
+        text += "\n"
+    return text
+
+
+def summarize_projects(projects: List[Dict[str, Any]], top_items: int = None) -> str:
+    """Aggregate the project history into frequency and recency summaries."""
+    sections = (
+        ("Required competencies", PSE_COMPETENCY_COLUMNS),
+        ("Required certifications", PSE_CERTIFICATION_COLUMNS),
+        ("Required cloud skills", PSE_CLOUD_SKILL_COLUMNS)
+    )
+    counts = {title: Counter() for title, _ in sections}
+    last_required = {title: {} for title, _ in sections}
+    roles = Counter()
+    dates = []
+
+    for project in projects:
+        date = _first_value(project, PSE_DATE_COLUMNS)
+        date = str(date) if date is not None else None
+        if date:
+            dates.append(date)
+        role = _first_value(project, PSE_ROLE_COLUMNS)
+        if role is not None:
+            roles[str(role)] += 1
+        for title, columns in sections:
+            values = set()
+            for column in columns:
+                values.update(split_values(project.get(column)))
+            for value in values:
+                counts[title][value] += 1
+                if date and date > last_required[title].get(value, ""):
+                    last_required[title][value] = date
+
+    text = f"Project History Summary (PSE Data): {len(projects)} projects"
+    if dates:
+        text += f", {min(dates)} to {max(dates)}"
+    text += "\n"
+    if roles:
+        text += "Roles: " + ", ".join(f"{role} ({count})" for role, count in roles.most_common(top_items)) + "\n"
+
+    for title, _ in sections:
+        if not counts[title]:
+            continue
+        items = counts[title].most_common(top_items)
+        text += f"{title} (number of projects, last required):\n"
+        text += "".join(
+            f"- {value}: {count}" + (f", last {last_required[title][value]}" if value in last_required[title] else "") + "\n"
+            for value, count in items
+        )
+        if len(counts[title]) > len(items):
+            text += f"- ... {len(counts[title]) - len(items)} less frequent items omitted\n"
+
+    recent = sorted(projects, key=lambda p: str(_first_value(p, PSE_DATE_COLUMNS) or ""), reverse=True)
+    text += "Most recent projects:\n"
+    for project in recent[:SUMMARY_RECENT_PROJECTS]:
+        name = _first_value(project, PSE_PROJECT_NAME_COLUMNS) or "Unnamed project"
+        details = [str(value) for value in (_first_value(project, PSE_ROLE_COLUMNS), project.get("start_date"), project.get("end_date"))
+                   if not _is_missing(value)]
+        text += f"- {name}" + (f" ({', '.join(details)})" if details else "") + "\n"
+    return text
+
+
+def _pse_renderings(employee_pse_data: List[Dict[str, Any]]) -> Iterator[Tuple[str, str]]:
+    """Yield (stage, text) renderings of the project history, from most to least detailed."""
+    if not employee_pse_data:
+        yield "none", "Project History (PSE Data): No project history available\n"
+        return
+
+    projects = _clean_projects(employee_pse_data)
+    yield "full", format_project_rows(projects)
+    dropped = []
+    for column in LOW_VALUE_PSE_COLUMNS:
+        if any(column in project for project in projects):
+            dropped.append(column)
+            yield f"without {', '.join(dropped)}", format_project_rows(projects, dropped)
+    yield "summary", summarize_projects(projects)
+    yield f"summary (top {SUMMARY_TOP_ITEMS})", summarize_projects(projects, SUMMARY_TOP_ITEMS)
+
+
+# -------------------------------
+# Messages
+# -------------------------------
+def _format_profile(employee: Dict[str, Any], pse_data_formatted: str, identified_competencies: List[str]) -> str:
+    """The per-employee part of the user message."""
+    return f"""### Employee Name: {employee['name']} ###
+Existing Cloud Skills: {', '.join(employee['cloud_skills'])}
+Existing Competencies:
+{chr(10).join(f"- {comp}: {level}" for comp, level in employee['competencies'].items())}
+Existing Certifications: {', '.join(employee['certifications'])}
+
+{pse_data_formatted}
+
+### Already Identified Competencies ###
+{', '.join(identified_competencies) or 'None'}
+"""
+
+
+def build_messages(employee: Dict[str, Any], employee_pse_data: List[Dict[str, Any]],
+                   identified_competencies: List[str], candidate_competencies: List[str],
+                   budget: int = PROMPT_INPUT_TOKEN_BUDGET) -> Dict[str, Any]:
+    """
+    Build the analysis messages for one employee within `budget` prompt tokens.
+
+    :return: {"messages": [...], "prompt_tokens": int, "pse_rendering": name of the rendering used}
+    """
+    for stage, pse_data_formatted in _pse_renderings(employee_pse_data):
+        user_message = _format_profile(employee, pse_data_formatted, identified_competencies) + f"""
+### Candidate Competencies ###
+{', '.join(candidate_competencies)}
+"""
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_message}
+        ]
+        prompt_tokens = estimate_prompt_tokens(messages)
+        if prompt_tokens <= budget:
+            break
+
+    if prompt_tokens > budget:
+        print(f"Warning: prompt for {employee['name']} is {prompt_tokens} tokens, over the {budget} token budget")
+    return {"messages": messages, "prompt_tokens": prompt_tokens, "pse_rendering": stage}
+
+
+# -------------------------------
+# Batched messages
+# -------------------------------
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+###Batch Mode###
+
+You will receive several employees at once, each introduced by a "### Employee ID: <id> ###" line. Analyze every employee independently - never use one employee's data for another.
+For each employee, the candidate competencies are the Company Approved Competencies that are not already in their Existing Competencies or Already Identified Competencies.
+Return exactly one entry in results per employee, with the employee_id copied exactly as given and that employee's thought_process and new_competencies.
+"""
+
+
+def render_employee_profile(employee: Dict[str, Any], employee_pse_data: List[Dict[str, Any]],
+                            identified_competencies: List[str], budget: int) -> Dict[str, Any]:
+    """
+    Render one employee's profile for a batched request, as detailed as fits in `budget` tokens.
+
+    :return: {"text": str, "tokens": int, "pse_rendering": str, "fits": bool}
+    """
+    for stage, pse_data_formatted in _pse_renderings(employee_pse_data):
+        text = f"### Employee ID: {employee['employee_id']} ###\n" + _format_profile(employee, pse_data_formatted, identified_competencies)
+        tokens = count_text_tokens(text)
+        if tokens <= budget:
+            break
+    return {"text": text, "tokens": tokens, "pse_rendering": stage, "fits": tokens <= budget}
+
+
+def build_batch_messages(profiles: List[Dict[str, Any]], approved_competencies: List[str]) -> Dict[str, Any]:
+    """
+    Build one request covering several employee profiles (from render_employee_profile).
+
+    The system prompt and approved list are shared by every employee in the batch.
+
+    :return: {"messages": [...], "prompt_tokens": int, "shared_tokens": tokens not attributable to one employee}
+    """
+    shared = f"""### Company Approved Competencies ###
+{', '.join(approved_competencies)}
+
+"""
+    user_message = shared + "\n".join(profile["text"] for profile in profiles)
+    messages = [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": user_message}
+    ]
+    prompt_tokens = estimate_prompt_tokens(messages)
+    return {
+        "messages": messages,
+        "prompt_tokens": prompt_tokens,
+        "shared_tokens": max(0, prompt_tokens - sum(profile["tokens"] for profile in profiles))
+    }
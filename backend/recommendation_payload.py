@@ -0,0 +1,79 @@
+"""
+### recommendation_payload.py ###
+
+API-ready projection of an employee's competency recommendations, shared by the agent (which
+stores it) and app.py (which serves it). The agent writes the validated, confidence-sorted
+payload as a JSON string in the employee document (`recommendations_payload`) together with
+`recommendations_schema_version`, so the API can return the stored bytes without building
+models per request. Bump RECOMMENDATIONS_SCHEMA_VERSION whenever the models below change;
+records with another version are rebuilt from `analysis_result` on read.
+"""
+
+from typing import Any, Dict, Iterable, List
+from pydantic import BaseModel, Field
+
+RECOMMENDATIONS_SCHEMA_VERSION = 1
+
+
+# Define models for our API responses
+class CompetencyRecommendation(BaseModel):
+    id: str
+    name: str  # This is the competency name
+    level: str  # One of: "beginner", "intermediate", "advanced", "expert"
+    confidence: int  # Percentage (0-100)
+    reasoning: str = Field(..., description="The reasoning provided by the agent")
+
+class EmployeeRecommendations(BaseModel):
+    employee_id: str
+    employee_name: str
+    recommendations: List[CompetencyRecommendation]
+
+
+def build_employee_recommendations(employee_id: str, employee_name: str,
+                                   new_competencies: Iterable[Dict[str, Any]]) -> EmployeeRecommendations:
+    """Turn the agent's new_competencies into the API response, sorted by confidence (highest first)."""
+    recommendations = []
+    for i, comp in enumerate(new_competencies):
+        try:
+            recommendation = CompetencyRecommendation(
+                id=str(i+1),
+                name=comp['competency'],
+                level=comp['level'],
+                confidence=comp['confidence'],
+                reasoning=comp.get('reasoning', "No reasoning provided")
+            )
+        except Exception as e:
+            print(f"Error creating recommendation object: {e}")
+            recommendation = CompetencyRecommendation(
+                id=str(i+1),
+                name=comp.get('competency', 'Unknown'),
+                level=comp.get('level', 'beginner'),
+                confidence=comp.get('confidence', 0),
+                reasoning=f"Error processing: {str(e)}"
+            )
+        recommendations.append(recommendation)
+
+    recommendations.sort(key=lambda x: x.confidence, reverse=True)
+
+    return EmployeeRecommendations(
+        employee_id=employee_id,
+        employee_name=employee_name,
+        recommendations=recommendations
+    )
+
+
+def build_recommendations_payload(employee_id: str, employee_name: str, new_competencies: Iterable[Dict[str, Any]]) -> str:
+    """Serialized EmployeeRecommendations, as stored in `recommendations_payload`."""
+    return build_employee_recommendations(employee_id, employee_name, new_competencies).model_dump_json()
+
+
+def payload_from_record(employee_record: Dict[str, Any]) -> bytes:
+    """Response body for an employee document: the stored payload if current, else rebuilt from analysis_result."""
+    payload = employee_record.get('recommendations_payload')
+    if payload and employee_record.get('recommendations_schema_version') == RECOMMENDATIONS_SCHEMA_VERSION:
+        return payload.encode("utf-8")
+
+    new_competencies = (employee_record.get('analysis_result') or {}).get('new_competencies') or []
+    return build_recommendations_payload(
+        employee_record['employee_id'], employee_record['employee_name'], new_competencies
+    ).encode("utf-8")
@@ -0,0 +1,297 @@
+"""
+### run_journal.py ###
+
+Crash-safe checkpoint journal for agent batch runs. Every employee's progress through the
+pipeline (analyzed -> stored -> notified) is recorded under the run id, so a run that dies
+partway through (VM eviction, a bad row, an expired token) can be resumed with
+`agent_v2.py --resume <run_id>`: completed employees are skipped, analyzed-but-unstored ones
+are stored from the journaled analysis without another LLM call, and stored-but-unnotified
+ones are only notified.
+
+Two backends:
+    * file   - an append-only JSON Lines file in AGENT_JOURNAL_DIR (default "run_journals").
+               Each flush is one write + fsync; a line torn by a crash is ignored on replay.
+    * cosmos - control documents in the agent's container (partition "agent_runs"), for hosts
+               without durable local disk. Each flush writes the new records as delta documents
+               ("run-journal-<run_id>-<seq>", at most DELTA_DOCUMENT_RECORDS records each), so a
+               flush costs the same RU at the end of a long run as at the start and no document
+               grows towards the 2 MB item limit. Replay reads them back in sequence order.
+
+Writes are buffered and flushed every FLUSH_EVERY records or FLUSH_INTERVAL_SECONDS, whichever
+comes first, so checkpointing adds a dict update per stage to the hot loop. Replay takes the
+furthest stage seen per employee, so batches flushed out of order by worker threads are safe.
+Records of a failed flush are retried with the next one, at most once per FLUSH_INTERVAL_SECONDS;
+while the store stays unreachable the buffer keeps the newest MAX_BUFFERED_RECORDS and the
+dropped count is reported (a resume repeats the work of those employees).
+
+Usage:
+    journal = RunJournal.open(run_id, "file", resume=True)
+    if not journal.is_complete(employee_id):
+        ...
+        journal.record(employee_id, "stored")
+    journal.close()
+"""
+
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+STAGES = ("analyzed", "stored", "notified")
+
+JOURNAL_BACKENDS = ("file", "cosmos", "off")
+
+DEFAULT_JOURNAL_DIR = os.getenv("AGENT_JOURNAL_DIR", "run_journals")
+# Buffered records are flushed after this many records or seconds, whichever comes first
+FLUSH_EVERY = int(os.getenv("AGENT_JOURNAL_FLUSH_EVERY", "100"))
+FLUSH_INTERVAL_SECONDS = float(os.getenv("AGENT_JOURNAL_FLUSH_SECONDS", "2"))
+# Records kept for retry while flushes fail; older ones are dropped beyond this
+MAX_BUFFERED_RECORDS = int(os.getenv("AGENT_JOURNAL_MAX_BUFFERED", "10000"))
+# Records per Cosmos DB delta document (a journaled analysis is a few KB)
+DELTA_DOCUMENT_RECORDS = 100
+
+# Partition of the control documents in the agent's container
+CONTROL_PARTITION_KEY = "agent_runs"
+
+
+class FileJournalStore:
+    """Append-only JSON Lines journal on local disk."""
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def __str__(self) -> str:
+        return self.path
+
+    def load(self) -> Iterable[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave the last line half-written
+                    print(f"Ignoring unreadable journal line {line_number} in {self.path}")
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+
+class CosmosJournalStore:
+    """Journal kept as a sequence of delta documents in the agent's Cosmos DB container."""
+
+    def __init__(self, cosmos_db_manager, run_id: str, records_per_document: int = DELTA_DOCUMENT_RECORDS):
+        self.cosmos_db_manager = cosmos_db_manager
+        self.run_id = run_id
+        self.records_per_document = records_per_document
+        self.document_prefix = f"run-journal-{run_id}-"
+        # Sequence number of the next delta document; found on the first load or write
+        self._next_seq: Optional[int] = None
+
+    def __str__(self) -> str:
+        return f"Cosmos DB documents {self.document_prefix}*"
+
+    def _deltas(self) -> List[Dict[str, Any]]:
+        deltas = self.cosmos_db_manager.query_items(
+            "SELECT * FROM c WHERE c.type = 'run_journal_delta' AND c.run_id = @run_id",
+            parameters=[{"name": "@run_id", "value": self.run_id}],
+            partition_key=CONTROL_PARTITION_KEY
+        )
+        return sorted(deltas, key=lambda delta: delta["seq"])
+
+    def load(self) -> Iterable[Dict[str, Any]]:
+        deltas = self._deltas()
+        self._next_seq = deltas[-1]["seq"] + 1 if deltas else 0
+        for delta in deltas:
+            yield from delta["records"]
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        if self._next_seq is None:
+            # A new attempt of a run that already has deltas continues their sequence
+            seqs = self.cosmos_db_manager.query_items(
+                "SELECT VALUE c.seq FROM c WHERE c.type = 'run_journal_delta' AND c.run_id = @run_id",
+                parameters=[{"name": "@run_id", "value": self.run_id}],
+                partition_key=CONTROL_PARTITION_KEY
+            )
+            self._next_seq = max(seqs) + 1 if seqs else 0
+        for start in range(0, len(records), self.records_per_document):
+            document = {
+                "id": f"{self.document_prefix}{self._next_seq:06d}",
+                "partitionKey": CONTROL_PARTITION_KEY,
+                "type": "run_journal_delta",
+                "run_id": self.run_id,
+                "seq": self._next_seq,
+                "records": records[start:start + self.records_per_document],
+                "written_at": datetime.now().isoformat()
+            }
+            if not self.cosmos_db_manager.upsert_item(document):
+                # The retry rewrites this sequence number, so a delta that was written after all is replaced
+                raise RuntimeError(f"Failed to upsert {document['id']}")
+            self._next_seq += 1
+
+
+class RunJournal:
+    """Thread-safe, buffered record of each employee's furthest completed stage in a run."""
+
+    def __init__(self, run_id: str, store, final_stage: str = "notified",
+                 flush_every: int = FLUSH_EVERY, flush_interval: float = FLUSH_INTERVAL_SECONDS,
+                 max_buffered: int = MAX_BUFFERED_RECORDS):
+        """
+        :param final_stage: Stage after which an employee is complete ("stored" when notifications are off)
+        :param max_buffered: Records kept for retry while flushes fail; the oldest are dropped beyond it
+        """
+        if final_stage not in STAGES:
+            raise ValueError(f"Unknown stage: {final_stage}")
+        self.run_id = run_id
+        self.store = store
+        self.final_stage = final_stage
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self._stages: Dict[str, int] = {}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        # Set while the last flush failed: retry on the interval only, not on every record
+        self._failing = False
+        self._counters = {"replayed": 0, "recorded": 0, "flushes": 0, "flush_errors": 0, "dropped": 0}
+
+    @classmethod
+    def open(cls, run_id: str, backend: str = "file", journal_dir: str = DEFAULT_JOURNAL_DIR,
+             cosmos_db_manager=None, resume: bool = False, **kwargs) -> "RunJournal":
+        """Create the journal of `run_id`; with `resume`, replay what an earlier attempt recorded."""
+        if backend == "file":
+            store = FileJournalStore(os.path.join(journal_dir, f"run_{run_id}.journal.jsonl"))
+        elif backend == "cosmos":
+            store = CosmosJournalStore(cosmos_db_manager, run_id)
+        else:
+            raise ValueError(f"Unknown journal backend: {backend}")
+
+        journal = cls(run_id, store, **kwargs)
+        if resume:
+            journal.replay()
+        journal._append({"type": "resume" if resume else "start", "run_id": run_id,
+                         "timestamp": datetime.now().isoformat()})
+        return journal
+
+    # ---------------------------
+    # State
+    # ---------------------------
+    def _apply(self, employee_id: str, stage: str, analysis: Optional[Dict[str, Any]]) -> None:
+        index = STAGES.index(stage)
+        current = self._stages.get(employee_id, -1)
+        if index > current:
+            self._stages[employee_id] = current = index
+        if current >= STAGES.index(self.final_stage):
+            self._pending.pop(employee_id, None)
+        elif analysis is not None:
+            self._pending[employee_id] = analysis
+
+    def replay(self) -> int:
+        """Load the records of an earlier attempt; returns the number of employees with progress."""
+        count = 0
+        with self._lock:
+            for record in self.store.load():
+                if record.get("stage") in STAGES:
+                    self._apply(str(record["employee_id"]), record["stage"], record.get("analysis"))
+                    count += 1
+            self._counters["replayed"] += count
+            return len(self._stages)
+
+    def stage(self, employee_id) -> Optional[str]:
+        """Furthest stage recorded for the employee, or None."""
+        index = self._stages.get(str(employee_id))
+        return STAGES[index] if index is not None else None
+
+    def is_complete(self, employee_id) -> bool:
+        return self._stages.get(str(employee_id), -1) >= STAGES.index(self.final_stage)
+
+    def pending_analysis(self, employee_id) -> Optional[Dict[str, Any]]:
+        """Journaled analysis of an employee that was analyzed but not completed."""
+        return self._pending.get(str(employee_id))
+
+    # ---------------------------
+    # Recording
+    # ---------------------------
+    def record(self, employee_id, stage: str, analysis: Optional[Dict[str, Any]] = None) -> None:
+        """Record that `employee_id` completed `stage`; `analysis` lets a resume skip the LLM call."""
+        employee_id = str(employee_id)
+        record = {"employee_id": employee_id, "stage": stage, "timestamp": time.time()}
+        if analysis is not None:
+            record["analysis"] = analysis
+        with self._lock:
+            self._apply(employee_id, stage, analysis)
+            self._counters["recorded"] += 1
+        self._append(record)
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._buffer.append(record)
+            due = ((len(self._buffer) >= self.flush_every and not self._failing)
+                   or time.monotonic() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered records; on failure they are kept (up to max_buffered) for the next flush."""
+        with self._write_lock:
+            with self._lock:
+                records, self._buffer = self._buffer, []
+                self._last_flush = time.monotonic()
+                if not records:
+                    return
+            try:
+                self.store.write(records)
+                self._counters["flushes"] += 1
+                self._failing = False
+            except Exception as e:
+                with self._lock:
+                    self._buffer[:0] = records
+                    dropped = max(0, len(self._buffer) - self.max_buffered)
+                    if dropped:
+                        del self._buffer[:dropped]
+                    self._counters["flush_errors"] += 1
+                    self._counters["dropped"] += dropped
+                    self._failing = True
+                print(f"Error writing run journal to {self.store}: {e} ({len(self._buffer)} records kept for retry"
+                      + (f", {dropped} oldest dropped" if dropped else "") + ")")
+
+    def close(self) -> None:
+        self.flush()
+
+    # ---------------------------
+    # Stats
+    # ---------------------------
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["employees"] = len(self._stages)
+            stats["complete"] = sum(1 for index in self._stages.values() if index >= STAGES.index(self.final_stage))
+            stats["pending"] = len(self._pending)
+            stats["buffered"] = len(self._buffer)
+        return stats
+
+    def print_stats(self) -> None:
+        stats = self.stats()
+        print("\n==== RUN JOURNAL ====")
+        print(f"Run {self.run_id}: {stats['employees']} employees journaled, {stats['complete']} complete, "
+              f"{stats['pending']} pending (journal: {self.store})")
+        print(f"Records: {stats['recorded']} written in {stats['flushes']} flushes "
+              f"({stats['flush_errors']} failed), {stats['replayed']} replayed")
+        if stats["buffered"] or stats["dropped"]:
+            print(f"WARNING: {stats['buffered']} records not written, {stats['dropped']} dropped; "
+                  f"resuming this run repeats the work they recorded")
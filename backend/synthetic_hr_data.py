@@ -0,0 +1,154 @@
+"""
+### synthetic_hr_data.py ###
+
+Generates synthetic Workday, PSE (Project System of Engagement) and approved-values CSV files
+in the formats read by agent_v2.py, for benchmarking without access to real HR exports.
+Generation is streamed to disk so very large files can be produced with little memory.
+
+Usage:
+    python synthetic_hr_data.py --employees 10000 --pse-rows 100000 --output-dir ./synthetic
+"""
+
+import os
+import csv
+import random
+import argparse
+from datetime import date, timedelta
+
+APPROVED_COMPETENCIES = [
+    "Technical Architecture", "System Design", "Solution Architecture", "Technical Strategy",
+    "Innovation Leadership", "AI Strategy", "Data Strategy", "ML Architecture", "Data Architecture",
+    "AI Governance", "Data Governance", "Technical Team Leadership", "Project Management",
+    "Agile Leadership", "Product Strategy", "Cross-functional Collaboration", "Cloud Architecture",
+    "DevOps", "Security Engineering", "Data Engineering", "Machine Learning Engineering",
+    "Business Intelligence", "Stakeholder Management", "Technical Pre-Sales", "Mentorship"
+]
+
+CERTIFICATIONS = [
+    "AZ-900", "AZ-104", "AZ-204", "AZ-305", "AZ-400", "DP-100", "DP-203", "AI-102",
+    "AWS Solutions Architect Associate", "AWS Developer Associate", "GCP Professional Data Engineer",
+    "PMP", "CSM", "CKA", "CISSP", "TOGAF"
+]
+
+CLOUD_SKILLS = [
+    "Azure", "AWS", "GCP", "Kubernetes", "Docker", "Terraform", "Azure OpenAI", "Databricks",
+    "Snowflake", "Cosmos DB", "Azure Functions", "AKS", "CI/CD", "Power BI", "Spark"
+]
+
+LEVELS = ["beginner", "intermediate", "advanced", "expert"]
+
+ROLES = ["Developer", "Lead Developer", "Architect", "Data Engineer", "Project Manager", "Consultant", "Analyst"]
+
+CLIENTS = ["Contoso", "Fabrikam", "Northwind", "Tailspin", "Woodgrove", "Adventure Works", "Litware"]
+
+WORKDAY_COLUMNS = ["employee_id", "name", "email", "competencies", "certifications", "cloud_skills"]
+
+PSE_COLUMNS = [
+    "employee_id", "project_id", "project_name", "client", "role", "start_date", "end_date", "hours",
+    "required_competencies", "required_certifications", "required_cloud_skills", "project_description"
+]
+
+
+def employee_id_for(index: int) -> str:
+    """Stable, fixed-width employee id for the n-th synthetic employee (sorts like an integer)."""
+    return f"{10000000 + index}"
+
+
+def _sample(rng: random.Random, values, low: int, high: int):
+    return rng.sample(values, rng.randint(low, min(high, len(values))))
+
+
+def generate_workday_csv(file_path: str, num_employees: int, seed: int = 42) -> str:
+    """Write a Workday export with `num_employees` rows, sorted by employee_id."""
+    rng = random.Random(seed)
+    with open(file_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(WORKDAY_COLUMNS)
+        for index in range(num_employees):
+            competencies = ",".join(
+                f"{competency}:{rng.choice(LEVELS)}" for competency in _sample(rng, APPROVED_COMPETENCIES, 0, 9)
+            )
+            writer.writerow([
+                employee_id_for(index),
+                f"Employee {index}",
+                f"employee{index}@example.com",
+                competencies,
+                ",".join(_sample(rng, CERTIFICATIONS, 0, 4)),
+                ",".join(_sample(rng, CLOUD_SKILLS, 0, 5))
+            ])
+    return file_path
+
+
+def generate_pse_csv(file_path: str, num_rows: int, num_employees: int, seed: int = 43) -> str:
+    """
+    Write a PSE export with `num_rows` project rows spread over `num_employees` employees.
+
+    Rows are written grouped and sorted by employee_id, as the streaming loaders expect.
+    Project counts per employee are skewed so a few employees have long project histories.
+    """
+    rng = random.Random(seed)
+    num_employees = max(1, num_employees)
+    weights = [rng.paretovariate(1.5) for _ in range(num_employees)]
+    total_weight = sum(weights)
+    counts = [int(num_rows * weight / total_weight) for weight in weights]
+    for index in rng.sample(range(num_employees), min(num_employees, num_rows - sum(counts))):
+        counts[index] += 1
+
+    project_id = 0
+    with open(file_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(PSE_COLUMNS)
+        for index, count in enumerate(counts):
+            for _ in range(count):
+                project_id += 1
+                start = date(2015, 1, 1) + timedelta(days=rng.randint(0, 3500))
+                end = start + timedelta(days=rng.randint(30, 720))
+                client = rng.choice(CLIENTS)
+                writer.writerow([
+                    employee_id_for(index),
+                    f"P{project_id:08d}",
+                    f"{client} modernization {project_id}",
+                    client,
+                    rng.choice(ROLES),
+                    start.isoformat(),
+                    end.isoformat(),
+                    rng.randint(40, 2000),
+                    ",".join(_sample(rng, APPROVED_COMPETENCIES, 1, 4)),
+                    ",".join(_sample(rng, CERTIFICATIONS, 0, 2)),
+                    ",".join(_sample(rng, CLOUD_SKILLS, 1, 4)),
+                    f"Delivery of a {rng.choice(CLOUD_SKILLS)} platform for {client}"
+                ])
+    return file_path
+
+
+def generate_approved_values_csv(file_path: str) -> str:
+    """Write the approved-values file with the approved_competency column."""
+    with open(file_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["approved_competency"])
+        for competency in APPROVED_COMPETENCIES:
+            writer.writerow([competency])
+    return file_path
+
+
+def generate_dataset(output_dir: str, num_employees: int, num_pse_rows: int, seed: int = 42) -> dict:
+    """Generate all three CSV files into `output_dir` and return their paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    return {
+        "workday": generate_workday_csv(os.path.join(output_dir, "employee_data_workday.csv"), num_employees, seed),
+        "pse": generate_pse_csv(os.path.join(output_dir, "employee_data_pse.csv"), num_pse_rows, num_employees, seed + 1),
+        "approved": generate_approved_values_csv(os.path.join(output_dir, "approved_values.csv"))
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic HR CSV files")
+    parser.add_argument("--employees", type=int, default=1000)
+    parser.add_argument("--pse-rows", type=int, default=10000)
+    parser.add_argument("--output-dir", default="synthetic_data")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    paths = generate_dataset(args.output_dir, args.employees, args.pse_rows, args.seed)
+    for name, path in paths.items():
+        print(f"Wrote {name}: {path}")
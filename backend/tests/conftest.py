@@ -0,0 +1,15 @@
+"""
+### conftest.py ###
+
+The backend modules are flat scripts run from the backend directory; make them importable and
+keep the tests offline (no LLM response cache on disk, no scheduler throttling).
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("LLM_CACHE_ENABLED", "0")
+os.environ.setdefault("AOAI_TPM_LIMIT", "100000000")
+os.environ.setdefault("AOAI_RPM_LIMIT", "600000")
@@ -0,0 +1,77 @@
+import io
+import contextlib
+
+import pytest
+
+from agent_v2 import CompetencyAnalysis, store_employee_analysis
+from cosmos_db import CosmosDBManager
+from cosmos_db_memory import InMemoryContainer
+
+EMPLOYEE = {"employee_id": "7", "name": "Ada", "email": "ada@example.com"}
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def _analysis(*competencies):
+    structured_data = CompetencyAnalysis.model_validate({
+        "thought_process": "",
+        "new_competencies": [{"competency": name, "level": "advanced", "confidence": 80, "reasoning": "Projects."}
+                             for name in competencies]
+    })
+    return {"structured_data": structured_data, "input_fingerprint": "f", "prompt_tokens": 10}
+
+
+def _decide(container, **decisions):
+    record = container.read_item("7", "people")
+    record["decisions"] = {name: {"decision": decision, "level": None, "timestamp": "t"}
+                           for name, decision in decisions.items()}
+    container.upsert_item(record)
+
+
+def test_rerun_keeps_decisions_about_competencies_still_recommended():
+    container = InMemoryContainer()
+    manager = CosmosDBManager.from_container(container)
+    assert store_employee_analysis(EMPLOYEE, _analysis("DevOps", "Data Engineering"), manager)
+    _decide(container, **{"DevOps": "approve", "Data Engineering": "reject"})
+
+    assert store_employee_analysis(EMPLOYEE, _analysis("devops", "ML Architecture"), manager)
+
+    record = container.read_item("7", "people")
+    assert record["decisions"] == {"devops": {"decision": "approve", "level": None, "timestamp": "t"}}
+    assert record["approved"] is False and record["approved_timestamp"] is None
+
+    # Once the remaining recommendations are all decided the record stays approved across re-runs
+    _decide(container, devops="approve", **{"ML Architecture": "approve"})
+    assert store_employee_analysis(EMPLOYEE, _analysis("DevOps", "ML Architecture"), manager)
+    record = container.read_item("7", "people")
+    assert set(record["decisions"]) == {"DevOps", "ML Architecture"}
+    assert record["approved"] is True and record["approved_timestamp"]
+
+
+def test_decisions_saved_while_the_agent_stores_are_not_dropped():
+    container = InMemoryContainer()
+    manager = CosmosDBManager.from_container(container)
+    assert store_employee_analysis(EMPLOYEE, _analysis("DevOps"), manager)
+
+    read_item = manager.read_item
+    reads = []
+
+    def read_then_decide(item_id, partition_key):
+        record = read_item(item_id, partition_key)
+        reads.append(record["_etag"])
+        if len(reads) == 1:
+            # The API saves a decision between the agent's read and its write
+            _decide(container, DevOps="approve")
+        return record
+
+    manager.read_item = read_then_decide
+    assert store_employee_analysis(EMPLOYEE, _analysis("DevOps"), manager)
+
+    assert len(reads) == 2 and reads[0] != reads[1]
+    record = container.read_item("7", "people")
+    assert record["decisions"]["DevOps"]["decision"] == "approve"
+    assert record["approved"] is True
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+import app
+from response_cache import CachedResponse
+
+
+@pytest.fixture
+def gated_load(monkeypatch):
+    """Replace the Cosmos DB read with one that returns each version only when released."""
+    app.recommendations_cache.clear()
+    versions = []
+
+    async def load(employee_id):
+        gate = asyncio.Event()
+        versions.append(gate)
+        version = len(versions)
+        await gate.wait()
+        return CachedResponse(body=f"version {version}".encode(), etag=None)
+
+    monkeypatch.setattr(app, "_load_employee_recommendations", load)
+    return versions
+
+
+def test_load_in_flight_during_invalidation_is_not_cached(gated_load):
+    async def scenario():
+        stale = asyncio.create_task(app.get_employee_recommendations("e1"))
+        await asyncio.sleep(0)
+        app.invalidate_employee_recommendations("e1")
+
+        # A request after the change starts its own read instead of joining the stale one
+        fresh = asyncio.create_task(app.get_employee_recommendations("e1"))
+        await asyncio.sleep(0)
+        assert len(gated_load) == 2
+
+        gated_load[0].set()
+        assert (await stale).body == b"version 1"
+        assert app.recommendations_cache.get("e1") is None
+
+        gated_load[1].set()
+        assert (await fresh).body == b"version 2"
+        assert app.recommendations_cache.get("e1").body == b"version 2"
+        assert "e1" not in app._pending_loads
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_requests_share_one_load(gated_load):
+    async def scenario():
+        requests = [asyncio.create_task(app.get_employee_recommendations("e2")) for _ in range(3)]
+        await asyncio.sleep(0)
+        gated_load[0].set()
+        assert {(await request).body for request in requests} == {b"version 1"}
+        assert len(gated_load) == 1
+
+    asyncio.run(scenario())
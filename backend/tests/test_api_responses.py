@@ -0,0 +1,74 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app
+from cosmos_db_async import AsyncCosmosDBManager
+from cosmos_db_memory import AsyncInMemoryContainer, InMemoryContainer
+from recommendation_payload import RECOMMENDATIONS_SCHEMA_VERSION, build_recommendations_payload
+
+NEW_COMPETENCIES = [
+    {"competency": "Data Engineering", "level": "advanced", "confidence": 70, "reasoning": "Pipelines."},
+    {"competency": "ML Architecture", "level": "intermediate", "confidence": 90, "reasoning": "Model serving."}
+]
+
+
+def _record(employee_id, name="Ada"):
+    return {
+        "id": employee_id, "partitionKey": "people", "employee_id": employee_id, "employee_name": name,
+        "analysis_result": {"thought_process": "", "new_competencies": NEW_COMPETENCIES},
+        "recommendations_payload": build_recommendations_payload(employee_id, name, NEW_COMPETENCIES),
+        "recommendations_schema_version": RECOMMENDATIONS_SCHEMA_VERSION,
+        "approved": False, "notification_sent": True
+    }
+
+
+@pytest.fixture
+def container(monkeypatch):
+    container = InMemoryContainer()
+    monkeypatch.setattr(app, "cosmos_manager", AsyncCosmosDBManager.from_container(AsyncInMemoryContainer(container)))
+    app.recommendations_cache.clear()
+    return container
+
+
+@pytest.fixture
+def client(container):
+    with TestClient(app.app) as client:
+        yield client
+
+
+def test_stored_payload_is_served_as_is_with_its_etag(container, client):
+    container.upsert_item(_record("1"))
+    response = client.get("/api/recommendations/1")
+
+    assert response.status_code == 200
+    assert response.content == container.read_item("1", "people")["recommendations_payload"].encode()
+    assert [item["name"] for item in response.json()["recommendations"]] == ["ML Architecture", "Data Engineering"]
+    etag = response.headers["etag"]
+    assert client.get("/api/recommendations/1", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_bulk_and_page_responses_are_assembled_from_stored_bytes(container, client):
+    for employee_id in ("1", "2", "3"):
+        container.upsert_item(_record(employee_id))
+
+    bulk = client.get("/api/recommendations", params={"ids": "3,missing,1"}).json()
+    assert [item["employee_id"] for item in bulk["items"]] == ["3", "1"]
+    assert bulk["missing"] == ["missing"]
+
+    page = client.get("/api/recommendations/page", params={"page_size": 2}).json()
+    assert len(page["items"]) == 2 and isinstance(page["continuation_token"], str)
+    last = client.get("/api/recommendations/page",
+                      params={"page_size": 2, "continuation_token": page["continuation_token"]}).json()
+    assert len(last["items"]) == 1 and last["continuation_token"] is None
+
+
+def test_decisions_response_follows_its_model(container, client):
+    container.upsert_item(_record("1"))
+    response = client.post("/api/recommendations/1/decisions",
+                           json={"decisions": [{"competency": "data engineering", "decision": "approve"}]})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == {"employee_id", "decisions", "approved", "etag"}
+    assert body["decisions"]["Data Engineering"]["decision"] == "approve"
+    assert body["approved"] is False and body["etag"] == container.read_item("1", "people")["_etag"]
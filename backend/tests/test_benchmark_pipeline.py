@@ -0,0 +1,35 @@
+import benchmark_pipeline
+from benchmark_pipeline import SCENARIOS, run_benchmark
+
+OPTIONS = {
+    "employees": 12, "concurrency": 4, "batch_size": 3, "chunk_size": 20, "bulk_size": 5, "llm_latency_ms": 1.0,
+    "llm_latency_sigma": 0.0, "tpm_limit": 100_000_000, "email": True, "email_latency_ms": 1.0,
+    "journal": "file", "snapshot": False, "seed": 42
+}
+
+
+def test_every_scenario_completes_and_reports_its_stages():
+    results = run_benchmark(SCENARIOS, OPTIONS)
+
+    assert set(results) == set(SCENARIOS)
+    for name in ("agent", "agent_stream", "agent_batched"):
+        result = results[name]
+        assert result["employees"] > 0 and result["failed"] == 0, name
+        assert result["emails"] == result["employees"], name
+        assert {"employee", "cosmos_upsert", "notify"} <= set(result["stages"]), name
+        assert result["stages"]["employee"]["count"] == result["employees"], name
+    assert results["agent"]["llm_calls"] == results["agent"]["employees"]
+    assert results["agent_batched"]["llm_calls"] < results["agent_batched"]["employees"]
+    assert "analyze_batch" in results["agent_batched"]["stages"]
+
+    api = results["api"]
+    assert api["employees"] == OPTIONS["employees"]
+    assert set(api["stages"]) == {"get_one_cold", "get_one_cached", "get_many_cold", "list_pages"}
+    assert all(stage["count"] > 0 for stage in api["stages"].values())
+
+
+def test_peak_rss_is_unavailable_without_the_resource_module(monkeypatch):
+    monkeypatch.setattr(benchmark_pipeline.os, "name", "nt")
+    assert benchmark_pipeline._peak_rss_mb() is None
+    monkeypatch.undo()
+    assert benchmark_pipeline._peak_rss_mb() > 0
@@ -0,0 +1,42 @@
+from competency_rules import derive_direct_competencies, missing_pse_columns
+
+APPROVED = ["Azure", "Kubernetes", "Data Engineering"]
+
+
+def test_requirement_columns_give_direct_matches():
+    project = {"project_name": "Lake", "required_cloud_skills": "Azure, Kubernetes"}
+    result = derive_direct_competencies({"competencies": {}}, [project], APPROVED)
+
+    assert [r["competency"] for r in result["recommendations"]] == ["Azure", "Kubernetes"]
+    assert result["candidate_competencies"] == ["Data Engineering"]
+    assert result["unmapped_evidence"]["project_details"] == ["Lake: project_name"]
+    assert result["needs_llm"]
+
+
+def test_free_text_projects_are_left_to_the_llm():
+    # The shape of data/employee_data.json projects: no requirement columns
+    project = {"name": "Data Platform Migration", "role": "Solution Architect", "duration": "2023-2024",
+               "description": "Moved the data platform to Azure with Databricks and Kubernetes"}
+    result = derive_direct_competencies({"competencies": {}}, [project], APPROVED)
+
+    assert result["recommendations"] == []
+    assert result["needs_llm"]
+    assert result["unmapped_evidence"]["project_details"] == [
+        "Data Platform Migration: name", "Data Platform Migration: role", "Data Platform Migration: description"]
+
+
+def test_ids_and_dates_are_not_evidence():
+    project = {"employee_id": "1", "project_id": "P1", "start_date": "2024-01-01", "hours": "120", "role": float("nan")}
+    result = derive_direct_competencies({"competencies": {}, "certifications": [], "cloud_skills": []}, [project], APPROVED)
+
+    assert not result["needs_llm"]
+
+
+def test_missing_pse_columns():
+    assert missing_pse_columns(["employee_id", "name", "role", "duration", "description"]) == {
+        "required_competencies": ["required_competencies"],
+        "required_certifications": ["required_certifications"],
+        "required_cloud_skills": ["required_cloud_skills"]
+    }
+    assert missing_pse_columns(["required_competencies", "required_certifications", "required_cloud_skills",
+                                "project_id"]) == {}
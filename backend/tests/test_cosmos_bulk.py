@@ -0,0 +1,84 @@
+from cosmos_db import CosmosDBManager
+from cosmos_telemetry import LEDGER
+from cosmos_db_memory import InMemoryContainer
+
+
+def _manager(**container_options):
+    container = InMemoryContainer(**container_options)
+    return CosmosDBManager.from_container(container), container
+
+
+def _items(count, partition_keys=("a", "b")):
+    return [{"id": str(i), "partitionKey": partition_keys[i % len(partition_keys)], "value": i} for i in range(count)]
+
+
+def test_upserts_are_grouped_into_batches_per_partition_key():
+    manager, container = _manager()
+    result = manager.bulk_upsert_items(_items(250), max_concurrency=4)
+
+    assert result["succeeded"] == 250 and result["failed"] == 0
+    # 125 items per partition key, in batches of at most 100 operations
+    assert container.operation_counts == {"upsert": 4}
+    assert len(container.items()) == 250
+    assert result["request_charge"] == 250 * 10.0
+
+
+def test_single_item_groups_are_written_directly():
+    manager, container = _manager()
+    result = manager.bulk_upsert_items(_items(3, partition_keys=("a", "b", "c")))
+
+    assert result["succeeded"] == 3
+    assert container.operation_counts == {"upsert": 3}
+
+
+def test_throttled_batches_and_items_are_retried():
+    manager, container = _manager(throttle_rate=0.5, seed=3)
+    # 30 batches of 3 items; half of the calls are throttled
+    partition_keys = tuple(f"p{n}" for n in range(30))
+    result = manager.bulk_upsert_items(_items(90, partition_keys), max_retries=30)
+
+    assert result["succeeded"] == 90 and result["failed"] == 0
+    assert len(container.items()) == 90
+
+
+def test_each_throttled_attempt_counts_one_retry(monkeypatch):
+    manager, container = _manager(throttle_rate=0.5, seed=5)
+    throttles = []
+    maybe_throttle = container._maybe_throttle
+
+    def counting_throttle():
+        try:
+            maybe_throttle()
+        except Exception:
+            throttles.append(1)
+            raise
+
+    monkeypatch.setattr(container, "_maybe_throttle", counting_throttle)
+    LEDGER.reset()
+    result = manager.bulk_upsert_items(_items(40, partition_keys=tuple(f"p{n}" for n in range(40))), max_retries=30)
+
+    assert result["succeeded"] == 40
+    assert len(throttles) > 1
+    assert LEDGER.total("retries") == len(throttles)
+
+
+def test_retries_give_up_after_max_retries():
+    manager, _ = _manager(throttle_rate=1.0, seed=1)
+    result = manager.bulk_upsert_items(_items(2, partition_keys=("a", "b")), max_retries=1)
+
+    assert result["failed"] == 2
+    assert {outcome["status_code"] for outcome in result["results"]} == {429}
+
+
+def test_failed_batch_falls_back_to_per_item_outcomes():
+    manager, container = _manager()
+    manager.bulk_upsert_items(_items(4, partition_keys=("a",)))
+    patches = [{"id": str(i), "partitionKey": "a", "operations": [{"op": "set", "path": "/sent", "value": True}]}
+               for i in range(5)]
+    result = manager.bulk_patch_items(patches)
+
+    outcomes = {outcome["id"]: outcome for outcome in result["results"]}
+    assert result["succeeded"] == 4 and result["failed"] == 1
+    assert outcomes["4"]["status_code"] == 404 and not outcomes["4"]["success"]
+    assert all(outcomes[str(i)]["success"] and outcomes[str(i)]["request_charge"] == 10.0 for i in range(4))
+    assert all(item["sent"] for item in container.items())
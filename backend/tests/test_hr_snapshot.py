@@ -0,0 +1,135 @@
+import io
+import os
+import math
+import contextlib
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import agent_v2
+import hr_snapshot
+from hr_snapshot import HRSnapshot
+from synthetic_hr_data import generate_dataset
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return generate_dataset(str(tmp_path / "data"), 40, 300, seed=5)
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def _sources(paths):
+    return {"employees": paths["workday"], "pse": paths["pse"], "approved_values": paths["approved"]}
+
+
+def _parser(paths, calls):
+    def parse():
+        calls.append(1)
+        return (agent_v2._load_employees_csv(paths["workday"]), agent_v2._load_pse_data_csv(paths["pse"]),
+                agent_v2._load_approved_values_csv(paths["approved"]))
+    return parse
+
+
+def _plain(value):
+    """NaN (an empty CSV cell) compared as None."""
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+
+def test_snapshot_matches_the_csv_loaders(paths, tmp_path):
+    snapshot = HRSnapshot.load(_sources(paths), _parser(paths, []), str(tmp_path / "snapshots"))
+
+    employees = agent_v2._load_employees_csv(paths["workday"])
+    pse_data = agent_v2._load_pse_data_csv(paths["pse"])
+    assert snapshot.rebuilt
+    assert _plain(list(snapshot.employees())) == _plain(employees)
+    assert set(snapshot.projects()) == set(pse_data)
+    assert all(_plain(snapshot.projects()[employee_id]) == _plain(projects) for employee_id, projects in pse_data.items())
+    assert snapshot.approved_values() == agent_v2._load_approved_values_csv(paths["approved"])
+
+
+def test_snapshot_is_reused_until_a_source_changes(paths, tmp_path, monkeypatch):
+    sources, calls, snapshot_dir = _sources(paths), [], str(tmp_path / "snapshots")
+    built = HRSnapshot.load(sources, _parser(paths, calls), snapshot_dir)
+
+    hashed = []
+    checksum = hr_snapshot.file_checksum
+    monkeypatch.setattr(hr_snapshot, "file_checksum", lambda path: hashed.append(path) or checksum(path))
+
+    reopened = HRSnapshot.load(sources, _parser(paths, calls), snapshot_dir)
+    assert not reopened.rebuilt and reopened.snapshot_id == built.snapshot_id
+    assert len(calls) == 1 and hashed == []
+
+    # A touched but unchanged file is hashed once, then its new mtime is recorded
+    stat = os.stat(paths["pse"])
+    os.utime(paths["pse"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    touched = HRSnapshot.load(sources, _parser(paths, calls), snapshot_dir)
+    assert not touched.rebuilt and len(calls) == 1
+    assert hashed == [paths["pse"]]
+    HRSnapshot.load(sources, _parser(paths, calls), snapshot_dir)
+    assert hashed == [paths["pse"]]
+
+    # A changed file rebuilds the snapshot under new file names and removes the old files
+    with open(paths["workday"], encoding="utf-8") as f:
+        lines = f.readlines()
+    with open(paths["workday"], "w", encoding="utf-8") as f:
+        f.writelines(lines[:-1])
+    rebuilt = HRSnapshot.load(sources, _parser(paths, calls), snapshot_dir)
+    assert rebuilt.rebuilt and rebuilt.snapshot_id != built.snapshot_id and len(calls) == 2
+    assert len(rebuilt.employees()) == len(built.employees()) - 1
+    assert sorted(name for name in os.listdir(rebuilt.directory) if name.endswith(".arrow")) == \
+        sorted(rebuilt.manifest["files"].values())
+
+    assert HRSnapshot.load(sources, _parser(paths, calls), snapshot_dir, rebuild=True).rebuilt
+
+
+def test_project_lookups_across_record_batches(paths, tmp_path, monkeypatch):
+    # Batches of 7 rows: most employees' rows straddle a batch boundary, some span several batches
+    monkeypatch.setattr(hr_snapshot, "BATCH_ROWS", 7)
+    monkeypatch.setattr(hr_snapshot, "PSE_CACHED_BATCHES", 2)
+    snapshot = HRSnapshot.load(_sources(paths), _parser(paths, []), str(tmp_path / "snapshots"))
+    projects = snapshot.projects()
+    pse_data = agent_v2._load_pse_data_csv(paths["pse"])
+
+    assert len(projects._batches) > 10
+    assert any(length > 7 for _, length in projects._positions.values())
+    # Looked up in reverse so the small batch cache keeps evicting
+    for employee_id in reversed(list(pse_data)):
+        assert _plain(projects[employee_id]) == _plain(pse_data[employee_id])
+    assert len(projects._converted) <= 2
+    assert "missing" not in projects
+    with pytest.raises(KeyError):
+        projects["missing"]
+
+
+def test_employees_support_indexes_and_slices_like_a_list(paths, tmp_path, monkeypatch):
+    monkeypatch.setattr(hr_snapshot, "BATCH_ROWS", 7)
+    snapshot = HRSnapshot.load(_sources(paths), _parser(paths, []), str(tmp_path / "snapshots"))
+    employees = snapshot.employees()
+    expected = _plain(agent_v2._load_employees_csv(paths["workday"]))
+
+    assert _plain(employees[0]) == expected[0] and _plain(employees[-1]) == expected[-1]
+    for index in (slice(None, 3), slice(-2, None), slice(5, 20), slice(3, None, 4), slice(None, None, -9), slice(20, 5)):
+        assert _plain(employees[index]) == expected[index]
+    with pytest.raises(IndexError):
+        employees[len(expected)]
+    with pytest.raises(TypeError):
+        employees["0"]
+
+
+def test_agent_loads_its_inputs_from_the_snapshot(paths, tmp_path):
+    snapshot_dir = str(tmp_path / "snapshots")
+    first = agent_v2.load_hr_inputs(paths["workday"], paths["pse"], paths["approved"], snapshot_dir)
+    second = agent_v2.load_hr_inputs(paths["workday"], paths["pse"], paths["approved"], snapshot_dir)
+
+    assert first[3].rebuilt and not second[3].rebuilt
+    assert _plain(list(second[0])) == _plain(agent_v2._load_employees_csv(paths["workday"]))
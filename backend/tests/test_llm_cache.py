@@ -0,0 +1,96 @@
+import sqlite3
+import threading
+from itertools import count
+
+import pytest
+from pydantic import BaseModel
+
+import llm_cache
+from llm_cache import LLMResponseCache
+
+
+class Answer(BaseModel):
+    text: str
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    # Distinct, increasing access times so the LRU order is deterministic
+    ticks = count(1)
+    monkeypatch.setattr(llm_cache.time, "time", lambda: float(next(ticks)))
+
+
+def _keys(path):
+    with sqlite3.connect(path) as connection:
+        return {row[0] for row in connection.execute("SELECT key FROM entries")}
+
+
+def _totals(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT total_bytes, total_entries FROM meta").fetchone()
+
+
+def test_entries_over_max_entries_are_evicted_least_recently_used_first(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = LLMResponseCache(path, max_bytes=10**9, max_entries=3, enabled=True)
+    for key in "abc":
+        cache.put_model(key, Answer(text=key))
+    # Reading "a" makes "b" the least recently used
+    assert cache.get_model("a", Answer) == Answer(text="a")
+
+    cache.put_model("d", Answer(text="d"))
+    assert _keys(path) == {"a", "c", "d"}
+    cache.put_model("e", Answer(text="e"))
+    assert _keys(path) == {"a", "d", "e"}
+    assert cache.stats()["evictions"] == 2
+    assert _totals(path)[1] == 3
+
+
+def test_entries_over_max_bytes_are_evicted_least_recently_used_first(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    size = len(Answer(text="x" * 100).model_dump_json())
+    cache = LLMResponseCache(path, max_bytes=size * 4, enabled=True)
+    for key in "abcd":
+        cache.put_model(key, Answer(text=key * 100))
+    cache.get_model("a", Answer)
+    cache.get_model("b", Answer)
+
+    cache.put_model("e", Answer(text="e" * 100))
+    assert _keys(path) == {"a", "b", "d", "e"}
+    # Replacing an entry with a larger value frees room by evicting the oldest others
+    cache.put_model("d", Answer(text="d" * 150))
+    assert _keys(path) == {"b", "d", "e"}
+    assert _totals(path) == (size * 2 + len(Answer(text="d" * 150).model_dump_json()), 3)
+
+
+def test_totals_stay_exact_with_concurrent_writers(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = LLMResponseCache(path, max_bytes=10**9, max_entries=50, enabled=True)
+
+    def write(worker):
+        for index in range(40):
+            cache.put_model(f"{worker}-{index % 30}", Answer(text=str(index)))
+
+    threads = [threading.Thread(target=write, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with sqlite3.connect(path) as connection:
+        actual = connection.execute("SELECT SUM(size), COUNT(*) FROM entries").fetchone()
+    assert _totals(path) == actual
+    assert actual[1] == 50
+    assert cache.stats()["errors"] == 0
+
+
+def test_totals_are_counted_for_a_cache_written_before_they_were_kept(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    LLMResponseCache(path, enabled=True).put_model("a", Answer(text="a"))
+    with sqlite3.connect(path) as connection:
+        connection.execute("DROP TABLE meta")
+
+    cache = LLMResponseCache(path, max_entries=1, enabled=True)
+    cache.put_model("b", Answer(text="b"))
+    assert _keys(path) == {"b"}
+    assert _totals(path)[1] == 1
@@ -0,0 +1,18 @@
+import llm_scheduler
+from llm_scheduler import LLMRequestScheduler
+
+
+def test_utilization_window_only_keeps_the_last_minute(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_scheduler.time, "monotonic", lambda: now[0])
+    scheduler = LLMRequestScheduler(tokens_per_minute=10_000_000, requests_per_minute=100_000)
+
+    for _ in range(300):
+        scheduler.run(lambda: "ok", estimated_tokens=10)
+        now[0] += 1.0
+
+    # Pruned as requests are admitted, without waiting for stats()
+    assert len(scheduler._window) <= 61
+    stats = scheduler.stats()
+    assert stats["requests"] == 300
+    assert stats["requests_last_minute"] == 60 and stats["tokens_last_minute"] == 600
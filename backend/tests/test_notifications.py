@@ -0,0 +1,170 @@
+import io
+import time
+import threading
+import contextlib
+
+import pytest
+
+from agent_v2 import CompetencyAnalysis
+from cosmos_db import CosmosDBManager
+from cosmos_db_memory import InMemoryContainer
+from notifications import FakeEmailClient, NotificationDispatcher
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def _analysis():
+    structured_data = CompetencyAnalysis.model_validate({
+        "thought_process": "Led several data platform projects.",
+        "new_competencies": [{"competency": "Data Engineering", "level": "advanced", "confidence": 90,
+                              "reasoning": "Built the <ingestion> pipelines."}]
+    })
+    return {"structured_data": structured_data, "text": "Data Engineering (advanced)"}
+
+
+def _employees(container, count):
+    employees = []
+    for index in range(count):
+        employee = {"employee_id": str(index), "name": f"Employee {index}", "email": f"e{index}@example.com"}
+        container.upsert_item({"id": employee["employee_id"], "partitionKey": "people", "notification_sent": False})
+        employees.append(employee)
+    return employees
+
+
+def _dispatcher(container, email_client, **options):
+    options = {"poll_interval": 0.01, "status_flush_seconds": 60, **options}
+    return NotificationDispatcher(email_client, CosmosDBManager.from_container(container), "hr@example.com", **options)
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_on_done_runs_after_the_status_is_written():
+    container = InMemoryContainer()
+    email_client = FakeEmailClient()
+    callbacks = []
+    lock = threading.Lock()
+
+    def on_done_for(employee_id):
+        def on_done(sent):
+            # The journal records "notified" from here, so the status must already be in Cosmos DB
+            item = container.read_item(employee_id, "people")
+            with lock:
+                callbacks.append((employee_id, sent, item["notification_sent"]))
+        return on_done
+
+    with _dispatcher(container, email_client, status_batch_size=4) as dispatcher:
+        for employee in _employees(container, 10):
+            dispatcher.submit(employee, _analysis(), on_done_for(employee["employee_id"]))
+        assert dispatcher.drain(timeout=5)
+
+    assert sorted(callbacks) == sorted((str(index), True, True) for index in range(10))
+    assert email_client.sent == 10
+    assert "&lt;ingestion&gt;" in email_client.messages[0]["content"]["html"]
+    stats = dispatcher.stats()
+    assert stats["sent"] == stats["status_written"] == 10 and stats["pending"] == 0
+
+
+def test_statuses_are_written_in_batches_of_status_batch_size():
+    container = InMemoryContainer()
+    dispatcher = _dispatcher(container, FakeEmailClient(), status_batch_size=5)
+    try:
+        for employee in _employees(container, 10):
+            dispatcher.submit(employee, _analysis())
+        # Two full batches go out without waiting for status_flush_seconds or drain()
+        assert _wait_for(lambda: dispatcher.stats()["status_written"] == 10)
+        assert dispatcher.stats()["status_batches"] == 2
+    finally:
+        dispatcher.close()
+
+
+def test_a_partial_batch_is_written_after_status_flush_seconds():
+    container = InMemoryContainer()
+    dispatcher = _dispatcher(container, FakeEmailClient(), status_batch_size=50, status_flush_seconds=0.3)
+    try:
+        started = time.monotonic()
+        for employee in _employees(container, 3):
+            dispatcher.submit(employee, _analysis())
+        assert _wait_for(lambda: dispatcher.stats()["sent"] == 3)
+        assert dispatcher.stats()["status_written"] == 0
+
+        assert _wait_for(lambda: dispatcher.stats()["status_written"] == 3)
+        assert time.monotonic() - started >= 0.3
+        assert dispatcher.stats()["status_batches"] == 1
+    finally:
+        dispatcher.close()
+
+
+def test_sends_still_running_after_send_timeout_fail():
+    container = InMemoryContainer()
+    results = []
+    dispatcher = _dispatcher(container, FakeEmailClient(latency_ms=60000), send_timeout=0.1)
+    for employee in _employees(container, 3):
+        dispatcher.submit(employee, _analysis(), results.append)
+    assert dispatcher.drain(timeout=5)
+    dispatcher.close()
+
+    assert results == [False, False, False]
+    stats = dispatcher.stats()
+    assert stats["failed"] == stats["timed_out"] == 3 and stats["sent"] == 0 and stats["status_batches"] == 0
+    assert not any(item["notification_sent"] for item in container.items())
+
+
+def test_failed_sends_are_counted_and_not_recorded_as_sent():
+    container = InMemoryContainer()
+    email_client = FakeEmailClient(failure_rate=0.5, seed=4)
+    results = {}
+    with _dispatcher(container, email_client, status_batch_size=3) as dispatcher:
+        for employee in _employees(container, 20):
+            employee_id = employee["employee_id"]
+            dispatcher.submit(employee, _analysis(), lambda sent, employee_id=employee_id: results.update({employee_id: sent}))
+        assert dispatcher.drain(timeout=5)
+
+    stats = dispatcher.stats()
+    failed = [employee_id for employee_id, sent in results.items() if not sent]
+    assert 0 < len(failed) < 20
+    assert stats["failed"] == len(failed) and stats["timed_out"] == 0
+    assert stats["sent"] == stats["status_written"] == 20 - len(failed)
+    sent_items = {item["id"] for item in container.items() if item["notification_sent"]}
+    assert sent_items == {employee_id for employee_id, sent in results.items() if sent}
+
+
+def test_without_an_email_client_only_the_status_is_recorded():
+    container = InMemoryContainer()
+    results = []
+    with _dispatcher(container, None) as dispatcher:
+        for employee in _employees(container, 2):
+            dispatcher.submit(employee, _analysis(), results.append)
+
+    assert results == [True, True]
+    assert dispatcher.stats()["status_written"] == 2
+    assert all(item["notification_sent"] for item in container.items())
+
+
+def test_dispatcher_spans_nest_under_the_run_span(monkeypatch):
+    from tracing import TRACER
+
+    finished = []
+    record = TRACER._finish
+    monkeypatch.setattr(TRACER, "_finish", lambda span: (finished.append(span), record(span)))
+    container = InMemoryContainer()
+
+    TRACER.start_run("notifications")
+    with _dispatcher(container, FakeEmailClient(), status_batch_size=2) as dispatcher:
+        for employee in _employees(container, 4):
+            dispatcher.submit(employee, _analysis())
+        assert dispatcher.drain(timeout=5)
+    TRACER.finish_run(employees=4)
+
+    run = next(span for span in finished if span.name == "run")
+    spans = [span for span in finished if span.name in ("email_send", "notification_status")]
+    assert {span.name for span in spans} == {"email_send", "notification_status"}
+    assert all(span.parent_id == run.span_id for span in spans)
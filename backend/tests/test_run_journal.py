@@ -0,0 +1,181 @@
+import json
+import contextlib
+import io
+
+import pytest
+
+import run_journal
+from cosmos_db import CosmosDBManager
+from cosmos_db_memory import InMemoryContainer
+from run_journal import CosmosJournalStore, FileJournalStore, RunJournal
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingStore:
+    """Store whose first `failures` writes raise."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.writes = []
+
+    def load(self):
+        return iter(())
+
+    def write(self, records):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("store unavailable")
+        self.writes.append(list(records))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(run_journal.time, "monotonic", clock)
+    return clock
+
+
+def _lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_buffer_is_flushed_after_flush_every_records(tmp_path, clock):
+    path = tmp_path / "run.jsonl"
+    journal = RunJournal("r1", FileJournalStore(str(path), fsync=False), flush_every=3, flush_interval=60)
+
+    journal.record("1", "analyzed")
+    journal.record("1", "stored")
+    assert not path.exists()
+
+    journal.record("2", "analyzed")
+    assert [(line["employee_id"], line["stage"]) for line in _lines(path)] == [("1", "analyzed"), ("1", "stored"), ("2", "analyzed")]
+    assert journal.stats()["flushes"] == 1
+
+
+def test_buffer_is_flushed_after_flush_interval(tmp_path, clock):
+    path = tmp_path / "run.jsonl"
+    journal = RunJournal("r1", FileJournalStore(str(path), fsync=False), flush_every=100, flush_interval=2)
+
+    journal.record("1", "analyzed")
+    clock.now += 1
+    journal.record("2", "analyzed")
+    assert not path.exists()
+
+    clock.now += 1
+    journal.record("3", "analyzed")
+    assert len(_lines(path)) == 3
+
+
+def test_failed_flush_is_retried_on_the_interval(clock, capsys):
+    store = FailingStore(failures=1)
+    journal = RunJournal("r1", store, flush_every=2, flush_interval=5)
+
+    journal.record("1", "analyzed")
+    journal.record("2", "analyzed")
+    assert store.writes == [] and journal.stats()["flush_errors"] == 1
+    assert "2 records kept for retry" in capsys.readouterr().out
+
+    # While failing, a full buffer does not trigger a write on every record
+    journal.record("3", "analyzed")
+    journal.record("4", "analyzed")
+    assert store.writes == []
+
+    clock.now += 5
+    journal.record("5", "analyzed")
+    assert [[record["employee_id"] for record in records] for records in store.writes] == [["1", "2", "3", "4", "5"]]
+    stats = journal.stats()
+    assert stats["flushes"] == 1 and stats["buffered"] == 0 and stats["dropped"] == 0
+
+
+def test_retry_buffer_keeps_the_newest_records(clock):
+    store = FailingStore(failures=10)
+    journal = RunJournal("r1", store, flush_every=1, flush_interval=1, max_buffered=3)
+
+    for employee_id in range(6):
+        clock.now += 1
+        journal.record(str(employee_id), "stored")
+
+    stats = journal.stats()
+    assert stats["buffered"] == 3 and stats["dropped"] == 3
+    store.failures = 0
+    journal.close()
+    assert [record["employee_id"] for record in store.writes[0]] == ["3", "4", "5"]
+
+
+def test_cosmos_journal_writes_delta_documents_and_replays_them(clock):
+    container = InMemoryContainer()
+    manager = CosmosDBManager.from_container(container)
+    with contextlib.redirect_stdout(io.StringIO()):
+        journal = RunJournal.open("r1", "cosmos", cosmos_db_manager=manager, final_stage="stored", flush_every=50)
+        for employee_id in range(120):
+            journal.record(str(employee_id), "analyzed", {"structured_data": {"n": employee_id}})
+            if employee_id % 2 == 0:
+                journal.record(str(employee_id), "stored")
+        journal.close()
+
+        deltas = [item for item in container.items() if item.get("type") == "run_journal_delta"]
+        assert all(len(delta["records"]) <= run_journal.DELTA_DOCUMENT_RECORDS for delta in deltas)
+        assert sorted(delta["seq"] for delta in deltas) == list(range(len(deltas)))
+
+        resumed = RunJournal.open("r1", "cosmos", cosmos_db_manager=manager, resume=True, final_stage="stored")
+        resumed.record("1", "stored")
+        resumed.close()
+
+    stats = resumed.stats()
+    assert stats["employees"] == 120 and stats["complete"] == 61 and stats["pending"] == 59
+    assert resumed.pending_analysis("3") == {"structured_data": {"n": 3}}
+    # The resumed attempt appends to the sequence instead of overwriting the first delta
+    seqs = sorted(item["seq"] for item in container.items() if item.get("type") == "run_journal_delta")
+    assert seqs == list(range(len(deltas) + 1))
+
+
+def test_resume_skips_completed_employees_and_stores_pending_analyses(tmp_path, monkeypatch):
+    import agent_v2
+    from benchmark_pipeline import FakeLLM
+    from synthetic_hr_data import generate_dataset
+
+    paths = generate_dataset(str(tmp_path), 20, 100, seed=3)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(agent_v2, "ENABLE_EMAIL_NOTIFICATIONS", False)
+
+    def run(container, **options):
+        monkeypatch.setattr(agent_v2, "llm", FakeLLM(latency_ms=0))
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = agent_v2.main(employees_csv=paths["workday"], pse_csv=paths["pse"], approved_values_csv=paths["approved"],
+                                   force=True, max_employees=1000, report_dir=str(tmp_path), snapshot_dir=None,
+                                   journal_backend="file", cosmos_db_manager=CosmosDBManager.from_container(container),
+                                   **options)
+        return report["summary"], agent_v2.llm.calls
+
+    summary, llm_calls = run(InMemoryContainer(), run_id="r1")
+    assert summary["processed"] == llm_calls >= 3
+
+    # Simulate a crash: the first employee finished, the second was only analyzed, the rest never started
+    path = tmp_path / "run_journals" / "run_r1.journal.jsonl"
+    records = [record for record in _lines(path) if "stage" in record]
+    employee_ids = list(dict.fromkeys(record["employee_id"] for record in records))
+    done, analyzed = employee_ids[0], employee_ids[1]
+    kept = [record for record in records
+            if record["employee_id"] == done or (record["employee_id"] == analyzed and record["stage"] == "analyzed")]
+    path.write_text("".join(json.dumps(record) + "\n" for record in kept), encoding="utf-8")
+
+    container = InMemoryContainer()
+    resumed_summary, resumed_llm_calls = run(container, resume_run_id="r1")
+
+    assert resumed_summary["resumed"] == 1
+    assert resumed_summary["processed"] == summary["processed"] - 1
+    # Only the employees that were never analyzed go back to the LLM
+    assert resumed_llm_calls == summary["processed"] - 2
+    stored = {item["id"]: item for item in container.items()}
+    assert done not in stored
+    journaled = next(record["analysis"] for record in kept if record["employee_id"] == analyzed)
+    assert stored[analyzed]["analysis_result"] == journaled["structured_data"]
+    assert RunJournal.open("r1", resume=True, final_stage="stored").stats()["complete"] == summary["processed"]
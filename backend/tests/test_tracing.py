@@ -0,0 +1,44 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import Tracer, current_span
+
+
+def test_employee_spans_in_worker_threads_nest_under_the_run_span():
+    tracer = Tracer()
+    finished = []
+    record = tracer._finish
+    tracer._finish = lambda span: (finished.append(span), record(span))
+
+    tracer.start_run("run-1")
+
+    def analyze(employee_id):
+        with tracer.span("employee", employee_id=employee_id):
+            with tracer.span("llm"):
+                pass
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for employee_id in ("1", "2"):
+            executor.submit(contextvars.copy_context().run, analyze, employee_id).result()
+    report = tracer.finish_run(employees=2)
+
+    spans = {span.span_id: span for span in finished}
+    run = next(span for span in finished if span.name == "run")
+    assert run.parent_id is None and run.attributes["run_id"] == "run-1"
+    assert all(spans[span.parent_id].name == "run" for span in finished if span.name == "employee")
+    assert all(spans[span.parent_id].name == "employee" for span in finished if span.name == "llm")
+    assert report["stages"]["run"]["count"] == 1
+    # The run span is closed again in the calling context
+    assert current_span().__class__.__name__ == "_NoopSpan"
+
+
+def test_a_new_run_drops_the_span_of_an_unfinished_one():
+    tracer = Tracer()
+    tracer.start_run("abandoned")
+    tracer.start_run("run-2")
+    with tracer.span("employee") as employee:
+        pass
+    report = tracer.finish_run(employees=1)
+
+    assert employee.parent_id is not None
+    assert report["stages"]["run"]["count"] == 1
@@ -0,0 +1,104 @@
+import time
+import threading
+
+import pytest
+
+from work_leases import FileLeaseStore, LeaseKeeper, SQLiteLeaseStore, acquire_next, claim_shards, rollup
+
+
+@pytest.fixture(params=["sqlite", "file"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteLeaseStore(str(tmp_path / "leases.sqlite3"))
+    return FileLeaseStore(str(tmp_path / "leases"))
+
+
+def test_a_leased_shard_cannot_be_acquired_by_another_owner(store):
+    lease = store.acquire("r1", 0, 2, "worker-a", ttl=60)
+
+    assert lease is not None and lease.attempt == 1
+    assert store.acquire("r1", 0, 2, "worker-b", ttl=60) is None
+    assert store.shard_states("r1")[0]["owner"] == "worker-a"
+
+
+def test_contending_workers_lease_each_shard_once(store):
+    num_shards = 8
+    leases = []
+    lock = threading.Lock()
+
+    def worker(owner):
+        while True:
+            lease = acquire_next(store, "r1", num_shards, owner, ttl=60)
+            if lease is None:
+                return
+            with lock:
+                leases.append(lease)
+
+    threads = [threading.Thread(target=worker, args=(f"worker-{n}",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(lease.shard for lease in leases) == list(range(num_shards))
+    states = store.shard_states("r1")
+    assert all(states[lease.shard]["token"] == lease.token for lease in leases)
+
+
+def test_an_expired_lease_is_reclaimed_and_the_old_owner_cannot_complete(store):
+    stale = store.acquire("r1", 0, 1, "worker-a", ttl=0.1)
+    time.sleep(0.15)
+
+    lease = store.acquire("r1", 0, 1, "worker-b", ttl=60)
+    assert lease is not None and lease.attempt == 2
+    assert store.renew(stale, ttl=60) is None
+    assert store.complete(stale, {"processed": 1}) is False
+    assert store.complete(lease, {"processed": 2}) is True
+    # A finished shard is never leased again
+    assert store.acquire("r1", 0, 1, "worker-c", ttl=60) is None
+
+
+def test_keeper_of_a_reclaimed_lease_does_not_complete_the_shard(store):
+    stale = store.acquire("r1", 0, 1, "worker-a", ttl=0.1)
+    time.sleep(0.15)
+    store.acquire("r1", 0, 1, "worker-b", ttl=60)
+
+    with LeaseKeeper(store, stale, ttl=0.06) as keeper:
+        deadline = time.monotonic() + 2
+        while not keeper.lost and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert keeper.lost
+        assert keeper.complete({"processed": 1}) is False
+    state = store.shard_states("r1")[0]
+    assert state["owner"] == "worker-b" and state["status"] == "leased"
+
+
+def test_keeper_renews_its_lease_until_the_shard_is_complete(store):
+    lease = store.acquire("r1", 0, 1, "worker-a", ttl=0.15)
+    with LeaseKeeper(store, lease, ttl=0.15) as keeper:
+        time.sleep(0.4)
+        assert store.acquire("r1", 0, 1, "worker-b", ttl=60) is None
+        assert keeper.complete({"processed": 3}) is True
+    assert store.shard_states("r1")[0]["status"] == "done"
+
+
+def test_rollup_adds_up_the_finished_shards(store):
+    num_shards = 3
+    claimed = []
+    for lease in claim_shards(store, "r1", num_shards, "worker-a", ttl=60):
+        claimed.append(lease.shard)
+        summary = {"processed": lease.shard + 1, "failed": 1, "worker": "worker-a"}
+        assert store.complete(lease, summary)
+
+    assert sorted(claimed) == list(range(num_shards))
+    assert rollup(store.shard_states("r1"), num_shards) == {
+        "processed": 6, "failed": 3, "shards_done": 3, "shards_pending": 0
+    }
+
+
+def test_rollup_reports_shards_still_leased(store):
+    done = store.acquire("r1", 0, 2, "worker-a", ttl=60)
+    store.complete(done, {"processed": 4})
+    store.acquire("r1", 1, 2, "worker-b", ttl=60)
+
+    assert rollup(store.shard_states("r1"), 2) == {"processed": 4, "shards_done": 1, "shards_pending": 1}
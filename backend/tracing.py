@@ -0,0 +1,327 @@
+"""
+### tracing.py ###
+
+Lightweight tracing for the batch agent: each stage of the per-employee pipeline (rules, prompt
+build, LLM call, Cosmos DB upsert, notification) runs inside a span that records its duration,
+attributes such as prompt/completion tokens, and its outcome. Spans nest through a contextvar,
+so stages appear under their employee's span, and employees under the run's span: `start_run()`
+opens a `run` span in the calling context (worker threads started with `contextvars.copy_context()`
+inherit it) and `finish_run()` closes it.
+
+At the end of a run `Tracer.report()` summarizes p50/p95/p99 per stage, throughput and the
+slowest employees, and `write_report()` saves it as JSON. With an export path, finished spans
+are also streamed to a file in the OpenTelemetry OTLP/JSON format (one ExportTraceServiceRequest
+per line, as read by the OpenTelemetry Collector's otlpjsonfile receiver).
+
+Memory stays bounded for large runs: only durations (as float arrays) and the slowest employees
+are kept; exported spans are flushed to disk in batches.
+
+Usage:
+    TRACER.start_run(export_path="run_reports/spans.otlp.jsonl")
+    with TRACER.span("employee", employee_id="123") as span:
+        with TRACER.span("llm") as llm_span:
+            llm_span.set_attributes(prompt_tokens=812, completion_tokens=240)
+    report = TRACER.finish_run(employees=1)
+"""
+
+import os
+import json
+import time
+import heapq
+import uuid
+import threading
+import contextvars
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+# Number of slowest employees kept for the report
+SLOWEST_EMPLOYEES = 10
+# Spans buffered before they are written to the export file
+EXPORT_BATCH_SIZE = 1000
+
+SERVICE_NAME = "skills-agent"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status", "status_message")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes)
+        self.status = "ok"
+        self.status_message = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def set_error(self, message: str) -> None:
+        self.status = "error"
+        self.status_message = message
+
+    @property
+    def seconds(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class _NoopSpan:
+    """Returned by current_span() outside any span, so callers can set attributes unconditionally."""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, **attributes) -> None:
+        pass
+
+    def set_error(self, message: str) -> None:
+        pass
+
+
+def new_run_id() -> str:
+    """Sortable, unique id for a run, e.g. 20240501-142300-a1b2c3."""
+    return datetime.now().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+
+
+def current_span():
+    return _current_span.get() or _NoopSpan()
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class Tracer:
+    """Collects span durations for the run report and optionally exports spans as OTLP/JSON."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._run_span = None
+        self._run_token = None
+        self._reset()
+
+    # ---------------------------
+    # Run lifecycle
+    # ---------------------------
+    def start_run(self, run_id: Optional[str] = None, export_path: Optional[str] = None) -> str:
+        """Reset the collected data, start a new trace and open its `run` span; returns the run id."""
+        # A run that returned early without finish_run() leaves its span open: drop it
+        self._close_run_span(record=False)
+        self._reset(run_id, export_path)
+        self._run_span = Span("run", self.trace_id, None, {"run_id": self.run_id})
+        self._run_token = _current_span.set(self._run_span)
+        return self.run_id
+
+    def finish_run(self, employees: int) -> Dict[str, Any]:
+        """Close the run span, flush exported spans and return the run report."""
+        self._close_run_span(record=True)
+        self.flush()
+        return self.report(employees)
+
+    def _close_run_span(self, record: bool) -> None:
+        span, token = self._run_span, self._run_token
+        self._run_span = self._run_token = None
+        if span is None:
+            return
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Closed from another context than the one that opened it
+            pass
+        if record:
+            span.end_ns = time.time_ns()
+            self._finish(span)
+
+    def _reset(self, run_id: Optional[str] = None, export_path: Optional[str] = None) -> None:
+        with self._lock:
+            self.run_id = run_id or new_run_id()
+            self.trace_id = uuid.uuid4().hex
+            self.started_at = datetime.now(timezone.utc)
+            self._started = time.perf_counter()
+            self._durations: Dict[str, array] = {}
+            self._errors: Dict[str, int] = {}
+            self._tokens = {"prompt_tokens": 0, "completion_tokens": 0}
+            self._slowest: List[tuple] = []
+            self._export_path = export_path
+            self._export_buffer: List[Dict[str, Any]] = []
+            self._exported = 0
+            if export_path:
+                os.makedirs(os.path.dirname(os.path.abspath(export_path)), exist_ok=True)
+                open(export_path, "w").close()
+
+    # ---------------------------
+    # Spans
+    # ---------------------------
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Run the block inside a span; exceptions mark it as failed and propagate."""
+        parent = _current_span.get()
+        span = Span(name, self.trace_id, parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        seconds = span.seconds
+        with self._lock:
+            durations = self._durations.get(span.name)
+            if durations is None:
+                durations = self._durations[span.name] = array("d")
+            durations.append(seconds)
+            if span.status != "ok":
+                self._errors[span.name] = self._errors.get(span.name, 0) + 1
+            for key in self._tokens:
+                if isinstance(span.attributes.get(key), int):
+                    self._tokens[key] += span.attributes[key]
+
+            if span.name == "employee":
+                record = (seconds, span.span_id, {
+                    "employee_id": span.attributes.get("employee_id"),
+                    "seconds": round(seconds, 4),
+                    "outcome": span.attributes.get("outcome", span.status)
+                })
+                if len(self._slowest) < SLOWEST_EMPLOYEES:
+                    heapq.heappush(self._slowest, record)
+                else:
+                    heapq.heappushpop(self._slowest, record)
+
+            if self._export_path:
+                self._export_buffer.append(self._to_otlp(span))
+                flush = len(self._export_buffer) >= EXPORT_BATCH_SIZE
+            else:
+                flush = False
+        if flush:
+            self.flush()
+
+    # ---------------------------
+    # OTLP/JSON export
+    # ---------------------------
+    @staticmethod
+    def _to_otlp(span: Span) -> Dict[str, Any]:
+        otlp = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items() if value is not None],
+            "status": {"code": 1} if span.status == "ok" else {"code": 2, "message": span.status_message or ""}
+        }
+        if span.parent_id:
+            otlp["parentSpanId"] = span.parent_id
+        return otlp
+
+    def flush(self) -> None:
+        """Append buffered spans to the export file as one ExportTraceServiceRequest line."""
+        with self._lock:
+            spans, self._export_buffer = self._export_buffer, []
+            path = self._export_path
+            self._exported += len(spans)
+        if not spans or not path:
+            return
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+                    {"key": "run.id", "value": {"stringValue": self.run_id}}
+                ]},
+                "scopeSpans": [{"scope": {"name": "skills-agent.tracing"}, "spans": spans}]
+            }]
+        }
+        with self._lock:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(request, separators=(",", ":")) + "\n")
+
+    # ---------------------------
+    # Report
+    # ---------------------------
+    def report(self, employees: int) -> Dict[str, Any]:
+        """p50/p95/p99 per stage, throughput and the slowest employees."""
+        elapsed = time.perf_counter() - self._started
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self._durations.items()}
+            errors = dict(self._errors)
+            tokens = dict(self._tokens)
+            slowest = sorted(self._slowest, reverse=True)
+            exported = self._exported
+
+        stages = {}
+        for name, values in durations.items():
+            stages[name] = {
+                "count": len(values),
+                "errors": errors.get(name, 0),
+                "total_seconds": round(sum(values), 4),
+                "p50_seconds": round(_percentile(values, 0.50), 4),
+                "p95_seconds": round(_percentile(values, 0.95), 4),
+                "p99_seconds": round(_percentile(values, 0.99), 4),
+                "max_seconds": round(values[-1], 4)
+            }
+        return {
+            "run_id": self.run_id,
+            "trace_id": self.trace_id,
+            "started_at": self.started_at.isoformat(),
+            "duration_seconds": round(elapsed, 3),
+            "employees": employees,
+            "employees_per_minute": round(employees / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            "tokens": tokens,
+            "stages": stages,
+            "slowest_employees": [record for _, _, record in slowest],
+            "exported_spans": exported,
+            "export_path": self._export_path
+        }
+
+
+def write_report(report: Dict[str, Any], path: str) -> str:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """Print the stage timings and throughput of a run report."""
+    print("\n==== RUN REPORT ====")
+    print(f"Run {report['run_id']}: {report['employees']} employees in {report['duration_seconds']:.1f}s "
+          f"({report['employees_per_minute']:.1f} employees/min)")
+    print(f"Tokens: {report['tokens']['prompt_tokens']} prompt, {report['tokens']['completion_tokens']} completion")
+    print(f"{'stage':<18} {'count':>7} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stage in sorted(report["stages"].items(), key=lambda item: -item[1]["total_seconds"]):
+        print(f"{name:<18} {stage['count']:>7} {stage['errors']:>6} {stage['p50_seconds'] * 1000:>9.1f} "
+              f"{stage['p95_seconds'] * 1000:>9.1f} {stage['p99_seconds'] * 1000:>9.1f} {stage['max_seconds'] * 1000:>9.1f}")
+    if report["slowest_employees"]:
+        print("Slowest employees: " + ", ".join(f"{e['employee_id']} ({e['seconds']:.2f}s)" for e in report["slowest_employees"][:5]))
+
+
+# Process-wide tracer
+TRACER = Tracer()
@@ -0,0 +1,456 @@
+"""
+### work_leases.py ###
+
+Horizontal sharding of an agent run across processes and machines. The employee set is split
+into `num_shards` shards by a stable hash of employee_id (shard_for), and workers started with
+the same run id and shard count claim shards through expiring leases in a coordination store:
+
+    * SQLiteLeaseStore - one SQLite database, for worker processes on one machine
+    * FileLeaseStore   - one JSON file per shard in a (shared) directory, updated under an OS file
+                         lock (the share must support byte-range locks, e.g. SMB or NFSv4)
+    * CosmosLeaseStore - one control document per shard in the agent's Cosmos DB container
+                         (partition "agent_runs"), for workers on several machines
+
+A lease expires `ttl` seconds after it was last renewed; LeaseKeeper renews it in the
+background while the shard is processed. Workers keep claiming shards until every shard is
+done, so the shards of a worker that died are reclaimed once their lease has expired. A
+finished shard stores its processing summary, and rollup() adds the summaries of every
+finished shard up into the run's totals.
+
+Expiry uses wall-clock time, so hosts sharing a store need roughly synchronized clocks
+(well within the lease TTL).
+
+Usage:
+    store = open_lease_store("sqlite:agent_leases.sqlite3")
+    for lease in claim_shards(store, run_id, num_shards, worker_id):
+        with LeaseKeeper(store, lease) as keeper:
+            ...  # process employees where shard_for(employee_id, num_shards) == lease.shard
+            keeper.complete(summary)
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, NamedTuple, Optional
+
+from azure.cosmos import exceptions
+
+from run_journal import CONTROL_PARTITION_KEY
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# Seconds a lease stays valid without renewal
+DEFAULT_LEASE_TTL_SECONDS = float(os.getenv("AGENT_LEASE_TTL_SECONDS", "300"))
+DEFAULT_LEASE_STORE = os.getenv("AGENT_LEASE_STORE", "sqlite:agent_leases.sqlite3")
+
+
+def shard_for(employee_id, num_shards: int) -> int:
+    """Stable shard of an employee (the same in every process, unlike hash())."""
+    digest = hashlib.blake2b(str(employee_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % num_shards
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class Lease(NamedTuple):
+    run_id: str
+    shard: int
+    owner: str
+    token: str
+    expires_at: float
+    attempt: int
+    etag: Optional[str] = None
+
+
+def _acquirable(state: Optional[Dict[str, Any]], now: float) -> bool:
+    return state is None or (state["status"] != "done" and state["expires_at"] <= now)
+
+
+# -------------------------------
+# Lease stores
+# -------------------------------
+class SQLiteLeaseStore:
+    """Leases in a SQLite database (WAL mode), shared by worker processes on one machine."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def __str__(self) -> str:
+        return f"sqlite:{self.path}"
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS shard_leases (
+                    run_id TEXT NOT NULL,
+                    shard INTEGER NOT NULL,
+                    num_shards INTEGER NOT NULL,
+                    owner TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    summary TEXT,
+                    PRIMARY KEY (run_id, shard)
+                )
+            """)
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _state(row) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        return {"shard": row[0], "num_shards": row[1], "owner": row[2], "token": row[3], "expires_at": row[4],
+                "status": row[5], "attempts": row[6], "summary": json.loads(row[7]) if row[7] else None}
+
+    _COLUMNS = "shard, num_shards, owner, token, expires_at, status, attempts, summary"
+
+    def acquire(self, run_id: str, shard: int, num_shards: int, owner: str, ttl: float) -> Optional[Lease]:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            state = self._state(connection.execute(
+                f"SELECT {self._COLUMNS} FROM shard_leases WHERE run_id = ? AND shard = ?", (run_id, shard)).fetchone())
+            now = time.time()
+            if not _acquirable(state, now):
+                connection.execute("ROLLBACK")
+                return None
+            attempt = (state["attempts"] if state else 0) + 1
+            lease = Lease(run_id, shard, owner, uuid.uuid4().hex, now + ttl, attempt)
+            connection.execute(
+                "INSERT OR REPLACE INTO shard_leases VALUES (?, ?, ?, ?, ?, ?, 'leased', ?, NULL)",
+                (run_id, shard, num_shards, owner, lease.token, lease.expires_at, attempt))
+            connection.execute("COMMIT")
+            return lease
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def renew(self, lease: Lease, ttl: float) -> Optional[Lease]:
+        expires_at = time.time() + ttl
+        cursor = self._connection().execute(
+            "UPDATE shard_leases SET expires_at = ? WHERE run_id = ? AND shard = ? AND token = ? AND status = 'leased'",
+            (expires_at, lease.run_id, lease.shard, lease.token))
+        return lease._replace(expires_at=expires_at) if cursor.rowcount == 1 else None
+
+    def complete(self, lease: Lease, summary: Dict[str, Any]) -> bool:
+        cursor = self._connection().execute(
+            "UPDATE shard_leases SET status = 'done', summary = ? WHERE run_id = ? AND shard = ? AND token = ? AND status = 'leased'",
+            (json.dumps(summary), lease.run_id, lease.shard, lease.token))
+        return cursor.rowcount == 1
+
+    def shard_states(self, run_id: str) -> Dict[int, Dict[str, Any]]:
+        rows = self._connection().execute(
+            f"SELECT {self._COLUMNS} FROM shard_leases WHERE run_id = ?", (run_id,)).fetchall()
+        return {row[0]: self._state(row) for row in rows}
+
+
+class FileLeaseStore:
+    """Leases as JSON files (one per shard) in a directory, e.g. on a share mounted by every worker."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def __str__(self) -> str:
+        return f"file:{self.directory}"
+
+    def _path(self, run_id: str, shard: int) -> str:
+        return os.path.join(self.directory, run_id, f"shard-{shard:04d}.json")
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: str, state: Dict[str, Any]) -> None:
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    @contextmanager
+    def _locked(lock_path: str) -> Iterator[None]:
+        """Hold an exclusive OS lock on lock_path. The OS releases it if the worker dies, so the
+        lock file is never removed (removing it would let two workers lock different files)."""
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+        try:
+            if os.name == "nt":
+                while True:
+                    try:
+                        # LK_LOCK gives up after 10 one-second attempts
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+                try:
+                    yield
+                finally:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def _update(self, run_id: str, shard: int, update) -> Any:
+        """Run update(state) -> (new_state or None, result) while holding the shard's file lock."""
+        path = self._path(run_id, shard)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._locked(path + ".lock"):
+            new_state, result = update(self._read(path))
+            if new_state is not None:
+                self._write(path, new_state)
+            return result
+
+    def acquire(self, run_id: str, shard: int, num_shards: int, owner: str, ttl: float) -> Optional[Lease]:
+        def update(state):
+            now = time.time()
+            if not _acquirable(state, now):
+                return None, None
+            lease = Lease(run_id, shard, owner, uuid.uuid4().hex, now + ttl, (state["attempts"] if state else 0) + 1)
+            return {"shard": shard, "num_shards": num_shards, "owner": owner, "token": lease.token,
+                    "expires_at": lease.expires_at, "status": "leased", "attempts": lease.attempt, "summary": None}, lease
+        return self._update(run_id, shard, update)
+
+    def renew(self, lease: Lease, ttl: float) -> Optional[Lease]:
+        def update(state):
+            if not state or state["token"] != lease.token or state["status"] != "leased":
+                return None, None
+            state["expires_at"] = time.time() + ttl
+            return state, lease._replace(expires_at=state["expires_at"])
+        return self._update(lease.run_id, lease.shard, update)
+
+    def complete(self, lease: Lease, summary: Dict[str, Any]) -> bool:
+        def update(state):
+            if not state or state["token"] != lease.token or state["status"] != "leased":
+                return None, False
+            state.update(status="done", summary=summary)
+            return state, True
+        return self._update(lease.run_id, lease.shard, update)
+
+    def shard_states(self, run_id: str) -> Dict[int, Dict[str, Any]]:
+        directory = os.path.join(self.directory, run_id)
+        if not os.path.isdir(directory):
+            return {}
+        states = {}
+        for name in os.listdir(directory):
+            if name.startswith("shard-") and name.endswith(".json"):
+                state = self._read(os.path.join(directory, name))
+                if state:
+                    states[state["shard"]] = state
+        return states
+
+
+class CosmosLeaseStore:
+    """Leases as control documents in the agent's Cosmos DB container, claimed with ETag checks."""
+
+    def __init__(self, cosmos_db_manager):
+        self.cosmos_db_manager = cosmos_db_manager
+
+    def __str__(self) -> str:
+        return "cosmos"
+
+    @staticmethod
+    def _document_id(run_id: str, shard: int) -> str:
+        return f"lease-{run_id}-{shard:04d}"
+
+    def _patch(self, lease: Lease, operations) -> Optional[Dict[str, Any]]:
+        try:
+            return self.cosmos_db_manager.patch_item(self._document_id(lease.run_id, lease.shard),
+                                                     CONTROL_PARTITION_KEY, operations, etag=lease.etag)
+        except exceptions.CosmosAccessConditionFailedError:
+            return None
+
+    def acquire(self, run_id: str, shard: int, num_shards: int, owner: str, ttl: float) -> Optional[Lease]:
+        document_id = self._document_id(run_id, shard)
+        state = self.cosmos_db_manager.read_item(document_id, CONTROL_PARTITION_KEY)
+        now = time.time()
+        if not _acquirable(state, now):
+            return None
+        token = uuid.uuid4().hex
+        if state is None:
+            # create_item fails (returns None) if another worker created the lease first
+            document = self.cosmos_db_manager.create_item({
+                "id": document_id, "partitionKey": CONTROL_PARTITION_KEY, "type": "shard_lease",
+                "run_id": run_id, "shard": shard, "num_shards": num_shards, "owner": owner, "token": token,
+                "expires_at": now + ttl, "status": "leased", "attempts": 1, "summary": None
+            })
+        else:
+            # Take over an expired lease only if nobody else changed it since it was read
+            previous = Lease(run_id, shard, state["owner"], state["token"], state["expires_at"], state["attempts"], state["_etag"])
+            document = self._patch(previous, [
+                {"op": "set", "path": "/owner", "value": owner},
+                {"op": "set", "path": "/token", "value": token},
+                {"op": "set", "path": "/expires_at", "value": now + ttl},
+                {"op": "incr", "path": "/attempts", "value": 1}
+            ])
+        if not document:
+            return None
+        return Lease(run_id, shard, owner, token, document["expires_at"], document["attempts"], document.get("_etag"))
+
+    def renew(self, lease: Lease, ttl: float) -> Optional[Lease]:
+        expires_at = time.time() + ttl
+        document = self._patch(lease, [{"op": "set", "path": "/expires_at", "value": expires_at}])
+        return lease._replace(expires_at=expires_at, etag=document.get("_etag")) if document else None
+
+    def complete(self, lease: Lease, summary: Dict[str, Any]) -> bool:
+        return bool(self._patch(lease, [
+            {"op": "set", "path": "/status", "value": "done"},
+            {"op": "set", "path": "/summary", "value": summary}
+        ]))
+
+    def shard_states(self, run_id: str) -> Dict[int, Dict[str, Any]]:
+        query = ("SELECT * FROM c WHERE c.partitionKey = @partition_key AND c.type = 'shard_lease' "
+                 "AND c.run_id = @run_id")
+        documents = self.cosmos_db_manager.query_items(query, parameters=[
+            {"name": "@partition_key", "value": CONTROL_PARTITION_KEY},
+            {"name": "@run_id", "value": run_id}
+        ], partition_key=CONTROL_PARTITION_KEY)
+        return {document["shard"]: document for document in documents}
+
+
+def open_lease_store(spec: str = DEFAULT_LEASE_STORE, cosmos_db_manager=None):
+    """Lease store from "sqlite:<path>", "file:<directory>" or "cosmos"."""
+    kind, _, location = spec.partition(":")
+    if kind == "sqlite":
+        return SQLiteLeaseStore(location or "agent_leases.sqlite3")
+    if kind == "file":
+        return FileLeaseStore(location or "agent_leases")
+    if kind == "cosmos":
+        if cosmos_db_manager is None:
+            raise ValueError("The cosmos lease store needs a CosmosDBManager")
+        return CosmosLeaseStore(cosmos_db_manager)
+    raise ValueError(f"Unknown lease store: {spec}")
+
+
+# -------------------------------
+# Claiming and renewing shards
+# -------------------------------
+def acquire_next(store, run_id: str, num_shards: int, owner: str,
+                 ttl: float = DEFAULT_LEASE_TTL_SECONDS) -> Optional[Lease]:
+    """
+    Lease the next shard that is unclaimed or whose lease expired, or return None when there is none.
+
+    Workers start at different shards (by worker id) so they rarely contend for the same one.
+
+    :raises ValueError: If the run's shards were created with another shard count
+    """
+    states = store.shard_states(run_id)
+    for state in states.values():
+        if state["num_shards"] != num_shards:
+            raise ValueError(f"Run {run_id} is split into {state['num_shards']} shards, not {num_shards}")
+    now = time.time()
+    start = shard_for(owner, num_shards)
+    for offset in range(num_shards):
+        shard = (start + offset) % num_shards
+        if _acquirable(states.get(shard), now):
+            lease = store.acquire(run_id, shard, num_shards, owner, ttl)
+            if lease is not None:
+                return lease
+    return None
+
+
+def claim_shards(store, run_id: str, num_shards: int, owner: str,
+                 ttl: float = DEFAULT_LEASE_TTL_SECONDS) -> Iterator[Lease]:
+    """
+    Yield leases on the run's shards until every shard is done.
+
+    When the remaining shards are all leased by other workers, waits for them to finish or for
+    their leases to expire (their worker died), and reclaims the expired ones.
+    """
+    while True:
+        lease = acquire_next(store, run_id, num_shards, owner, ttl)
+        if lease is not None:
+            yield lease
+            continue
+        states = store.shard_states(run_id)
+        leased = [state for state in states.values() if state["status"] != "done"]
+        if not leased and len(states) == num_shards:
+            return
+        next_expiry = min((state["expires_at"] for state in leased), default=time.time())
+        time.sleep(min(ttl / 3, max(0.5, next_expiry - time.time())))
+
+
+class LeaseKeeper:
+    """Renews a lease every ttl/3 seconds in a background thread until the shard is completed."""
+
+    def __init__(self, store, lease: Lease, ttl: float = DEFAULT_LEASE_TTL_SECONDS):
+        self.store = store
+        self.lease = lease
+        self.ttl = ttl
+        self.lost = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{lease.shard}", daemon=True)
+
+    def __enter__(self) -> "LeaseKeeper":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            with self._lock:
+                if self.lost:
+                    return
+                try:
+                    renewed = self.store.renew(self.lease, self.ttl)
+                except Exception as e:
+                    # Keep trying until the lease would have expired anyway
+                    print(f"Error renewing lease of shard {self.lease.shard}: {e}")
+                    renewed = self.lease if time.time() < self.lease.expires_at else None
+                if renewed is None:
+                    print(f"Lost the lease of shard {self.lease.shard}; another worker may have reclaimed it")
+                    self.lost = True
+                else:
+                    self.lease = renewed
+
+    def complete(self, summary: Dict[str, Any]) -> bool:
+        """Mark the shard done with its summary; False if the lease was lost meanwhile."""
+        self._stop.set()
+        with self._lock:
+            if self.lost:
+                return False
+            return self.store.complete(self.lease, summary)
+
+
+def rollup(states: Dict[int, Dict[str, Any]], num_shards: int) -> Dict[str, Any]:
+    """Sum the summaries of the finished shards; also reports how many shards are not done."""
+    totals: Dict[str, Any] = {}
+    done = 0
+    for state in states.values():
+        if state["status"] != "done" or not state.get("summary"):
+            continue
+        done += 1
+        for key, value in state["summary"].items():
+            if isinstance(value, (int, float)):
+                totals[key] = totals.get(key, 0) + value
+    totals["shards_done"] = done
+    totals["shards_pending"] = num_shards - done
+    return totals